@@ -0,0 +1,343 @@
+"""Headless benchmark of calist.py's hot paths.
+
+Generates synthetic data (see generate_data.py) at one or more scales,
+drives the app through Streamlit's AppTest harness and times each
+interaction as a full script rerun, the way a user experiences it:
+
+    python benchmark.py --customers 1000 10000 100000 --repeat 5 --output benchmark_results.json
+    python benchmark.py --customers 10000 --baseline benchmark_results.json
+
+Only the open tab runs, so scenarios select the tab they exercise;
+AppTest cannot click tabs, it sets their session state before each run.
+AppTest also reruns the whole script where a browser would rerun just
+a fragment, so the call and history timings are upper bounds.
+Results are written as JSON; with ``--baseline`` the medians are
+compared and the exit status is 1 if any scenario regressed by more
+than ``--threshold``. Every data set, and the bundled sample book, is
+also checked for duplicate customers: the whole-book scan must list
+pairs, and the sample's known same-name pairs among them.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import generate_data
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILES = ["calist.py", "scorecards.py", "Logo-CMCB.png"]
+RM_CODE = "001"
+SEARCH_TERMS = ["sok", "phone repair", "chen", "grocery", "dara tan"]
+FUZZY_TERMS = ["sokk", "bophaa", "chenn", "piseht"]
+STATUS_VALUES = ["Pending", "Completed", "Missed", "New Lead"]
+SORT_VALUES = ["Name", "Last Contact", "Potential", "Status"]
+MAKE_CALLS_TAB = "📞 Make Calls"
+PERFORMANCE_TAB = "📊 Performance"
+SCORECARDS_TAB = "🏢 Branch Scorecards"
+HISTORY_TAB = "📞 Call History Lookup"
+CUSTOMER_LIST_TAB = "📋 Customer List"
+DUPLICATES_TAB = "🔁 Duplicates"
+SAMPLE_FILES = ["sample_customers.csv", "call_log.csv"]
+SAMPLE_DUPLICATES = {(1, 12), (9, 18), (10, 15)}  # same-name customer pairs in sample_customers.csv
+
+
+def prepare_workdir(customers, calls, rms, seed):
+    """Copy the app next to freshly generated data in a throwaway directory"""
+    workdir = tempfile.mkdtemp(prefix="calist-bench-")
+    for name in APP_FILES:
+        shutil.copy(os.path.join(BASE_DIR, name), workdir)
+    generate_data.generate(workdir, customers, calls, rms, seed=seed)
+    return workdir
+
+
+def prepare_sample_workdir():
+    """Copy the app next to the bundled sample data in a throwaway directory"""
+    workdir = tempfile.mkdtemp(prefix="calist-sample-")
+    for name in APP_FILES + SAMPLE_FILES:
+        shutil.copy(os.path.join(BASE_DIR, name), workdir)
+    return workdir
+
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(f"app raised: {at.exception[0].value}")
+    return at
+
+
+def timed(fn):
+    start = time.perf_counter()
+    check(fn())
+    return (time.perf_counter() - start) * 1000
+
+
+def login(app_path, timeout):
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    check(at.run())
+    at.text_input[0].input("bench")
+    at.text_input[1].input(RM_CODE)
+    return at
+
+
+def login_button(at):
+    return next(b for b in at.button if b.label.startswith("Login"))
+
+
+def open_tab(at, main_tab=None, customer_tab=None):
+    """Select tabs for the next run; AppTest falls back to the first tab otherwise"""
+    if main_tab:
+        at.session_state["main_tab"] = main_tab
+    if customer_tab:
+        at.session_state["customer_tab"] = customer_tab
+    return at
+
+
+def wait_for_rollups(at, timeout):
+    """Re-run the open tab until the background call rollup scan has finished"""
+    deadline = time.monotonic() + timeout
+    while any("Counting the whole call log" in info.value for info in at.info):
+        if time.monotonic() > deadline:
+            raise RuntimeError("call rollups were not ready in time")
+        time.sleep(0.2)
+        check(at.run())
+    return at
+
+
+def buttons(at, prefix):
+    return [b for b in at.button if b.key and b.key.startswith(prefix)]
+
+
+def run_scenarios(app_path, repeat, timeout):
+    """Returns {scenario: [milliseconds, ...]} for one data set"""
+    times = {}
+
+    def record(name, ms):
+        times.setdefault(name, []).append(ms)
+
+    at = login(app_path, timeout)
+    record("login_cold", timed(lambda: login_button(at).click().run()))
+    for _ in range(repeat):
+        other = login(app_path, timeout)
+        record("login_warm", timed(lambda: login_button(other).click().run()))
+
+    for i in range(repeat):
+        record("rerun", timed(lambda: at.run()))
+
+    search = at.text_input(key="search_main")
+    for i in range(repeat):
+        term = SEARCH_TERMS[i % len(SEARCH_TERMS)]
+        record("search", timed(lambda: search.input(term).run()))
+    at.checkbox(key="search_fuzzy").check()
+    for i in range(repeat):
+        term = FUZZY_TERMS[i % len(FUZZY_TERMS)]
+        record("search_fuzzy", timed(lambda: search.input(term).run()))
+    at.checkbox(key="search_fuzzy").uncheck()
+    check(search.input("").run())
+
+    for i in range(repeat):
+        value = STATUS_VALUES[i % len(STATUS_VALUES)]
+        record("filter_status", timed(lambda: at.selectbox(key="status_filter").set_value(value).run()))
+    check(at.selectbox(key="status_filter").set_value("All").run())
+    for i in range(repeat):
+        value = SORT_VALUES[i % len(SORT_VALUES)]
+        record("sort", timed(lambda: at.selectbox(key="sort_by").set_value(value).run()))
+    check(at.selectbox(key="sort_by").set_value("Relevance").run())
+
+    for i in range(repeat):
+        page_input = at.number_input(key="directory_page")
+        target = page_input.max if page_input.max and i % 2 == 0 else 1
+        record("page_jump", timed(lambda: page_input.set_value(target).run()))
+    check(at.number_input(key="directory_page").set_value(1).run())
+    record("compact_table", timed(lambda: at.radio(key="directory_view_mode").set_value("Compact table").run()))
+    check(at.radio(key="directory_view_mode").set_value("Cards").run())
+
+    for i in range(repeat):
+        history = buttons(at, "history_")
+        if not history:
+            break
+        check(history[i % len(history)].click().run())
+        record("history_open", timed(lambda: open_tab(at, customer_tab=HISTORY_TAB).run()))
+        more = buttons(at, "history_more_")
+        if more:
+            open_tab(at, customer_tab=HISTORY_TAB)
+            record("history_more", timed(more[0].click().run))
+        check(at.run())
+
+    for i in range(repeat):
+        calls = buttons(at, "call_")
+        if not calls:
+            break
+        record("call_select", timed(calls[i % len(calls)].click().run))
+        record("tab_make_calls", timed(lambda: open_tab(at, MAKE_CALLS_TAB).run()))
+        log_call = next(b for b in at.button if "Log Call" in b.label)
+        open_tab(at, MAKE_CALLS_TAB)
+        record("call_log", timed(log_call.click().run))
+        check(at.run())
+
+    # The call rollups are counted in the background from login; the first Performance run only
+    # waits for them if that scan is still going, later ones catch up with the calls just logged
+    record("rollups_cold", timed(lambda: open_tab(at, PERFORMANCE_TAB).run()))
+    wait_for_rollups(open_tab(at, PERFORMANCE_TAB), timeout)
+    check(at.run())
+    for i in range(repeat):
+        record("tab_performance", timed(lambda: open_tab(at, PERFORMANCE_TAB).run()))
+        check(at.run())
+
+    # Scorecards are counted from the rollups once per period and version
+    record("scorecards_cold", timed(lambda: open_tab(at, SCORECARDS_TAB).run()))
+    for i in range(repeat):
+        record("tab_scorecards", timed(lambda: open_tab(at, SCORECARDS_TAB).run()))
+
+    # The first Duplicates run indexes the book by blocking key and scans it; later ones reuse the scan
+    record("duplicates_cold", timed(lambda: open_tab(at, CUSTOMER_LIST_TAB, DUPLICATES_TAB).run()))
+    for i in range(repeat):
+        record("tab_duplicates", timed(lambda: open_tab(at, CUSTOMER_LIST_TAB, DUPLICATES_TAB).run()))
+    return times
+
+
+def check_duplicates(app_path, timeout, expected=()):
+    """Scan the whole book for duplicates; raises if it lists none, or misses an ``expected`` pair"""
+    at = login(app_path, timeout)
+    check(login_button(at).click().run())
+    check(open_tab(at, CUSTOMER_LIST_TAB, DUPLICATES_TAB).run())
+    open_tab(at, CUSTOMER_LIST_TAB, DUPLICATES_TAB)
+    check(at.radio(key="duplicate_scope").set_value("Whole book").run())
+    counts = at.session_state["rerun_last_event"]["counts"]
+    print(f"  duplicates      {counts['duplicate_pairs']:,} pairs, {counts['duplicate_split_blocks']:,} keys split, "
+          f"{counts['duplicate_fine_blocks']:,} split again by email, {counts['duplicate_skipped_blocks']:,} skipped",
+          flush=True)
+    if not counts['duplicate_pairs']:
+        raise RuntimeError("the duplicate scan found no pairs")
+    # Merge buttons are keyed merge_<keep>_<drop>, for pairs of the RM's own customers
+    listed = {tuple(sorted(int(part) for part in b.key.split("_")[1:])) for b in buttons(at, "merge_")}
+    missing = set(expected) - listed
+    if missing:
+        raise RuntimeError(f"the duplicate scan missed {sorted(missing)}")
+    return counts
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+    return {
+        "runs": len(samples),
+        "min_ms": round(ordered[0], 2),
+        "median_ms": round(statistics.median(ordered), 2),
+        "p95_ms": round(p95, 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against a previous run; returns the regressed scenarios"""
+    before = {(r["customers"], r["storage"], r["scenario"]): r["median_ms"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = before.get((r["customers"], r["storage"], r["scenario"]))
+        if not old:
+            continue
+        change = (r["median_ms"] - old) / old
+        flag = " REGRESSION" if change > threshold else ""
+        print(f"{r['customers']:>9,} {r['scenario']:<15} {old:>10.1f} -> {r['median_ms']:>10.1f} ms "
+              f"({change:+.0%}){flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, nargs="+", default=[1_000, 10_000],
+                        help="customer counts to benchmark (default 1000 10000)")
+    parser.add_argument("--calls-per-customer", type=int, default=5)
+    parser.add_argument("--rms", type=int, default=20, help="RM codes in the data; the benchmark logs in as 001")
+    parser.add_argument("--storage", choices=["csv", "sqlite"], default="csv")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per scenario (default 5)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds allowed per rerun")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression threshold (default 0.2 = 20%%)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated work directories")
+    args = parser.parse_args()
+
+    os.environ["CALL_SYSTEM_STORAGE"] = args.storage
+    workdir = prepare_sample_workdir()
+    os.environ["CALL_SYSTEM_DB"] = os.path.join(workdir, "call_system.db")
+    st.cache_resource.clear()
+    print(f"sample data ({args.storage}) in {workdir}", flush=True)
+    try:
+        check_duplicates(os.path.join(workdir, "calist.py"), args.timeout, SAMPLE_DUPLICATES)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = []
+    for customers in args.customers:
+        calls = customers * args.calls_per_customer
+        workdir = prepare_workdir(customers, calls, args.rms, args.seed)
+        os.environ["CALL_SYSTEM_DB"] = os.path.join(workdir, "call_system.db")
+        # Shared datasets, storage and writers are process-wide; start every scale cold
+        st.cache_resource.clear()
+        print(f"{customers:,} customers / {calls:,} calls ({args.storage}) in {workdir}", flush=True)
+        try:
+            times = run_scenarios(os.path.join(workdir, "calist.py"), args.repeat, args.timeout)
+            check_duplicates(os.path.join(workdir, "calist.py"), args.timeout)
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        for scenario, samples in times.items():
+            row = {"customers": customers, "calls": calls, "storage": args.storage, "scenario": scenario}
+            row.update(summarize(samples))
+            results.append(row)
+            print(f"  {scenario:<15} median {row['median_ms']:>10.1f} ms   p95 {row['p95_ms']:>10.1f} ms", flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "streamlit": st.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "rms": args.rms,
+            "peak_rss_mb": peak_rss_mb(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
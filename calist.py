@@ -1,10 +1,40 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import random
 from datetime import datetime, timedelta
 import time
 import csv
+import io
 import os
+import re
+import bisect
+import heapq
+import unicodedata
+import threading
+import atexit
+import tempfile
+import itertools
+import sqlite3
+import json
+import uuid
+import weakref
+import functools
+import contextlib
+import concurrent.futures
+import importlib.util
+import multiprocessing
+from collections import Counter, OrderedDict, deque
+
+import scorecards
+
+try:
+    import fcntl
+except ImportError:  # Windows: DataLock falls back to a thread lock
+    fcntl = None
+
+# Old call log partitions are compressed to Parquet only when pyarrow is installed
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
 
 # Page config
 st.set_page_config(page_title="Sales Call System", layout="wide", page_icon="📞")
@@ -80,77 +110,3879 @@ st.markdown("""
     background: linear-gradient(135deg, #2E8B57 0%, #3CB371 100%);
     background-attachment: fixed;
     }
-</style>
-""", unsafe_allow_html=True)
+</style>
+""", unsafe_allow_html=True)
+
+# Initialize session state
+if 'logged_in' not in st.session_state:
+    st.session_state.logged_in = False
+if 'current_user' not in st.session_state:
+    st.session_state.current_user = None
+if 'customers' not in st.session_state:
+    st.session_state.customers = []
+if 'call_log' not in st.session_state:
+    st.session_state.call_log = []
+if 'selected_customer' not in st.session_state:
+    st.session_state.selected_customer = None
+if 'view_customer_history' not in st.session_state:
+    st.session_state.view_customer_history = None
+
+# File paths
+
+# Get the folder where your main.py is
+BASE_DIR = os.path.dirname(__file__)
+
+# Relative path to the logo
+LOGO_PATH = os.path.join(BASE_DIR, "Logo-CMCB.png") 
+CUSTOMERS_FILE = os.path.join(BASE_DIR, "sample_customers.csv")
+CUSTOMER_JOURNAL_FILE = CUSTOMERS_FILE + ".journal"  # customer changes not yet folded into CUSTOMERS_FILE
+CALL_LOG_FILE = os.path.join(BASE_DIR, "call_log.csv")
+CALL_LOG_SEGMENT_DIR = os.path.join(BASE_DIR, "call_log_segments")
+CALL_LOG_DIR = os.path.join(BASE_DIR, "call_log")
+DATA_LOCK_FILE = os.path.join(BASE_DIR, "call_system.lock")
+SQLITE_FILE = os.environ.get("CALL_SYSTEM_DB", os.path.join(BASE_DIR, "call_system.db"))
+
+# Storage backend: "csv" (flat files, default) or "sqlite"
+STORAGE_BACKEND = os.environ.get("CALL_SYSTEM_STORAGE", "csv").lower()
+
+# Call log layout
+CALL_LOG_COLUMNS = ["customer_id", "customer", "date", "outcome", "notes"]
+CALL_LOG_BATCH_WINDOW = 0.02  # seconds the commit service waits to group concurrent call logs
+CALL_LOG_PARTITION_BY_RM = os.environ.get("CALL_SYSTEM_PARTITION_BY_RM", "0") == "1"  # split months per RM
+CALL_LOG_RECENT_MONTHS = 3  # months of calls every session loads; older months are read on request
+CALL_LOG_COMPRESS_AFTER_MONTHS = 3  # months kept as CSV before a partition is rewritten as Parquet
+CALL_LOG_CACHED_PARTITIONS = 12  # archived partitions kept indexed in memory for call history
+HISTORY_PAGE_SIZE = 10  # calls shown per "load more" step in the history panel
+RECENT_CALLS_SHOWN = 5  # calls listed under "Recent Call Log" on the Performance tab
+DIRECTORY_PAGE_SIZES = [10, 25, 50, 100]  # customers rendered per Customer Directory page
+
+# Next-best-call scoring: higher scores are called first
+CALL_QUEUE_POTENTIAL_POINTS = {"H": 30, "M": 20, "L": 10}
+CALL_QUEUE_STATUS_POINTS = {"Callback": 25, "New Lead": 20, "Pending": 15, "Missed": 12, "Completed": 0,
+                            "Not Interested": -50}
+CALL_QUEUE_CALLBACK_DUE_DAYS = 1  # a Callback without a due time scores as due this many days after the call
+CALL_QUEUE_DAY_POINTS = 0.3  # per day since last contact...
+CALL_QUEUE_MAX_DAYS = 90  # ...counting at most this many days (also used for unreadable dates)
+CALL_QUEUE_CALL_POINTS = 1.5  # deducted per earlier call, for up to 10 calls
+CALL_QUEUE_CALLED_TODAY_POINTS = 40  # deducted from customers already called today
+CALL_QUEUE_SKIP_POINTS = 100  # deducted from a customer skipped with Cancel, for this session
+CALL_QUEUE_PREVIEW = 5  # upcoming customers listed under the Next call button
+
+# Callback follow-ups
+CALLBACK_DEFAULT_HOURS = 24  # a Callback is due this long after the call unless the RM picks a time
+CALLBACK_POLL_SECONDS = 30  # how often the sidebar refreshes the due callback counts
+CALLBACKS_SHOWN = 5  # due callbacks listed on the Make Calls tab
+
+# Call rollups and branch scorecards
+CALL_SCAN_WORKERS = int(os.environ.get("CALL_SYSTEM_SCAN_WORKERS", "0")) or os.cpu_count() or 1  # call log scanners
+ROLLUP_COMPACT_ROWS = 5_000  # rollup rows folded in since the last merge before they are merged into the sorted counts
+SCORECARD_PERIODS = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All time": None}
+TREND_DEFAULT_DAYS = 30  # date range the Performance tab's call trends open with
+CALL_FUNNEL = [("Calls made", None), ("Reached", ["Completed", "Callback", "Not Interested"]),
+               ("Interested", ["Completed", "Callback"]), ("Completed", ["Completed"])]  # outcomes per stage
+
+# Customer fields
+CUSTOMER_COLUMNS = ["id", "name", "business", "phone", "email", "potential", "status",
+                    "last_contact", "call_count", "rm_code", "callback_due", "merged_into"]
+CUSTOMER_STATUSES = ["New Lead", "Pending", "Completed", "Missed", "Callback", "Not Interested"]
+IMPORT_CHUNK_ROWS = 10_000  # rows read, validated and written per bulk import batch
+CUSTOMER_FLUSH_SECONDS = 2.0  # queued customer changes are written at least this often
+CUSTOMER_FLUSH_BATCH = 500  # ...or as soon as this many customers are waiting
+CUSTOMER_JOURNAL_COMPACT_BYTES = 1_000_000  # journal size at which it's folded into the customer file
+CUSTOMER_WRITE_RETRIES = 3  # times a failed customer batch is retried before its writes are reported as failed
+SESSION_OVERLAY_MAX_EDITS = 500  # persisted edits a session keeps before it re-reads the shared snapshot
+
+# Duplicate customers
+DUPLICATE_MAX_BLOCK = 50  # customers sharing a blocking key beyond this are split by a second key
+DUPLICATE_MAX_SPLIT_BLOCK = 10  # ...split blocks bigger than this are split again by email
+DUPLICATE_PHONE_PREFIX_DIGITS = 6  # leading phone digits that split a common name or business
+DUPLICATE_MIN_PHONE_DIGITS = 6  # shorter phone keys are placeholders, not a blocking key
+DUPLICATE_WEIGHTS = {"phone": 0.5, "name": 0.35, "business": 0.15}  # pair score: same phone, name/business overlap
+DUPLICATE_MIN_SCORE = 0.5  # pairs scoring at least this are flagged as likely duplicates
+DUPLICATE_REVIEW_SCORE = 0.35  # ...and from this (a full name match alone) listed as possible duplicates to review
+DUPLICATE_BUSINESS_WORDS = {"shop", "store", "the", "and", "co", "ltd", "company", "enterprise"}  # ignored in keys
+DUPLICATE_PAIRS_SHOWN = 20  # pairs listed at once on the Duplicates tab
+DUPLICATE_MATCHES_SHOWN = 3  # existing customers listed when a new one looks like a duplicate
+
+# Simulated dialer
+DIALER_RING_SECONDS = (1.0, 4.0)  # how long the fake dialer rings before the outcome
+DIALER_ANSWER_RATE = 0.8  # share of simulated calls that get answered
+DIALER_POLL_SECONDS = 1  # how often the live call panel refreshes
+DIALER_KEEP_SECONDS = 3600  # forget finished calls after this long
+
+# Rerun instrumentation: one JSON line per script rerun, written only when CALL_SYSTEM_RERUN_LOG names a file
+RERUN_LOG_FILE = os.environ.get("CALL_SYSTEM_RERUN_LOG", "")
+RERUN_LOG_MAX_BYTES = 20_000_000  # the log is moved to <file>.1, replacing the previous one, past this size
+
+# Rerun instrumentation
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RerunTrace:
+    """Timings and counters for one script rerun.
+
+    Spans are inclusive wall-clock milliseconds and accumulate when the
+    same name is entered more than once; a tab's span contains the spans
+    of the work done inside it. Memory is the process-wide RSS delta, so
+    it also picks up whatever other sessions did meanwhile.
+    """
+
+    def __init__(self, session_id, trigger):
+        self.session_id = session_id
+        self.trigger = trigger
+        self.timestamp = datetime.now().isoformat(timespec="milliseconds")
+        self.spans = {}
+        self.counts = {}
+        self._started = time.perf_counter()
+        self._rss = current_rss()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def finish(self, rm_code, outcome):
+        """The rerun's event, as written to the log"""
+        rss = current_rss()
+        return {
+            "ts": self.timestamp,
+            "session": self.session_id,
+            "rm_code": rm_code,
+            "trigger": self.trigger,
+            "outcome": outcome,
+            "storage": STORAGE_BACKEND,
+            "total_ms": round((time.perf_counter() - self._started) * 1000, 2),
+            "spans_ms": {name: round(ms, 2) for name, ms in self.spans.items()},
+            "counts": self.counts,
+            "rss_mb": round(rss / 2**20, 1),
+            "rss_delta_kb": (rss - self._rss) // 1024,
+        }
+
+
+class RerunLog:
+    """Thread-safe JSONL sink shared by every session, rotated to one backup past ``max_bytes``"""
+
+    def __init__(self, path, max_bytes=RERUN_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    full = f.tell() >= self.max_bytes
+                if full:
+                    os.replace(self.path, self.path + ".1")
+            except OSError:
+                # Instrumentation must never take the app down with it
+                self.errors += 1
+
+
+@st.cache_resource
+def get_rerun_log():
+    return RerunLog(RERUN_LOG_FILE) if RERUN_LOG_FILE else None
+
+
+def widget_snapshot():
+    """Plain-valued session state, to tell which widget triggered the next rerun.
+
+    Only keyed widgets show up in session state; a rerun triggered by an
+    unkeyed one is logged with an empty trigger list.
+    """
+    return {key: value for key, value in st.session_state.items()
+            if not key.startswith("rerun_") and (value is None or isinstance(value, (str, int, float)))}
+
+
+def start_rerun_trace():
+    session_id = st.session_state.setdefault('rerun_session', uuid.uuid4().hex[:12])
+    before = st.session_state.get('rerun_widgets')
+    if before is None:
+        trigger = ["<session start>"]
+    elif st.session_state.get('rerun_requested'):
+        trigger = ["<st.rerun>"]
+    else:
+        # Widgets that merely appeared (still at a falsy default) or went away did not trigger anything
+        trigger = sorted(key for key, value in widget_snapshot().items()
+                         if (key in before and before[key] != value) or (key not in before and value))
+    st.session_state.rerun_trace = RerunTrace(session_id, trigger)
+    return st.session_state.rerun_trace
+
+
+def finish_rerun_trace(outcome):
+    """Write the rerun's event and remember widget values for the next trigger diff"""
+    trace = st.session_state.pop('rerun_trace', None)
+    if trace is None:
+        return None
+    event = trace.finish(st.session_state.get('rm_code'), outcome)
+    st.session_state.rerun_widgets = widget_snapshot()
+    st.session_state.rerun_requested = outcome == "rerun"
+    st.session_state.rerun_last_event = event
+    log = get_rerun_log()
+    if log is not None:
+        log.write(event)
+    return event
+
+
+def trace_span(name):
+    """Time a block against the current rerun; a no-op outside one (e.g. fragment reruns)"""
+    trace = st.session_state.get('rerun_trace')
+    return trace.span(name) if trace is not None else contextlib.nullcontext()
+
+
+def trace_count(name, value):
+    trace = st.session_state.get('rerun_trace')
+    if trace is not None:
+        trace.count(name, value)
+
+
+def traced(name):
+    """Decorator form of trace_span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def rerun_trace_panel(event):
+    """Sidebar breakdown of the rerun that just finished"""
+    with st.sidebar.expander("⏱️ Rerun timings", expanded=True):
+        st.caption(f"Trigger: {', '.join(event['trigger']) or 'none'} • {event['total_ms']:.0f} ms total")
+        if event['spans_ms']:
+            spans = pd.DataFrame(sorted(event['spans_ms'].items(), key=lambda item: -item[1]),
+                                 columns=["step", "ms"])
+            st.dataframe(spans, hide_index=True, width="stretch")
+        for name, value in event['counts'].items():
+            st.markdown(f"{name}: **{value:,}**")
+        st.caption(f"RSS {event['rss_mb']:,} MB ({event['rss_delta_kb']:+,} KB this rerun)")
+
+# Cross-process data lock
+class DataLock:
+    """Exclusive lock held by whoever writes the data files, in any server process.
+
+    Re-entrant within a thread. Across processes it is an ``flock`` on
+    ``path``; where fcntl is unavailable it only serializes threads, which
+    is enough for a single server process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                if self._fd is None:
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+@st.cache_resource
+def get_data_lock():
+    return DataLock(DATA_LOCK_FILE)
+
+
+# Month-partitioned call log
+def call_partition_key(date, rm_code=None):
+    """Partition of a call: its month ("2026-10"), optionally split per RM ("2026-10.001")"""
+    date = str(date or "")
+    month = date[:7] if re.match(r"\d{4}-\d{2}", date) else "undated"
+    return f"{month}.{rm_code}" if rm_code else month
+
+
+class PartitionedCallLog:
+    """Append-only call log stored as one partition per month.
+
+    With ``by_rm`` each month is further split per RM, taken from the
+    ``rm_code`` of the appended entries (calls themselves don't store it).
+    ``manifest.json`` lists every partition with its files, row count and
+    min/max call date, so ``read_frame(start, end)`` only opens the
+    partitions that overlap the range. New rows are appended to the
+    partition's CSV file; months older than ``compress_after`` months are
+    rewritten as one Parquet file when pyarrow is available, and a late
+    row for such a month starts a small CSV next to it. Each partition
+    also has a ``<key>.ids`` file holding the customer id of every row,
+    so per-customer reads can skip partitions without opening them.
+
+    All writes, and reads of the files, hold ``lock``, so server
+    processes sharing the directory never see a half-written partition.
+    On first use the old single-file log (plus its segments) is split into
+    partitions; the old files are left in place.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, root, columns, lock, by_rm=False, compress_after=CALL_LOG_COMPRESS_AFTER_MONTHS,
+                 legacy_files=()):
+        self.root = root
+        self.columns = list(columns)
+        self.by_rm = by_rm
+        self.compress_after = compress_after
+        self.legacy_files = legacy_files
+        self._lock = lock
+        self._manifest = None
+        self._manifest_signature = None
+        self._compressing = False
+        self.last_error = None
+        self.manifest_path = os.path.join(root, self.MANIFEST)
+        with self._lock:
+            if not os.path.exists(self.manifest_path):
+                self._migrate()
+
+    # -- public API -------------------------------------------------------
+    def append(self, row):
+        """Append a single call entry."""
+        self.append_many([row])
+
+    def append_many(self, rows):
+        """Append call entries to their partitions and fsync them."""
+        groups = {}
+        for row in rows:
+            key = call_partition_key(row.get('date'), row.get('rm_code') if self.by_rm else None)
+            groups.setdefault(key, []).append([row.get(col, "") for col in self.columns])
+        if not groups:
+            return
+        with self._lock:
+            manifest = self._load_manifest()
+            new_month = False
+            for key, values in groups.items():
+                entry = manifest['partitions'].get(key)
+                if entry is None:
+                    entry = manifest['partitions'][key] = self._new_entry(key)
+                    new_month = True
+                if entry['csv'] is None:
+                    entry['csv'] = key + ".csv"
+                self._write_rows(entry['csv'], values)
+                self._write_ids(key, [v[self.columns.index('customer_id')] for v in values])
+                self._count(entry, [v[self.columns.index('date')] for v in values])
+            self._save_manifest(manifest)
+        if new_month:
+            self.compress_in_background()
+
+    def partitions(self, start=None, end=None, rm_code=None):
+        """Manifest entries that can hold calls dated in [start, end), oldest month first.
+
+        ``rm_code`` only prunes when the log is split per RM.
+        """
+        with self._lock:
+            entries = list(self._load_manifest()['partitions'].values())
+        selected = []
+        for entry in entries:
+            if entry['rows'] and start is not None and (entry['max_date'] or "") < start:
+                continue
+            if entry['rows'] and end is not None and (entry['min_date'] or "") >= end:
+                continue
+            if rm_code is not None and self.by_rm and entry['rm_code'] not in (rm_code, None):
+                continue
+            selected.append(entry)
+        # Undated rows (very old logs) sort as the oldest partition
+        return sorted(selected, key=lambda e: (e['month'] != "undated", e['key']))
+
+    def read_partition(self, entry, csv_bytes=None):
+        """One partition as a DataFrame of strings, in write order.
+
+        With ``csv_bytes`` only that much of its CSV is read, and without
+        the lock: rows up to a size noted under the lock are complete.
+        """
+        frames = []
+        with self._lock if csv_bytes is None else contextlib.nullcontext():
+            if entry.get('parquet'):
+                frames.append(pd.read_parquet(os.path.join(self.root, entry['parquet'])))
+            if entry.get('csv'):
+                path = os.path.join(self.root, entry['csv'])
+                if csv_bytes is not None:
+                    with open(path, "rb") as f:
+                        data = f.read(csv_bytes)
+                    if data:
+                        frames.append(pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False))
+                elif os.path.exists(path) and os.path.getsize(path) > 0:
+                    frames.append(pd.read_csv(path, dtype=str, keep_default_na=False))
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return frame.reindex(columns=self.columns, fill_value="").fillna("").astype(str)
+
+    def customer_ids(self, entry):
+        """Customer id of every row of a partition, as strings ("" for calls logged without one).
+
+        Read from the partition's id file; a missing or short one (logs
+        written before id files, or a crash between the two appends) is
+        rebuilt from the partition.
+        """
+        with self._lock:
+            entry = self._load_manifest()['partitions'].get(entry['key'], entry)
+            path = os.path.join(self.root, entry['key'] + ".ids")
+            ids = None
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                ids = pd.read_csv(path, header=None, names=['customer_id'], dtype=str,
+                                  keep_default_na=False)['customer_id']
+            if ids is None or len(ids) != entry['rows']:
+                ids = self.read_partition(entry)['customer_id']
+                tmp = path + ".tmp"
+                with open(tmp, "w", newline="", encoding="utf-8") as f:
+                    csv.writer(f).writerows([i] for i in ids.tolist())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+        return ids
+
+    def read_frame(self, start=None, end=None, rm_code=None):
+        """Calls dated in [start, end) (``YYYY-MM-DD`` strings), reading only the overlapping partitions"""
+        frames = []
+        for entry in self.partitions(start, end, rm_code):
+            frame = self.read_partition(entry)
+            # Partitions straddling a bound are filtered row by row
+            if start is not None and (entry['min_date'] or "") < start:
+                frame = frame[frame['date'] >= start]
+            if end is not None and (entry['max_date'] or "") >= end:
+                frame = frame[frame['date'] < end]
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def read_since(self, marks):
+        """(rows appended since ``marks``, new marks), or None when a partition lost rows.
+
+        ``marks`` maps partition keys to (rows, CSV name, CSV inode, CSV
+        size) as a scan left them (see scorecards.read_task). A CSV that only
+        grew is read from its old end; a partition compressed or restarted
+        since is re-read and its first ``rows`` rows skipped.
+        """
+        frames, new_marks = [], {}
+        with self._lock:
+            for key, entry in self._load_manifest()['partitions'].items():
+                rows, csv_name, csv_inode, csv_size = marks.get(key, (0, None, None, 0))
+                if entry['rows'] < rows:
+                    return None
+                path = os.path.join(self.root, entry['csv']) if entry['csv'] else None
+                stat = os.stat(path) if path is not None and os.path.exists(path) else None
+                new_marks[key] = (entry['rows'], entry['csv'], stat.st_ino if stat else None,
+                                  stat.st_size if stat else 0)
+                if entry['rows'] == rows:
+                    continue
+                frame = None
+                if stat is not None and (entry['csv'], stat.st_ino) == (csv_name, csv_inode) and csv_size:
+                    frame = self._read_csv_tail(path, csv_size)
+                    if len(frame) != entry['rows'] - rows:
+                        frame = None
+                if frame is None:
+                    frame = self.read_partition(entry).iloc[rows:]
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=self.columns), new_marks
+        calls = pd.concat(frames, ignore_index=True)
+        return calls.reindex(columns=self.columns, fill_value="").fillna("").astype(str), new_marks
+
+    def files(self):
+        """Changes on every write, so it doubles as the SharedDataset source"""
+        return [self.manifest_path]
+
+    def stats(self):
+        entries = self.partitions()
+        return {"partitions": len(entries), "rows": sum(e['rows'] for e in entries),
+                "compressed": sum(1 for e in entries if e.get('parquet'))}
+
+    def compress_in_background(self):
+        if not PARQUET_AVAILABLE or self.compress_after is None:
+            return
+        with self._lock:
+            if self._compressing:
+                return
+            self._compressing = True
+        threading.Thread(target=self._compress_old, name="call-log-compressor", daemon=True).start()
+
+    # -- internals --------------------------------------------------------
+    def _new_entry(self, key):
+        month, _, rm_code = key.partition(".")
+        return {"key": key, "month": month, "rm_code": rm_code or None, "csv": None, "parquet": None,
+                "rows": 0, "min_date": None, "max_date": None}
+
+    def _count(self, entry, dates):
+        entry['rows'] += len(dates)
+        dates = [d for d in dates if d]
+        if dates:
+            low, high = min(dates), max(dates)
+            entry['min_date'] = low if entry['min_date'] is None else min(entry['min_date'], low)
+            entry['max_date'] = high if entry['max_date'] is None else max(entry['max_date'], high)
+
+    def _write_rows(self, name, values):
+        path = os.path.join(self.root, name)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(self.columns)
+            writer.writerows(values)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_ids(self, key, ids):
+        with open(os.path.join(self.root, key + ".ids"), "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([i] for i in ids)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_csv_tail(self, path, offset):
+        """Rows of a partition CSV written after byte ``offset``, under its header"""
+        with open(path, "rb") as f:
+            header = next(csv.reader([f.readline().decode("utf-8")]), [])
+            f.seek(offset)
+            tail = f.read()
+        if not tail.strip():
+            return pd.DataFrame(columns=header)
+        return pd.read_csv(io.BytesIO(tail), header=None, names=header, dtype=str, keep_default_na=False)
+
+    def _load_manifest(self):
+        """Cached manifest, re-read when another process has replaced it"""
+        stat = os.stat(self.manifest_path)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature != self._manifest_signature:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self._manifest = json.load(f)
+            self._manifest_signature = signature
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+        stat = os.stat(self.manifest_path)
+        self._manifest = manifest
+        self._manifest_signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _migrate(self):
+        """Split the single-file call log into partitions (runs once, under the lock)"""
+        os.makedirs(self.root, exist_ok=True)
+        manifest = {"version": 1, "created": datetime.now().isoformat(timespec="seconds"),
+                    "by_rm": self.by_rm, "partitions": {}}
+        calls = read_call_files(self.legacy_files, self.columns)
+        if len(calls):
+            months = calls['date'].str.slice(0, 7).where(calls['date'].str.match(r"\d{4}-\d{2}"), "undated")
+            keys = months
+            if self.by_rm:
+                rm_codes = self._legacy_rm_codes(calls)
+                keys = months.where(rm_codes == "", months + "." + rm_codes)
+            for key, rows in calls.groupby(keys, sort=True):
+                entry = manifest['partitions'][key] = self._new_entry(key)
+                entry['csv'] = key + ".csv"
+                self._write_rows(entry['csv'], rows[self.columns].values.tolist())
+                self._write_ids(key, rows['customer_id'].tolist())
+                self._count(entry, rows['date'].tolist())
+            manifest['migrated_from'] = [os.path.basename(p) for p in self.legacy_files if os.path.exists(p)]
+        self._save_manifest(manifest)
+        self.compress_in_background()
+
+    def _legacy_rm_codes(self, calls):
+        """RM of each old call through its customer id, or "" when unknown"""
+        customers = apply_customer_journal(
+            pd.read_csv(CUSTOMERS_FILE, dtype=str, usecols=['id', 'rm_code'], keep_default_na=False),
+            read_customer_journal(dtype=str, usecols=['id', 'rm_code'], keep_default_na=False))
+        rm_by_id = dict(zip(customers['id'], customers['rm_code']))
+        return calls['customer_id'].map(rm_by_id).fillna("")
+
+    def _compress_old(self):
+        """Rewrite CSV partitions of months before the cutoff as Parquet, one partition at a time.
+
+        The month is read and written without the lock; the lock is only
+        held to note the CSV's size and for the swap, which is given up
+        when a late call has reached the month meanwhile.
+        """
+        try:
+            cutoff = month_start(self.compress_after)[:7]
+            for entry in self.partitions():
+                if entry['month'] >= cutoff or not entry['csv']:
+                    continue
+                with self._lock:
+                    # Re-read: another process may have compressed it meanwhile
+                    current = self._load_manifest()['partitions'].get(entry['key'])
+                    if current is None or not current['csv']:
+                        continue
+                    current = dict(current)
+                    csv_bytes = os.path.getsize(os.path.join(self.root, current['csv']))
+                frame = self.read_partition(current, csv_bytes)
+                name = current['key'] + ".parquet"
+                # Written unlocked, so a name of its own: another process may be compressing too
+                tmp = os.path.join(self.root, f"{name}.{uuid.uuid4().hex}.tmp")
+                frame.to_parquet(tmp, index=False, compression="zstd")
+                with self._lock:
+                    manifest = self._load_manifest()
+                    latest = manifest['partitions'].get(current['key'])
+                    path = os.path.join(self.root, current['csv'])
+                    if latest != current or not os.path.exists(path) or os.path.getsize(path) != csv_bytes:
+                        os.remove(tmp)
+                        continue
+                    os.replace(tmp, os.path.join(self.root, name))
+                    manifest['partitions'][current['key']].update(csv=None, parquet=name)
+                    self._save_manifest(manifest)
+                    os.remove(path)
+        except Exception as e:
+            # The CSV stays authoritative; the next new month tries again
+            self.last_error = e
+        finally:
+            with self._lock:
+                self._compressing = False
+
+
+def month_start(months_back=0):
+    """First day of the month ``months_back`` months before this one, as YYYY-MM-DD"""
+    today = datetime.now()
+    index = today.year * 12 + today.month - 1 - months_back
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+
+@st.cache_resource
+def get_call_log():
+    """Process-wide partitioned call log shared by every session."""
+    return PartitionedCallLog(CALL_LOG_DIR, CALL_LOG_COLUMNS, get_data_lock(), by_rm=CALL_LOG_PARTITION_BY_RM,
+                              legacy_files=legacy_call_log_files())
+
+
+def read_call_files(paths, columns=CALL_LOG_COLUMNS):
+    """Concatenate call log CSV files, mapping older layouts onto ``columns``"""
+    frames = [pd.read_csv(path, dtype=str, keep_default_na=False).reindex(columns=columns, fill_value="")
+              for path in paths if os.path.exists(path) and os.path.getsize(path) > 0]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def legacy_call_log_files():
+    """The single-file call log and its rolled-over segments, oldest first"""
+    segments = []
+    if os.path.isdir(CALL_LOG_SEGMENT_DIR):
+        segments = sorted(os.path.join(CALL_LOG_SEGMENT_DIR, n) for n in os.listdir(CALL_LOG_SEGMENT_DIR)
+                          if n.startswith("segment-") and n.endswith(".csv"))
+    return segments + [CALL_LOG_FILE]
+
+# Shared, process-wide parsed datasets
+class SharedDataset:
+    """Parse a dataset once per process and hand the same records to every session.
+
+    The parsed records are reused until one of the source files changes
+    mtime or size or ``key()`` (if given) returns something new. Records
+    are shared between sessions and must be treated as read-only;
+    ``peek()`` returns the last parsed ones without looking at the
+    sources. ``stats()`` counts parses and reuses for the rerun trace.
+    """
+
+    def __init__(self, name, sources, parse, key=None):
+        self.name = name
+        self._sources = sources
+        self._parse = parse
+        self._key = key
+        self._lock = threading.Lock()
+        self._signature = None
+        self._records = None
+        self._loaded_at = None
+        self._loaded_key = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def signature(self):
+        files = []
+        for path in self._sources():
+            try:
+                stat = os.stat(path)
+                files.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                files.append((path, None, None))
+        return (self._key() if self._key else None, tuple(files))
+
+    def get(self):
+        with self._lock:
+            signature = self.signature()
+            if self._records is not None and signature == self._signature:
+                self.hits += 1
+                return self._records
+            if self._records is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            # Taken before reading, so any write acknowledged earlier is in the records
+            loaded_at = time.monotonic()
+            self._records = self._parse()
+            self._signature = signature
+            self._loaded_at = loaded_at
+            self._loaded_key = signature[0]
+            self.version += 1
+            return self._records
+
+    def peek(self):
+        """(records, version, load start time, key) of the last parse; records is None before the first get()"""
+        with self._lock:
+            return self._records, self.version, self._loaded_at, self._loaded_key
+
+    def stats(self):
+        return {"name": self.name, "version": self.version, "hits": self.hits,
+                "misses": self.misses, "reloads": self.reloads}
+
+
+def parse_customers():
+    # The journal is read before the file: compaction replaces the file first, so no change is ever missed
+    journal = read_customer_journal(dtype={"rm_code": str, "phone": str})
+    frame = pd.read_csv(CUSTOMERS_FILE, dtype={"rm_code": str, "phone": str})
+    return customer_frame(apply_customer_journal(frame, journal))
+
+
+def read_customer_journal(size=None, **read_csv_args):
+    """Rows of the customer journal (its first ``size`` bytes), or None; a half-written last line is left out"""
+    try:
+        with open(CUSTOMER_JOURNAL_FILE, "rb") as f:
+            data = f.read() if size is None else f.read(size)
+    except FileNotFoundError:
+        return None
+    data = data[:data.rfind(b"\n") + 1]
+    if data.count(b"\n") < 2:
+        return None
+    return pd.read_csv(io.BytesIO(data), **read_csv_args)
+
+
+def apply_customer_journal(frame, journal):
+    """Customers with journal rows applied: the last row per id wins, and customers keep their place"""
+    if journal is None or not len(journal):
+        return frame
+    combined = pd.concat([frame, journal], ignore_index=True)
+    first_seen = combined.groupby('id', sort=False).ngroup().to_numpy()
+    latest = combined.drop_duplicates('id', keep='last')
+    order = np.argsort(first_seen[latest.index.to_numpy()], kind='stable')
+    return latest.iloc[order].reset_index(drop=True)
+
+
+def parse_call_log(start=None):
+    return call_records(get_call_log().read_frame(start))
+
+
+def call_records(frame):
+    calls = frame.to_dict('records')
+    for call in calls:
+        customer_id = str(call.get('customer_id', ''))
+        call['customer_id'] = int(customer_id) if customer_id.isdigit() else None
+    return calls
+
+
+# Storage backends
+class CsvStorage:
+    """Flat-file storage: the customer CSV plus the append-only call log.
+
+    Every write holds the DataLock, so server processes sharing the files
+    take turns instead of overwriting each other. Customer writes are
+    appended to a journal next to the customer CSV; the journal is folded
+    into the CSV in the background once it grows, and the lock is only
+    held for the final swap, so call appends never wait on a rewrite of
+    the whole book.
+    """
+
+    name = "csv"
+    supports_queries = False
+
+    def __init__(self):
+        self._lock = get_data_lock()
+        self._file_next_id = None
+        self._compacting = False
+        self.compactions = 0
+        self.last_error = None
+
+    def customer_sources(self):
+        return [CUSTOMERS_FILE, CUSTOMER_JOURNAL_FILE]
+
+    def call_sources(self):
+        return get_call_log().files()
+
+    def load_customers(self):
+        return parse_customers()
+
+    def load_calls(self, start=None):
+        return parse_call_log(start)
+
+    def append_calls(self, calls):
+        get_call_log().append_many(calls)
+
+    def call_scan_tasks(self, start=None):
+        """Independent pieces of the call log from ``start`` on, one per partition, for scan workers"""
+        log = get_call_log()
+        return [("partition", log.manifest_path, entry['key'], DATA_LOCK_FILE) for entry in log.partitions(start)]
+
+    def call_watermark(self, marks):
+        """Where a full scan stopped, from the marks its tasks returned"""
+        return {mark[1]: mark[2:] for mark in marks}
+
+    def read_new_calls(self, watermark):
+        """(calls appended since ``watermark``, new watermark), or None if the log was rewritten"""
+        return get_call_log().read_since(watermark)
+
+    def reserve_customer_ids(self, count):
+        """Ids for new customers from a counter file shared by every process.
+
+        The counter never falls behind the customer file's highest id,
+        which is scanned once per process.
+        """
+        counter = CUSTOMERS_FILE + ".next_id"
+        with self._lock:
+            if self._file_next_id is None:
+                self._file_next_id = 1
+                for chunk in pd.read_csv(CUSTOMERS_FILE, usecols=['id'], chunksize=IMPORT_CHUNK_ROWS):
+                    if len(chunk):
+                        self._file_next_id = max(self._file_next_id, int(chunk['id'].max()) + 1)
+                journal = read_customer_journal(usecols=['id'])
+                if journal is not None and len(journal):
+                    self._file_next_id = max(self._file_next_id, int(journal['id'].max()) + 1)
+            start = self._file_next_id
+            if os.path.exists(counter):
+                with open(counter, encoding="utf-8") as f:
+                    start = max(start, int(f.read().strip() or 0))
+            with open(counter + ".tmp", "w", encoding="utf-8") as f:
+                f.write(str(start + count))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(counter + ".tmp", counter)
+            return range(start, start + count)
+
+    def insert_customers(self, records):
+        """Journal new customers in one write, assigning their ids"""
+        for record, customer_id in zip(records, self.reserve_customer_ids(len(records))):
+            record['id'] = customer_id
+        self.save_customers(records)
+        return records
+
+    def save_customers(self, records):
+        """Insert or update customers by id with one fsynced append to the customer journal"""
+        with self._lock:
+            if self._journal_header() not in (None, CUSTOMER_COLUMNS):
+                # Written before the customer columns changed; fold it in before appending new-style rows
+                self.compact_customers()
+            with open(CUSTOMER_JOURNAL_FILE, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if f.tell() == 0:
+                    writer.writerow(CUSTOMER_COLUMNS)
+                writer.writerows([["" if r.get(c) is None else r.get(c) for c in CUSTOMER_COLUMNS] for r in records])
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+        if size >= CUSTOMER_JOURNAL_COMPACT_BYTES:
+            self.compact_in_background()
+
+    def compact_in_background(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_and_clear, name="customer-compactor", daemon=True).start()
+
+    def compact_customers(self):
+        """Fold the journal into the customer file; False if another process changed them meanwhile.
+
+        The new file is written without the DataLock; the lock is held to
+        note where the journal ends and again for the swap, which carries
+        the journal rows appended in between over to a fresh journal.
+        """
+        with self._lock:
+            journal_bytes = os.path.getsize(CUSTOMER_JOURNAL_FILE) if os.path.exists(CUSTOMER_JOURNAL_FILE) else 0
+            signature = self._file_signature()
+        if not journal_bytes:
+            return True
+        journal = read_customer_journal(journal_bytes, dtype=str, keep_default_na=False)
+        frame = apply_customer_journal(pd.read_csv(CUSTOMERS_FILE, dtype=str, keep_default_na=False), journal)
+        header = list(frame.columns)
+        header += [c for c in CUSTOMER_COLUMNS if c not in header]
+        # Written unlocked, so a name of its own: another compaction may be writing too
+        tmp = f"{CUSTOMERS_FILE}.{uuid.uuid4().hex}.tmp"
+        self._write_durably(tmp, lambda f: frame.reindex(columns=header).to_csv(f, index=False))
+        with self._lock:
+            current = os.path.getsize(CUSTOMER_JOURNAL_FILE) if os.path.exists(CUSTOMER_JOURNAL_FILE) else 0
+            if self._file_signature() != signature or current < journal_bytes:
+                os.remove(tmp)
+                return False
+            with open(CUSTOMER_JOURNAL_FILE, "rb") as f:
+                head = f.readline()
+                f.seek(journal_bytes)
+                tail = f.read()
+            # The file first: a reader takes the journal before the file, so it never misses a change
+            os.replace(tmp, CUSTOMERS_FILE)
+            self._write_durably(CUSTOMER_JOURNAL_FILE + ".tmp", lambda f: f.write(head.decode("utf-8")
+                                                                                  + tail.decode("utf-8")))
+            os.replace(CUSTOMER_JOURNAL_FILE + ".tmp", CUSTOMER_JOURNAL_FILE)
+            self.compactions += 1
+        return True
+
+    def _compact_and_clear(self):
+        try:
+            self.compact_customers()
+        except Exception as e:
+            # The journal stays authoritative; the next growing append tries again
+            self.last_error = e
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def _journal_header(self):
+        """Header row of the customer journal, or None when there is no journal yet"""
+        if not os.path.exists(CUSTOMER_JOURNAL_FILE) or not os.path.getsize(CUSTOMER_JOURNAL_FILE):
+            return None
+        with open(CUSTOMER_JOURNAL_FILE, newline="", encoding="utf-8") as f:
+            return next(csv.reader(f), None)
+
+    @staticmethod
+    def _file_signature():
+        stat = os.stat(CUSTOMERS_FILE)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _write_durably(path, write):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class CustomerQuery:
+    """Lazily evaluated, paginated customer query; behaves like a list for len() and slicing"""
+
+    def __init__(self, storage, where, params, order_by):
+        self._storage = storage
+        self._where = where
+        self._params = params
+        self._order_by = order_by
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            row = self._storage.fetchone(f"SELECT COUNT(*) FROM customers WHERE {self._where}", self._params)
+            self._count = row[0]
+        return self._count
+
+    def __getitem__(self, page):
+        if not isinstance(page, slice):
+            raise TypeError("CustomerQuery only supports slicing")
+        start = page.start or 0
+        stop = len(self) if page.stop is None else page.stop
+        if stop <= start:
+            return []
+        return self._storage.fetch_customers(
+            f"WHERE {self._where} ORDER BY {self._order_by} LIMIT ? OFFSET ?",
+            self._params + [stop - start, start])
+
+
+class SqliteStorage:
+    """Embedded SQLite storage in WAL mode.
+
+    Several Streamlit server processes can share one database file:
+    readers never block the writer and writers wait on ``busy_timeout``.
+    On first use the tables are filled from the existing CSV files.
+    """
+
+    name = "sqlite"
+    supports_queries = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            business TEXT,
+            phone TEXT,
+            phone_key TEXT,
+            email TEXT,
+            potential TEXT,
+            status TEXT,
+            last_contact TEXT,
+            call_count INTEGER NOT NULL DEFAULT 0,
+            rm_code TEXT,
+            callback_due TEXT,
+            merged_into TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_customers_rm_code ON customers (rm_code);
+        CREATE INDEX IF NOT EXISTS idx_customers_phone_key ON customers (phone_key);
+        CREATE TABLE IF NOT EXISTS calls (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            customer TEXT,
+            date TEXT,
+            outcome TEXT,
+            notes TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_calls_customer_id ON calls (customer_id, seq);
+        CREATE INDEX IF NOT EXISTS idx_calls_date ON calls (date);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+    SORT_ORDERS = {
+        "Name": "name, id",
+        "Last Contact": "last_contact DESC, id",
+        "Potential": "CASE potential WHEN 'H' THEN 1 WHEN 'M' THEN 2 WHEN 'L' THEN 3 ELSE 4 END, id",
+        "Status": ("CASE status WHEN 'New Lead' THEN 1 WHEN 'Pending' THEN 2 WHEN 'Completed' THEN 3 "
+                   "WHEN 'Missed' THEN 4 WHEN 'Callback' THEN 5 WHEN 'Not Interested' THEN 6 ELSE 7 END, id"),
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(self.SCHEMA)
+        self._add_missing_columns()
+        self._migrate_from_csv()
+
+    # -- plumbing ---------------------------------------------------------
+    def fetchone(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def fetch_customers(self, clause="", params=()):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(CUSTOMER_COLUMNS)} FROM customers {clause}", params).fetchall()
+        # Drop NULLs so optional fields (e.g. email) behave like missing CSV columns
+        return [{k: row[k] for k in row.keys() if row[k] is not None} for row in rows]
+
+    def _write(self, sql, rows):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return cursor
+
+    def _customer_row(self, record):
+        row = [record.get(col) for col in CUSTOMER_COLUMNS]
+        return row + [normalize_phone(record.get('phone'))]
+
+    def _add_missing_columns(self):
+        """Columns added to the schema after a database was created"""
+        with self._lock:
+            existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(customers)")}
+            if "callback_due" not in existing:
+                self._conn.execute("ALTER TABLE customers ADD COLUMN callback_due TEXT")
+            if "merged_into" not in existing:
+                self._conn.execute("ALTER TABLE customers ADD COLUMN merged_into TEXT")
+
+    def _migrate_from_csv(self):
+        """One-shot import of the CSV files the first time the database is opened"""
+        if self.fetchone("SELECT value FROM meta WHERE key = 'migrated_from_csv'"):
+            return
+        customers = parse_customers().to_dict('records')
+        if os.path.exists(CALL_LOG_DIR):
+            calls = parse_call_log()
+        else:
+            calls = call_records(read_call_files(legacy_call_log_files()))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have migrated while we waited for the write lock
+                if not self._conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_csv'").fetchone():
+                    self._conn.executemany(self._upsert_customer_sql(), [self._customer_row(c) for c in customers])
+                    self._conn.executemany(self._insert_calls_sql(),
+                                           [[c.get(col) for col in CALL_LOG_COLUMNS] for c in calls])
+                    self._conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_csv', ?)",
+                                       (datetime.now().isoformat(timespec="seconds"),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _upsert_customer_sql(self):
+        columns = CUSTOMER_COLUMNS + ["phone_key"]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "id")
+        return (f"INSERT INTO customers ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}")
+
+    def _insert_calls_sql(self):
+        return f"INSERT INTO calls ({', '.join(CALL_LOG_COLUMNS)}) VALUES ({', '.join('?' * len(CALL_LOG_COLUMNS))})"
+
+    # -- storage API ------------------------------------------------------
+    def customer_sources(self):
+        return [self.path, self.path + "-wal"]
+
+    call_sources = customer_sources
+
+    def load_customers(self):
+        with self._lock:
+            frame = pd.read_sql_query(
+                f"SELECT {', '.join(CUSTOMER_COLUMNS)} FROM customers ORDER BY id", self._conn)
+        return customer_frame(frame)
+
+    def load_calls(self, start=None):
+        with self._lock:
+            # idx_calls_date keeps a recent window cheap however long the history gets
+            where, params = ("WHERE date >= ?", (start,)) if start else ("", ())
+            rows = self._conn.execute(
+                f"SELECT {', '.join(CALL_LOG_COLUMNS)} FROM calls {where} ORDER BY seq", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def append_calls(self, calls):
+        self._write(self._insert_calls_sql(),
+                    [[c.get(col) for col in CALL_LOG_COLUMNS] for c in calls])
+
+    def call_scan_tasks(self, start=None):
+        """One task per month of calls from ``start`` on; workers open their own read-only connections"""
+        # Every task stops at the same call, so calls logged during the scan are read once, later
+        through = self.fetchone("SELECT COALESCE(MAX(seq), 0) FROM calls")[0]
+        first = self.fetchone("SELECT min(date) FROM calls WHERE date >= ?", (start or "0",))[0]
+        last = self.fetchone("SELECT max(date) FROM calls")[0]
+        bounds = [start or ""]
+        if first and last:
+            # idx_calls_date answers min() and max() directly; months in between are cut at the 1st
+            month, end = int(first[:4]) * 12 + int(first[5:7]), int(last[:4]) * 12 + int(last[5:7]) - 1
+            for index in range(month, end + 1):
+                bounds.append(f"{index // 12:04d}-{index % 12 + 1:02d}-01")
+        return [("sqlite", self.path, low, high, through) for low, high in zip(bounds, bounds[1:] + [None])]
+
+    def call_watermark(self, marks):
+        """Where a full scan stopped: the last call sequence number it read"""
+        return max((mark[1] for mark in marks), default=0)
+
+    def read_new_calls(self, watermark):
+        """(calls after sequence number ``watermark``, new watermark), or None if calls were removed"""
+        with self._lock:
+            through = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM calls").fetchone()[0]
+            if through < watermark:
+                return None
+            calls = pd.read_sql_query(
+                f"SELECT {', '.join(CALL_LOG_COLUMNS)} FROM calls WHERE seq > ? AND seq <= ? ORDER BY seq",
+                self._conn, params=(watermark, through), dtype=str)
+        return calls.fillna(""), through
+
+    def reserve_customer_ids(self, count):
+        """Ids for new customers from a counter in meta, so processes never collide.
+
+        Reserved ids may be written later (see CommitService), so
+        ids are never taken from the table's current maximum alone.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_customer_id'").fetchone()
+                top = self._conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM customers").fetchone()[0]
+                start = max(int(row[0]) if row else 1, top)
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('next_customer_id', ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (str(start + count),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return range(start, start + count)
+
+    def insert_customers(self, records):
+        """Insert new customers in one transaction, assigning their ids"""
+        for record, customer_id in zip(records, self.reserve_customer_ids(len(records))):
+            record['id'] = customer_id
+        self.save_customers(records)
+        return records
+
+    def save_customers(self, records):
+        """Insert or update customers by id in one transaction"""
+        self._write(self._upsert_customer_sql(), [self._customer_row(r) for r in records])
+
+    def query_customers(self, rm_code, search="", status=None, potential=None, sort_by="Name"):
+        """Filtered, sorted customer query evaluated one page at a time"""
+        # Customers merged into another one stay in the table only to carry their calls
+        where, params = ["rm_code = ?", "COALESCE(merged_into, '') = ''"], [rm_code]
+        terms = search_tokens(search)
+        for term in terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(lower(name) LIKE ? ESCAPE '\\' OR lower(business) LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if potential:
+            where.append("potential = ?")
+            params.append(potential)
+        if sort_by == "Relevance" and terms:
+            # Names starting with the first search word come first
+            prefix = terms[0].replace("%", "").replace("_", "") + "%"
+            order_by = f"CASE WHEN lower(name) LIKE {sqlite_quote(prefix)} THEN 0 ELSE 1 END, name, id"
+        else:
+            order_by = self.SORT_ORDERS.get(sort_by, self.SORT_ORDERS["Name"])
+        return CustomerQuery(self, " AND ".join(where), params, order_by)
+
+    # -- call history, same contract as CallHistoryIndex --------------------
+    def count(self, customer_id):
+        return self.fetchone("SELECT COUNT(*) FROM calls WHERE customer_id = ?", (customer_id,))[0]
+
+    def page(self, customer_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Same contract as CallHistoryIndex.page; the cursor is a call sequence number"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seq, {', '.join(CALL_LOG_COLUMNS)} FROM calls WHERE customer_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (customer_id, cursor if cursor is not None else 2 ** 63 - 1, limit + 1)).fetchall()
+        calls = [dict(row) for row in rows[:limit]]
+        return calls, (calls[-1]['seq'] if len(rows) > limit else None)
+
+
+def sqlite_quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+@st.cache_resource
+def get_storage():
+    """Process-wide storage backend selected by CALL_SYSTEM_STORAGE"""
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    return CsvStorage()
+
+
+# Single-writer commit service
+class CommitService:
+    """The one thread in this process that writes to storage.
+
+    Sessions submit mutations and get a ``concurrent.futures.Future``
+    back as their acknowledgement; the thread commits them in batches,
+    in submission order, under the storage backend's own cross-process
+    locking (DataLock for the CSV files, ``BEGIN IMMEDIATE`` for SQLite).
+
+    - ``submit_calls()``: call entries that arrive within
+      ``batch_window`` of each other are group-committed with one append
+      and one fsync; every submitter's future resolves once that write is
+      durable, or fails with its exception.
+    - ``save_customer()``: only the latest version of a customer is kept;
+      pending customers are written together every ``flush_seconds``, or
+      as soon as ``max_pending`` are waiting. A failed batch stays queued
+      and is retried with the next one, up to ``max_retries`` times; then
+      its futures fail with the error.
+    - ``insert_customers()``: bulk inserts are committed as they come.
+
+    ``flush()`` blocks until everything submitted so far is committed,
+    and ``close()`` flushes and stops the thread.
+    """
+
+    def __init__(self, storage, batch_window=CALL_LOG_BATCH_WINDOW,
+                 flush_seconds=CUSTOMER_FLUSH_SECONDS, max_pending=CUSTOMER_FLUSH_BATCH,
+                 max_retries=CUSTOMER_WRITE_RETRIES):
+        self._storage = storage
+        self._batch_window = batch_window
+        self._flush_seconds = flush_seconds
+        self._max_pending = max_pending
+        self._max_retries = max_retries
+        self._cond = threading.Condition()
+        self._calls = []  # (entries, future)
+        self._inserts = []  # (records, future)
+        self._customers = {}  # id -> latest record
+        self._customer_futures = []
+        self._in_flight = []  # futures of the batch being written right now
+        self._calls_since = None
+        self._customers_since = None
+        self._customer_failures = 0  # failed attempts of the batch being retried
+        self._force = False
+        self._closing = False
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="commit-service", daemon=True)
+        self._thread.start()
+
+    # -- submission -------------------------------------------------------
+    def submit_calls(self, calls):
+        """Queue call entries; the future resolves once they are durable"""
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._check_open()
+            if self._calls_since is None:
+                self._calls_since = time.monotonic()
+            self._calls.append(([dict(c) for c in calls], future))
+            self._cond.notify_all()
+        return future
+
+    def save_customer(self, record):
+        """Queue the current version of a customer"""
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._check_open()
+            if not self._customers:
+                self._customers_since = time.monotonic()
+            self._customers[record.get('id')] = dict(record)
+            self._customer_futures.append(future)
+            if len(self._customers) in (1, self._max_pending):
+                # Arm the flush timer, or flush right away when the batch is full
+                self._cond.notify_all()
+        return future
+
+    def insert_customer(self, record):
+        """Queue a new customer; returns it with the id it will be stored under, and its future"""
+        record = dict(record, id=self._storage.reserve_customer_ids(1)[0])
+        return record, self.save_customer(record)
+
+    def insert_customers(self, records):
+        """Queue a batch of new customers; the future resolves to the stored records"""
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._check_open()
+            self._inserts.append((records, future))
+            self._cond.notify_all()
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far is committed; False on timeout"""
+        with self._cond:
+            futures = ([f for _, f in self._calls] + [f for _, f in self._inserts]
+                       + self._customer_futures + self._in_flight)
+            if not futures:
+                return True
+            self._force = True
+            self._cond.notify_all()
+        _, not_done = concurrent.futures.wait(futures, timeout)
+        return not not_done
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    # -- writer thread ----------------------------------------------------
+    def _check_open(self):
+        if self._closing:
+            raise RuntimeError("commit service is closed")
+
+    def _due(self, now):
+        """Seconds until the next batch is due, or 0 when one is due now"""
+        if self._closing or self._force or self._inserts or len(self._customers) >= self._max_pending:
+            return 0
+        waits = []
+        if self._calls:
+            waits.append(self._calls_since + self._batch_window - now)
+        if self._customers:
+            waits.append(self._customers_since + self._flush_seconds - now)
+        return max(min(waits), 0) if waits else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    wait = self._due(time.monotonic())
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+                calls, self._calls, self._calls_since = self._calls, [], None
+                inserts, self._inserts = self._inserts, []
+                take_customers = bool(self._customers) and (
+                    self._closing or self._force or len(self._customers) >= self._max_pending
+                    or time.monotonic() >= self._customers_since + self._flush_seconds)
+                customers, futures = {}, []
+                if take_customers:
+                    customers, self._customers = self._customers, {}
+                    futures, self._customer_futures = self._customer_futures, []
+                    self._customers_since = None
+                self._force = False
+                closing = self._closing
+                self._in_flight = [f for _, f in calls] + [f for _, f in inserts] + futures
+            if calls:
+                self._commit_calls(calls)
+            for records, future in inserts:
+                self._commit(future, self._storage.insert_customers, records)
+            if customers and not self._commit_customers(customers, futures):
+                with self._cond:
+                    self._customer_failures += 1
+                    retry = not closing and self._customer_failures <= self._max_retries
+                    if retry:
+                        # Retry with the next batch; anything newer for the same customer wins
+                        for customer_id, record in customers.items():
+                            self._customers.setdefault(customer_id, record)
+                        self._customer_futures = futures + self._customer_futures
+                        if self._customers_since is None:
+                            self._customers_since = time.monotonic()
+                    else:
+                        # Give up on this batch; edits queued since get attempts of their own
+                        self._customer_failures = 0
+                    if closing:
+                        self._fail_customers(self.last_error)
+                if not retry:
+                    for future in futures:
+                        future.set_exception(self.last_error)
+            with self._cond:
+                self._in_flight = []
+            if closing:
+                return
+
+    def _commit_calls(self, calls):
+        try:
+            self._storage.append_calls([entry for entries, _ in calls for entry in entries])
+        except Exception as e:
+            self.last_error = e
+            for _, future in calls:
+                future.set_exception(e)
+            return
+        for entries, future in calls:
+            future.set_result(len(entries))
+
+    def _commit(self, future, fn, *args):
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            self.last_error = e
+            future.set_exception(e)
+
+    def _commit_customers(self, customers, futures):
+        try:
+            self._storage.save_customers(list(customers.values()))
+        except Exception as e:
+            self.last_error = e
+            return False
+        self._customer_failures = 0
+        for future in futures:
+            future.set_result(None)
+        return True
+
+    def _fail_customers(self, error):
+        """Called on close: give up on customers that could not be written"""
+        for future in self._customer_futures:
+            future.set_exception(error)
+        self._customers, self._customer_futures = {}, []
+
+
+@st.cache_resource
+def get_commit_service():
+    """Process-wide commit service, flushed at interpreter exit"""
+    service = CommitService(get_storage())
+    atexit.register(service.close)
+    return service
+
+
+@st.cache_resource
+def get_customer_dataset():
+    storage = get_storage()
+    return SharedDataset("customers", storage.customer_sources,
+                         lambda: CustomerTable(storage.load_customers()))
+
+
+@st.cache_resource
+def get_call_log_dataset():
+    """The last CALL_LOG_RECENT_MONTHS months of calls; re-read when the window moves"""
+    storage = get_storage()
+    return SharedDataset("call_log", storage.call_sources, lambda: storage.load_calls(recent_calls_start()),
+                         key=recent_calls_start)
+
+
+def recent_calls_start():
+    return month_start(CALL_LOG_RECENT_MONTHS - 1)
+
+
+def normalize_phone(phone):
+    """Lookup key for a phone number: digits only, without +855 or the trunk 0"""
+    digits = re.sub(r"\D", "", str(phone or ""))
+    if digits.startswith("855"):
+        digits = digits[3:]
+    return digits.lstrip("0")
+
+
+def normalize_phones(phones):
+    """Vectorized normalize_phone over a Series"""
+    digits = phones.fillna("").astype(str).str.replace(r"\D", "", regex=True)
+    digits = digits.where(~digits.str.startswith("855"), digits.str[3:])
+    return digits.str.lstrip("0")
+
+
+def customer_frame(df):
+    """Normalize a raw customer DataFrame into the columnar customer model.
+
+    Every customer column is present, blanks get their defaults,
+    status/potential/rm_code are categoricals and ``phone_key`` holds
+    the normalized phone used for lookups.
+    """
+    df = df.copy()
+    # Ensure required fields exist; files padded by bulk import may hold blanks
+    defaults = {'rm_code': "001", 'call_count': 0, 'last_contact': datetime.now().strftime("%Y-%m-%d"),
+                'email': "", 'name': "", 'business': "", 'phone': "", 'status': "", 'potential': "",
+                'callback_due': ""}
+    for column, default in defaults.items():
+        df[column] = df[column].fillna(default) if column in df else default
+    df['id'] = df['id'].astype('int64')
+    # The id of the customer this one was merged into, as text; blank for live customers
+    merged_into = pd.to_numeric(df['merged_into'], errors='coerce') if 'merged_into' in df else np.nan
+    merged_into = pd.Series(merged_into, index=df.index).astype('Int64')
+    df['merged_into'] = merged_into.astype('string').fillna("").astype(str)
+    df['call_count'] = df['call_count'].astype('int64')
+    for column in ('name', 'business', 'phone', 'email', 'last_contact', 'callback_due'):
+        df[column] = df[column].astype(str)
+    df['rm_code'] = df['rm_code'].astype(str).astype('category')
+    statuses = CUSTOMER_STATUSES + sorted(set(df['status'].astype(str)) - set(CUSTOMER_STATUSES))
+    df['status'] = pd.Categorical(df['status'].astype(str), categories=statuses)
+    potentials = ["H", "M", "L"] + sorted(set(df['potential'].astype(str)) - {"H", "M", "L"})
+    df['potential'] = pd.Categorical(df['potential'].astype(str), categories=potentials)
+    df['phone_key'] = normalize_phones(df['phone'])
+    extras = [c for c in df.columns if c not in CUSTOMER_COLUMNS and c != 'phone_key']
+    return df[CUSTOMER_COLUMNS + extras + ['phone_key']].reset_index(drop=True)
+
+
+# Columnar customer snapshot
+class CustomerTable:
+    """Read-only columnar customer snapshot with its lookup indexes.
+
+    Built once per dataset version and shared by every session: a hash
+    index on id, row positions per rm_code and a sorted phone-key array
+    for O(log n) phone lookups. Customers merged into another one are
+    left out; ``merged_into`` maps each of their ids to the surviving
+    customer and ``merged_children`` lists the ids merged directly into
+    a customer.
+    """
+
+    def __init__(self, frame):
+        merged = (frame['merged_into'] != "").to_numpy()
+        links = dict(zip(frame['id'][merged].tolist(), frame['merged_into'][merged].astype(int).tolist()))
+        self.merged_children = {}
+        for alias, survivor in links.items():
+            self.merged_children.setdefault(survivor, []).append(alias)
+        self.merged_into = {}
+        for alias in links:
+            # Follow merges of merges to the customer that is still live
+            survivor, seen = links[alias], {alias}
+            while survivor in links and survivor not in seen:
+                seen.add(survivor)
+                survivor = links[survivor]
+            self.merged_into[alias] = survivor
+        if merged.any():
+            frame = frame[~merged].reset_index(drop=True)
+        self.frame = frame
+        self.id_index = pd.Index(frame['id'])
+        self.rm_positions = frame.groupby('rm_code', observed=True).indices
+        keys = frame['phone_key'].to_numpy(dtype=object)
+        self._phone_order = np.argsort(keys, kind='stable')
+        self._phone_sorted = keys[self._phone_order]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def position(self, customer_id):
+        try:
+            return self.id_index.get_loc(customer_id)
+        except (KeyError, TypeError):
+            return None
+
+    def phone_positions(self, phone_key):
+        start = np.searchsorted(self._phone_sorted, phone_key, side='left')
+        stop = np.searchsorted(self._phone_sorted, phone_key, side='right')
+        return self._phone_order[start:stop]
+
+    def rows(self, positions):
+        """Materialize rows as plain dicts (native Python values, no phone_key)"""
+        return self.frame.iloc[positions].drop(columns='phone_key').to_dict('records')
+
+
+class CustomerFrameView:
+    """Filtered customer frame that behaves like a list for len() and slicing.
+
+    Only the requested slice is turned into row dicts.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getitem__(self, page):
+        if not isinstance(page, slice):
+            raise TypeError("CustomerFrameView only supports slicing")
+        return self.frame.iloc[page].drop(columns='phone_key').to_dict('records')
+
+
+# Indexed customer store
+class CustomerStore:
+    """A session's view of the customers: the shared CustomerTable plus local edits.
+
+    Updated and newly added customers live in a small per-session
+    overlay keyed by id; lookups check the overlay first and fall back to
+    the shared snapshot, which is never modified. ``rebase()`` moves the
+    store onto a newer snapshot and drops the edits whose writes were
+    acknowledged before it was read, so the overlay only holds what the
+    shared snapshot doesn't have yet. Customers merged into another one
+    in this session stay gettable by id but drop out of every listing.
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._overlay = {}
+        self._writes = {}  # customer id -> [record being written, time its write was acknowledged]
+        self._failed = {}  # customer id -> error of its last failed write; kept across rebase()
+
+    def __len__(self):
+        size = len(self._table)
+        for customer_id, record in self._overlay.items():
+            known = self._table.position(customer_id) is not None
+            if known and record.get('merged_into'):
+                size -= 1
+            elif not known and not record.get('merged_into'):
+                size += 1
+        return size
+
+    def __iter__(self):
+        """Every record as a dict; avoid on hot paths"""
+        for record in self._table.rows(slice(None)):
+            record = self._overlay.get(record['id'], record)
+            if not record.get('merged_into'):
+                yield record
+        for record in self.added():
+            yield record
+
+    @property
+    def table(self):
+        return self._table
+
+    def get(self, customer_id):
+        if customer_id in self._overlay:
+            return self._overlay[customer_id]
+        position = self._table.position(customer_id)
+        return self._table.rows([position])[0] if position is not None else None
+
+    def frame(self, rm_code=None):
+        """Columnar customers (optionally for one RM) with this session's edits applied"""
+        table = self._table
+        if rm_code is None:
+            base = table.frame
+        else:
+            base = table.frame.take(table.rm_positions.get(rm_code, []))
+        if not self._overlay:
+            return base
+        edits = [r for r in self._overlay.values()
+                 if (rm_code is None or r.get('rm_code') == rm_code) and not r.get('merged_into')]
+        base = base[~base['id'].isin(list(self._overlay))]
+        if not edits:
+            return base
+        return pd.concat([base, customer_frame(pd.DataFrame(edits))], ignore_index=True)
+
+    def phone_keys(self):
+        keys = set(self._table.frame['phone_key'])
+        keys.update(normalize_phone(r.get('phone')) for r in self._overlay.values())
+        return keys
+
+    def find_by_phone(self, phone, rm_code=None):
+        """First customer whose phone matches, ignoring formatting and country prefix"""
+        key = normalize_phone(phone)
+        for record in self._overlay.values():
+            if record.get('merged_into'):
+                continue
+            if normalize_phone(record.get('phone')) == key and (rm_code is None or record.get('rm_code') == rm_code):
+                return record
+        for position in self._table.phone_positions(key):
+            record = self._table.rows([position])[0]
+            if record['id'] in self._overlay:
+                continue
+            if rm_code is None or record.get('rm_code') == rm_code:
+                return record
+        return None
+
+    def add(self, record):
+        if self.get(record.get('id')) is not None:
+            raise ValueError(f"Customer id {record.get('id')} already exists")
+        self._overlay[record.get('id')] = record
+        return record
+
+    def update(self, customer_id, **changes):
+        current = self.get(customer_id)
+        if current is None:
+            return None
+        updated = dict(current)
+        updated.update(changes)
+        self._overlay[customer_id] = updated
+        return updated
+
+    def track_write(self, record, future):
+        """Note the pending write of an edited record; acknowledged on the commit thread"""
+        write = self._writes[record.get('id')] = [record, None]
+        failed = self._failed
+
+        def done(f):
+            if f.exception() is None:
+                write[1] = time.monotonic()
+                failed.pop(record.get('id'), None)
+            else:
+                failed[record.get('id')] = f.exception()
+        future.add_done_callback(done)
+
+    def failed_writes(self):
+        """{customer id: error} of edits that storage gave up on; they stay in this session only"""
+        return dict(self._failed)
+
+    def edits(self, rm_code=None):
+        """(snapshot record or None if added, edited record) for each overlay entry"""
+        for customer_id, record in list(self._overlay.items()):
+            if rm_code is None or record.get('rm_code') == rm_code:
+                position = self._table.position(customer_id)
+                yield (self._table.rows([position])[0] if position is not None else None), record
+
+    def edit_count(self):
+        return len(self._overlay)
+
+    def added(self):
+        return [r for i, r in self._overlay.items() if self._table.position(i) is None and not r.get('merged_into')]
+
+    def merged(self):
+        """Ids this session merged into another customer"""
+        return [i for i, r in self._overlay.items() if r.get('merged_into')]
+
+    def merged_ids(self, customer_id):
+        """Ids of the customers merged into ``customer_id``, directly or through earlier merges"""
+        children = {}
+        for alias, record in self._overlay.items():
+            if record.get('merged_into'):
+                children.setdefault(int(record['merged_into']), []).append(alias)
+        found, pending = [], [customer_id]
+        while pending:
+            current = pending.pop()
+            for alias in self._table.merged_children.get(current, []) + children.get(current, []):
+                if alias not in found and alias != customer_id:
+                    found.append(alias)
+                    pending.append(alias)
+        return found
+
+    def unpersisted_edits(self):
+        """Overlay entries whose current version isn't acknowledged by storage yet"""
+        return sum(1 for i, r in self._overlay.items() if self._persisted_at(i, r) is None)
+
+    def persisted_edits(self):
+        return sum(1 for i, r in self._overlay.items() if self._persisted_at(i, r) is not None)
+
+    def rebase(self, table, loaded_at):
+        """A store over ``table`` (read from ``loaded_at`` on) keeping only the edits it may lack"""
+        store = CustomerStore(table)
+        store._failed = self._failed
+        for customer_id, record in self._overlay.items():
+            persisted = self._persisted_at(customer_id, record)
+            if persisted is None or persisted >= loaded_at:
+                store._overlay[customer_id] = record
+                if customer_id in self._writes:
+                    store._writes[customer_id] = self._writes[customer_id]
+        return store
+
+    def _persisted_at(self, customer_id, record):
+        write = self._writes.get(customer_id)
+        # A write of an older version of the record doesn't cover the current one
+        return write[1] if write is not None and write[0] is record else None
+
+
+# Per-customer call history
+class CallHistoryIndex:
+    """Call entries grouped by customer id, oldest first within each customer.
+
+    ``page()`` serves the newest calls first; the returned cursor is the
+    position to continue from, so reading a page never touches other
+    customers' rows.
+    """
+
+    def __init__(self, calls=(), resolve_id=None):
+        self._by_customer = {}
+        for call in calls:
+            customer_id = call.get('customer_id')
+            if customer_id is None and resolve_id is not None:
+                customer_id = resolve_id(call)
+            if customer_id is not None:
+                self.add(call, customer_id)
+
+    def add(self, call, customer_id=None):
+        if customer_id is None:
+            customer_id = call.get('customer_id')
+        self._by_customer.setdefault(customer_id, []).append(call)
+
+    def count(self, customer_id):
+        return len(self._by_customer.get(customer_id, ()))
+
+    def page(self, customer_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Return (calls newest first, cursor for the next page or None)"""
+        calls = self._by_customer.get(customer_id, [])
+        end = len(calls) if cursor is None else cursor
+        start = max(0, end - limit)
+        return calls[start:end][::-1], (start or None)
+
+
+class SessionCallLog:
+    """A session's call log: the shared snapshot's calls plus the ones it logged since.
+
+    Same ``page()``/``count()`` contract as CallHistoryIndex. The session's
+    own calls are the newest, so pages serve them first and then continue
+    into the shared index. ``rebase()`` drops own calls that are persisted
+    and already in the newer snapshot.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._own = []  # (call, rm_code, write future)
+        self._history = CallHistoryIndex()
+
+    def __len__(self):
+        return len(self._snapshot.calls) + len(self._own)
+
+    def append(self, call, rm_code, future):
+        self._own.append((call, rm_code, future))
+        self._history.add(call)
+
+    def own_calls(self, rm_code):
+        return [call for call, call_rm, _ in self._own if call_rm == rm_code]
+
+    def persisted_calls(self):
+        return sum(1 for _, _, future in self._own if self._persisted(future))
+
+    def count(self, customer_id):
+        return self._snapshot.history.count(customer_id) + self._history.count(customer_id)
+
+    def page(self, customer_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Return (calls newest first, cursor for the next page or None)"""
+        shared = self._snapshot.history
+        tier, position = cursor if cursor is not None else (0, None)
+        calls = []
+        if tier == 0:
+            calls, position = self._history.page(customer_id, limit, position)
+            if position is not None:
+                return calls, (0, position)
+            if len(calls) == limit:
+                return calls, ((1, None) if shared.count(customer_id) else None)
+        page, position = shared.page(customer_id, limit - len(calls), position)
+        return calls + page, (None if position is None else (1, position))
+
+    def rebase(self, snapshot):
+        """The same log over ``snapshot``, without own calls it already holds"""
+        log = SessionCallLog(snapshot)
+        held = self._held_in(snapshot)
+        for call, rm_code, future in self._own:
+            key = self._call_key(call)
+            if self._persisted(future) and held[key]:
+                # One snapshot call stands for one own call, so two alike calls need two
+                held[key] -= 1
+                continue
+            log.append(call, rm_code, future)
+        return log
+
+    def _held_in(self, snapshot):
+        """Snapshot calls per (customer, minute, outcome), only as far back as the persisted own calls go"""
+        since = {}
+        for call, _, future in self._own:
+            if self._persisted(future):
+                customer_id, date = call.get('customer_id'), str(call.get('date') or "")
+                since[customer_id] = min(since.get(customer_id, date), date)
+        held = Counter()
+        for customer_id, oldest in since.items():
+            cursor = None
+            while True:
+                calls, cursor = snapshot.history.page(customer_id, HISTORY_PAGE_SIZE, cursor)
+                held.update(self._call_key(c) for c in calls if str(c.get('date') or "") >= oldest)
+                # Pages run newest first, so the rest are older than any own call
+                if cursor is None or (calls and str(calls[-1].get('date') or "") < oldest):
+                    break
+        return held
+
+    @staticmethod
+    def _call_key(call):
+        # Calls have no id; a customer's call at the same minute with the same outcome is alike
+        return call.get('customer_id'), call.get('date'), call.get('outcome')
+
+    @staticmethod
+    def _persisted(future):
+        return future.done() and future.exception() is None
+
+
+class ArchivedCallHistory:
+    """Per-customer indexes of call log partitions, built on first use.
+
+    Shared by every session; the ``max_partitions`` most recently used
+    stay in memory. An index is rebuilt when its partition's files change
+    (a late call, compression). Per-customer call counts of every
+    partition come from its id file and are all kept, so partitions
+    without the customer are never opened.
+    """
+
+    def __init__(self, log, max_partitions=CALL_LOG_CACHED_PARTITIONS):
+        self._log = log
+        self._max_partitions = max_partitions
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # partition key -> (files signature, CallHistoryIndex)
+        self._counts = {}  # partition key -> (rows, sorted customer ids, their call counts, calls without an id)
+        self.builds = 0
+
+    def partitions(self, before, rm_code=None):
+        """Partitions of months before ``before`` (a YYYY-MM-DD month start), newest first"""
+        entries = self._log.partitions(end=before, rm_code=rm_code)
+        return [e for e in reversed(entries) if e['month'] < before[:7] or e['month'] == "undated"]
+
+    def cached(self, entry):
+        with self._lock:
+            cached = self._indexes.get(entry['key'])
+            if cached is None or cached[0] != self._signature(entry):
+                return None
+            self._indexes.move_to_end(entry['key'])
+            return cached[1]
+
+    def index(self, entry, resolve_id=None):
+        index = self.cached(entry)
+        if index is not None:
+            return index
+        index = CallHistoryIndex(call_records(self._log.read_partition(entry)), resolve_id)
+        with self._lock:
+            self.builds += 1
+            self._indexes[entry['key']] = (self._signature(entry), index)
+            self._indexes.move_to_end(entry['key'])
+            while len(self._indexes) > self._max_partitions:
+                self._indexes.popitem(last=False)
+        return index
+
+    def count(self, entry, customer_id):
+        """Calls of the customer in a partition, or None when some of its calls have no customer id"""
+        with self._lock:
+            counts = self._counts.get(entry['key'])
+        if counts is None or counts[0] != entry['rows']:
+            ids = pd.to_numeric(self._log.customer_ids(entry), errors='coerce')
+            known, calls = np.unique(ids.dropna().to_numpy(dtype=np.int64), return_counts=True)
+            counts = (entry['rows'], known, calls, int(ids.isna().sum()))
+            with self._lock:
+                self._counts[entry['key']] = counts
+        _, known, calls, unknown = counts
+        if unknown:
+            # Calls from before ids were logged are only matched by name in the index
+            index = self.cached(entry)
+            return None if index is None else index.count(customer_id)
+        position = np.searchsorted(known, customer_id)
+        return int(calls[position]) if position < len(known) and known[position] == customer_id else 0
+
+    @staticmethod
+    def _signature(entry):
+        return (entry.get('csv'), entry.get('parquet'), entry['rows'])
+
+
+@st.cache_resource
+def get_archived_history():
+    return ArchivedCallHistory(get_call_log())
+
+
+class TieredCallHistory:
+    """The session's recent calls, then older months from the archive.
+
+    Same contract as CallHistoryIndex. The first page never opens an
+    archived partition; each later page walks back through the months
+    holding the customer's calls until it is full. ``count()`` is None
+    only while a month with calls logged without customer ids has not
+    been opened yet.
+    """
+
+    def __init__(self, recent, archive, before, rm_code=None, resolve_id=None):
+        self._recent = recent
+        self._archive = archive
+        self._before = before
+        self._rm_code = rm_code
+        self._resolve_id = resolve_id
+        self._partitions = None
+
+    def partitions(self):
+        if self._partitions is None:
+            self._partitions = self._archive.partitions(self._before, self._rm_code)
+        return self._partitions
+
+    def count(self, customer_id):
+        archived = self._archived_count(customer_id)
+        return None if archived is None else self._recent.count(customer_id) + archived
+
+    def page(self, customer_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Return (calls newest first, cursor for the next page or None)"""
+        tier, position = cursor if cursor is not None else (0, None)
+        partitions = self.partitions()
+        if tier == 0:
+            calls, position = self._recent.page(customer_id, limit, position)
+            if position is not None:
+                return calls, (0, position)
+            more = partitions and self._archived_count(customer_id) != 0
+            return calls, ((1, None) if more else None)
+        calls = []
+        while tier <= len(partitions) and len(calls) < limit:
+            if position is None and self._without(partitions[tier - 1], customer_id):
+                tier += 1
+                continue
+            index = self._archive.index(partitions[tier - 1], self._resolve_id)
+            page, position = index.page(customer_id, limit - len(calls), position)
+            calls.extend(page)
+            if position is None:
+                tier += 1
+        # Step over months without the customer, so "load more" is only offered when there is more
+        while position is None and tier <= len(partitions) and self._without(partitions[tier - 1], customer_id):
+            tier += 1
+        return calls, ((tier, position) if tier <= len(partitions) else None)
+
+    def _without(self, entry, customer_id):
+        return self._archive.count(entry, customer_id) == 0
+
+    def _archived_count(self, customer_id):
+        total = 0
+        for entry in self.partitions():
+            count = self._archive.count(entry, customer_id)
+            if count is None:
+                return None
+            total += count
+        return total
+
+
+class MergedCallHistory:
+    """A customer's calls together with the calls of the customers merged into it.
+
+    Same contract as CallHistoryIndex for the surviving customer's id.
+    Each id's history is paged on its own and the pages are interleaved
+    newest first by call date; the cursor holds, per id, the calls read
+    but not yet shown, the source cursor and whether more remain.
+    """
+
+    def __init__(self, history, customer_id, merged_ids):
+        self._history = history
+        self._ids = [customer_id] + list(merged_ids)
+
+    def count(self, customer_id):
+        counts = [self._history.count(i) for i in self._ids]
+        return None if None in counts else sum(counts)
+
+    def page(self, customer_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Return (calls newest first, cursor for the next page or None)"""
+        sources = [list(s) for s in cursor] if cursor is not None else [[(), None, True] for _ in self._ids]
+        calls = []
+        while len(calls) < limit:
+            for source, source_id in zip(sources, self._ids):
+                if not source[0] and source[2]:
+                    page, source[1] = self._history.page(source_id, limit, source[1])
+                    source[0], source[2] = tuple(page), source[1] is not None
+            live = [source for source in sources if source[0]]
+            if not live:
+                break
+            newest = max(live, key=lambda source: str(source[0][0].get('date') or ""))
+            calls.append(newest[0][0])
+            newest[0] = newest[0][1:]
+        more = any(source[0] or source[2] for source in sources)
+        return calls, (tuple(tuple(source) for source in sources) if more else None)
+
+
+def legacy_call_resolver(store):
+    """Map call entries written before customer ids were logged, by unique name"""
+    ids_by_name = None
+
+    def resolve(call):
+        nonlocal ids_by_name
+        if ids_by_name is None:
+            # Built on first use; logs written with customer ids never need it
+            frame = store.frame()
+            unique = ~frame['name'].duplicated(keep=False)
+            ids_by_name = dict(zip(frame['name'][unique].tolist(), frame['id'][unique].tolist()))
+        # Same-name customers are ambiguous, leave those calls unassigned
+        return ids_by_name.get(call.get('customer'))
+    return resolve
+
+
+# Per-RM dashboard aggregates
+class RMAggregates:
+    """Running Performance tab numbers for one RM's portfolio"""
+
+    def __init__(self, recent_size=RECENT_CALLS_SHOWN):
+        self.total_customers = 0
+        self.status_counts = Counter()
+        self.potential_counts = Counter()
+        self.recent_calls = deque(maxlen=recent_size)
+
+    def add_customer(self, customer):
+        self.total_customers += 1
+        self.status_counts[customer.get('status')] += 1
+        self.potential_counts[customer.get('potential')] += 1
+
+    def remove_customer(self, customer):
+        self.total_customers -= 1
+        self.status_counts[customer.get('status')] -= 1
+        self.potential_counts[customer.get('potential')] -= 1
+
+    def update_customer(self, before, after):
+        if before.get('status') != after.get('status'):
+            self.status_counts[before.get('status')] -= 1
+            self.status_counts[after.get('status')] += 1
+        if before.get('potential') != after.get('potential'):
+            self.potential_counts[before.get('potential')] -= 1
+            self.potential_counts[after.get('potential')] += 1
+
+    def add_call(self, call):
+        self.recent_calls.append(call)
+
+    def copy(self):
+        aggregates = RMAggregates(self.recent_calls.maxlen)
+        aggregates.total_customers = self.total_customers
+        aggregates.status_counts = Counter(self.status_counts)
+        aggregates.potential_counts = Counter(self.potential_counts)
+        aggregates.recent_calls.extend(self.recent_calls)
+        return aggregates
+
+
+def build_rm_aggregates(store, calls, resolve_id):
+    """Vectorized counts over the customers and one pass over calls, on load"""
+    frame = store.frame()
+    aggregates = {}
+    for rm_code, size in frame.groupby('rm_code', observed=True).size().items():
+        aggregates.setdefault(rm_code, RMAggregates()).total_customers = int(size)
+    for (rm_code, status), size in frame.groupby(['rm_code', 'status'], observed=True).size().items():
+        aggregates[rm_code].status_counts[status] = int(size)
+    for (rm_code, potential), size in frame.groupby(['rm_code', 'potential'], observed=True).size().items():
+        aggregates[rm_code].potential_counts[potential] = int(size)
+
+    # RM of every call in one indexer lookup; calls of merged customers count for the survivor
+    merged_into = store.table.merged_into
+    call_ids = [call.get('customer_id') or resolve_id(call) or -1 for call in calls]
+    if merged_into:
+        call_ids = [merged_into.get(customer_id, customer_id) for customer_id in call_ids]
+    positions = pd.Index(frame['id']).get_indexer(call_ids)
+    rm_codes = frame['rm_code'].astype(str).to_numpy()
+    rms_by_name = None
+    for call, position in zip(calls, positions):
+        rm_code = rm_codes[position] if position >= 0 else None
+        if rm_code is None:
+            # Unresolved legacy rows still count when every same-name customer has one RM
+            if rms_by_name is None:
+                counts = frame.groupby('name')['rm_code'].nunique()
+                single = frame[frame['name'].isin(counts[counts == 1].index)]
+                rms_by_name = dict(zip(single['name'].tolist(), single['rm_code'].astype(str).tolist()))
+            rm_code = rms_by_name.get(call.get('customer'))
+            if rm_code is None:
+                continue
+        aggregates.setdefault(rm_code, RMAggregates()).add_call(call)
+    return aggregates
+
+
+def rm_aggregates(rm_code):
+    """An RM's Performance numbers: the shared ones with this session's edits and calls applied"""
+    def build():
+        shared = st.session_state.snapshot.aggregates.get(rm_code)
+        aggregates = shared.copy() if shared is not None else RMAggregates()
+        for before, after in st.session_state.customers.edits(rm_code):
+            if after.get('merged_into'):
+                if before is not None:
+                    aggregates.remove_customer(before)
+            elif before is None:
+                aggregates.add_customer(after)
+            else:
+                aggregates.update_customer(before, after)
+        for call in st.session_state.call_log.own_calls(rm_code):
+            aggregates.add_call(call)
+        return aggregates
+    return tab_memo("rm_aggregates", (data_version(), rm_code), build)
+
+
+# Shared snapshot
+class SharedSnapshot:
+    """One customer and call log version with everything derived from them.
+
+    Built once per pair of dataset versions and shared read-only by every
+    session; a session's own changes live in its CustomerStore and
+    SessionCallLog overlays.
+    """
+
+    def __init__(self, table, calls, versions=None):
+        self.table = table
+        self.calls = calls
+        self.versions = versions
+        store = CustomerStore(table)
+        resolve_id = legacy_call_resolver(store)
+        self.history = CallHistoryIndex(calls, resolve_id)
+        self.aggregates = build_rm_aggregates(store, calls, resolve_id)
+
+
+@st.cache_resource(max_entries=2)
+def get_shared_snapshot(customer_version, call_version, _table, _calls):
+    return SharedSnapshot(_table, _calls, (customer_version, call_version))
+
+
+# Call rollups
+def scan_call_log(storage, lookup, start=None, workers=CALL_SCAN_WORKERS):
+    """(counts, marks, stats) for the whole call log from ``start`` on, scanned by a process pool.
+
+    The log is split into independent tasks by the storage backend;
+    see scorecards.py for the worker side.
+    """
+    started = time.perf_counter()
+    tasks = storage.call_scan_tasks(start)
+    workers = max(1, min(workers, len(tasks)))
+    if workers > 1:
+        # Spawned, not forked: forking a server process with running threads can deadlock the child
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = list(pool.map(scorecards.count_calls, tasks, itertools.repeat(start, len(tasks)),
+                                  itertools.repeat(lookup, len(tasks))))
+    else:
+        parts = [scorecards.count_calls(task, start, lookup) for task in tasks]
+    counts = scorecards.merge_counts(counts for counts, _ in parts)
+    stats = {"calls": int(counts['calls'].sum()), "tasks": len(tasks), "workers": workers,
+             "seconds": time.perf_counter() - started}
+    return counts, [mark for _, mark in parts], stats
+
+
+class CallRollups:
+    """Calls per RM, potential tier, day and outcome over the whole call log.
+
+    Built in bulk by scan_call_log(), then kept current by folding in only
+    the calls appended since the storage watermark, so date-range queries
+    never touch the log itself. A call counts for its customer's RM and
+    tier when it is folded in; calls for customers newer than the customer
+    table are held back until a newer table places them. Shared by every
+    session of the process; the first scan runs on a background thread
+    started at login, see warm().
+    """
+
+    def __init__(self, storage, workers=CALL_SCAN_WORKERS):
+        self.storage = storage
+        self.workers = workers
+        self._lock = threading.RLock()
+        self._counts = scorecards.merge_counts([])
+        self._days = self._counts['day'].to_numpy()
+        self._recent = []  # count frames folded in since the last merge
+        self._recent_rows = 0
+        self._waiting = None  # calls for customers the table didn't have yet
+        self._watermark = None
+        self._table = None
+        self._lookup = None
+        self.version = 0
+        self.rebuild_stats = None
+        self.warm_error = None
+        self._warmer = None
+        self._warmer_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.rebuild_stats is not None
+
+    def warm(self, table):
+        """Start the first full scan on a background thread unless it is running or done"""
+        with self._warmer_lock:
+            if self.ready or self._warmer is not None:
+                return
+            self._warmer = threading.Thread(target=self._warm, args=(table,), name="call-rollups", daemon=True)
+            self._warmer.start()
+
+    def rebuild(self, table):
+        """Recount everything from the call log"""
+        with self._lock:
+            counts, marks, stats = scan_call_log(self.storage, self._customer_lookup(table), workers=self.workers)
+            self._watermark = self.storage.call_watermark(marks)
+            self._waiting = None
+            self._recent, self._recent_rows = [], 0
+            self._set_counts(counts)
+            self.rebuild_stats = stats
+            self.version += 1
+
+    def catch_up(self, table):
+        """Fold in the calls appended since the last scan; True if anything changed"""
+        with self._lock:
+            new = self.storage.read_new_calls(self._watermark) if self._watermark is not None else None
+            if new is None:
+                # First use, or calls were removed or rewritten: only a full scan is exact
+                self.rebuild(table)
+                return True
+            calls, self._watermark = new
+            calls = calls[scorecards.CALL_COLUMNS]
+            if self._waiting is not None and table is not self._table:
+                calls = pd.concat([self._waiting, calls], ignore_index=True)
+                self._waiting = None
+            if not len(calls):
+                return False
+            lookup = self._customer_lookup(table)
+            positions = scorecards.place_calls(calls, lookup)
+            ids = pd.to_numeric(calls['customer_id'], errors='coerce').to_numpy()
+            unknown = (positions < 0) & (ids > (lookup[0].max() if len(lookup[0]) else 0))
+            if unknown.any():
+                self._waiting = pd.concat([self._waiting, calls[unknown]], ignore_index=True)
+            counts = scorecards.group_calls(calls, positions, lookup)
+            if not len(counts):
+                return False
+            self._recent.append(counts)
+            self._recent_rows += len(counts)
+            if self._recent_rows >= ROLLUP_COMPACT_ROWS:
+                self._set_counts(scorecards.merge_counts([self._counts] + self._recent))
+                self._recent, self._recent_rows = [], 0
+            self.version += 1
+            return True
+
+    def frame(self, start=None, end=None, rm_code=None):
+        """Counts (COUNT_COLUMNS plus calls) for days in [start, end), optionally for one RM"""
+        with self._lock:
+            low = 0 if start is None else self._days.searchsorted(start)
+            high = len(self._days) if end is None else self._days.searchsorted(end)
+            parts = [self._counts.iloc[low:high]] + self._recent
+        # Rows added since the last merge are few and unsorted; filter them directly
+        for i, part in enumerate(parts[1:], 1):
+            if start is not None:
+                part = part[part['day'] >= start]
+            if end is not None:
+                part = part[part['day'] < end]
+            parts[i] = part
+        if rm_code is not None:
+            parts = [part[part['rm_code'] == rm_code] for part in parts]
+        if len(parts) == 1:
+            return parts[0].reset_index(drop=True)
+        return scorecards.merge_counts(parts)
+
+    def _warm(self, table):
+        try:
+            self.rebuild(table)
+            self.warm_error = None
+        except Exception as e:
+            # Kept for the Performance tab; the next warm() tries again
+            self.warm_error = e
+        finally:
+            with self._warmer_lock:
+                self._warmer = None
+
+    def _set_counts(self, counts):
+        self._counts = counts.sort_values('day', kind='stable', ignore_index=True)
+        self._days = self._counts['day'].to_numpy(dtype=object)
+
+    def _customer_lookup(self, table):
+        if table is not self._table:
+            self._table, self._lookup = table, scorecards.customer_lookup(table.frame, table.merged_into)
+        return self._lookup
+
+
+@st.cache_resource
+def get_call_rollups():
+    """Process-wide call rollups, empty until warm() has scanned the call log"""
+    return CallRollups(get_storage())
+
+
+def call_rollups():
+    """The process-wide rollups caught up with calls logged since the last query; None until the first scan is done"""
+    table = st.session_state.snapshot.table
+    rollups = get_call_rollups()
+    if not rollups.ready:
+        rollups.warm(table)
+        return None
+    with trace_span("rollups:catch_up"):
+        rollups.catch_up(table)
+    return rollups
+
+
+@st.fragment(run_every=1)
+def rollups_pending_panel():
+    """Polls the background rollup scan without re-running the whole script"""
+    rollups = get_call_rollups()
+    if rollups.ready:
+        st.rerun()
+    elif rollups.warm_error is not None:
+        st.warning(f"Could not count the call log, retrying: {rollups.warm_error}")
+        rollups.warm(st.session_state.snapshot.table)
+    else:
+        st.info("⏳ Counting the whole call log in the background; this shows up when it is done.")
+
+
+# Branch scorecards
+def compute_scorecards(rollups, customers, days, today):
+    """(scorecard per RM, calls per day per RM, run stats) over the last ``days`` days, or all time"""
+    started = time.perf_counter()
+    start = (today - timedelta(days=days - 1)).strftime("%Y-%m-%d") if days else None
+    counts = rollups.frame(start)
+    cards, daily = scorecards.build_scorecards(counts, customers, today, days)
+    stats = {"calls": int(counts['calls'].sum()), "seconds": time.perf_counter() - started}
+    return cards, daily, stats
+
+
+@st.cache_resource(max_entries=8)
+def get_scorecards(days, today, customer_version, rollup_version, _rollups, _customers):
+    """Scorecards for one period, customer version and rollup version, shared read-only by every session"""
+    return compute_scorecards(_rollups, _customers, days, today)
+
+
+def branch_scorecards(rollups, days):
+    snapshot = st.session_state.snapshot
+    today = datetime.now().date()
+    if snapshot.versions is None:
+        return tab_memo("scorecards", (data_version(), rollups.version, days, today),
+                        lambda: compute_scorecards(rollups, snapshot.table.frame, days, today))
+    return get_scorecards(days, today, snapshot.versions[0], rollups.version, rollups, snapshot.table.frame)
+
+
+def call_trends(rollups, rm_code, start, end):
+    """(calls per day by outcome, funnel, calls by tier and outcome, query seconds) for [start, end)"""
+    started = time.perf_counter()
+    counts = rollups.frame(start, end, rm_code)
+    daily = counts.pivot_table(index='day', columns='outcome', values='calls', aggfunc='sum', fill_value=0)
+    days = pd.date_range(start, datetime.strptime(end, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    daily = daily.reindex(days, fill_value=0)
+    by_outcome = counts.groupby('outcome')['calls'].sum()
+    funnel = pd.Series({label: int(by_outcome.sum() if outcomes is None else by_outcome.reindex(outcomes).sum())
+                        for label, outcomes in CALL_FUNNEL}, name="Calls")
+    tiers = counts.pivot_table(index='potential', columns='outcome', values='calls', aggfunc='sum', fill_value=0)
+    tiers = tiers.reindex(scorecards.TIERS, fill_value=0)
+    return daily, funnel, tiers, time.perf_counter() - started
+
+
+# Next-best-call queue
+def days_since_contact(last_contact, today):
+    try:
+        days = (today - datetime.strptime(str(last_contact)[:10], "%Y-%m-%d")).days
+    except ValueError:
+        return CALL_QUEUE_MAX_DAYS
+    return max(days, 0)
+
+
+def call_priority(customer, today):
+    """Score of one customer; must agree with call_priorities()"""
+    days = days_since_contact(customer.get('last_contact'), today)
+    status = customer.get('status')
+    call_count = int(customer.get('call_count') or 0)
+    score = CALL_QUEUE_POTENTIAL_POINTS.get(customer.get('potential'), 0)
+    callback_due = str(customer.get('callback_due') or "")
+    if callback_due:
+        due = callback_due <= today.strftime("%Y-%m-%d %H:%M")
+    else:
+        due = days >= CALL_QUEUE_CALLBACK_DUE_DAYS
+    if status != "Callback" or due:
+        score += CALL_QUEUE_STATUS_POINTS.get(status, 0)
+    score += min(days, CALL_QUEUE_MAX_DAYS) * CALL_QUEUE_DAY_POINTS
+    score -= min(call_count, 10) * CALL_QUEUE_CALL_POINTS
+    if days == 0 and call_count > 0:
+        score -= CALL_QUEUE_CALLED_TODAY_POINTS
+    return score
+
+
+def call_priorities(frame, today):
+    """call_priority() for every row of a customer frame at once"""
+    contacted = pd.to_datetime(frame['last_contact'].str.slice(0, 10), format="%Y-%m-%d", errors='coerce')
+    days = (pd.Timestamp(today) - contacted).dt.days.fillna(CALL_QUEUE_MAX_DAYS).clip(lower=0).to_numpy()
+    status = frame['status'].astype(str).to_numpy()
+    call_count = frame['call_count'].to_numpy()
+    status_points = frame['status'].astype(str).map(CALL_QUEUE_STATUS_POINTS).fillna(0).to_numpy()
+    callback_due = frame['callback_due'].to_numpy(dtype=str)
+    due = np.where(callback_due != "", callback_due <= today.strftime("%Y-%m-%d %H:%M"),
+                   days >= CALL_QUEUE_CALLBACK_DUE_DAYS)
+    not_due = (status == "Callback") & ~due
+    score = frame['potential'].astype(str).map(CALL_QUEUE_POTENTIAL_POINTS).fillna(0).to_numpy()
+    score = score + np.where(not_due, 0, status_points)
+    score = score + np.minimum(days, CALL_QUEUE_MAX_DAYS) * CALL_QUEUE_DAY_POINTS
+    score = score - np.minimum(call_count, 10) * CALL_QUEUE_CALL_POINTS
+    return score - np.where((days == 0) & (call_count > 0), CALL_QUEUE_CALLED_TODAY_POINTS, 0)
+
+
+class CallQueue:
+    """Max-heap of one RM's customers by call priority, with lazy invalidation.
+
+    ``update()`` pushes the customer's new score and forgets the old heap
+    entry instead of searching for it, so a logged call costs O(log n);
+    stale entries are dropped when they surface and the heap is rebuilt
+    once they outnumber the live ones. Scores use the date the queue was
+    built, which is fine for a session.
+    """
+
+    def __init__(self, customers=(), scores=(), today=None):
+        self.today = today or datetime.now()
+        self._seq = itertools.count()
+        self._entries = {}  # customer id -> its live heap entry
+        for customer_id, score in zip(customers, scores):
+            self._entries[customer_id] = (-score, next(self._seq), customer_id)
+        self._heap = list(self._entries.values())
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def from_frame(cls, frame, today=None):
+        today = today or datetime.now()
+        return cls(frame['id'].tolist(), call_priorities(frame, today).tolist(), today)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, customer, penalty=0):
+        """(Re)queue a customer under its current score"""
+        entry = (penalty - call_priority(customer, self.today), next(self._seq), customer.get('id'))
+        self._entries[entry[2]] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def defer(self, customer):
+        """Requeue a skipped customer behind everyone not skipped"""
+        self.update(customer, CALL_QUEUE_SKIP_POINTS)
+
+    def discard(self, customer_id):
+        """Take a customer out of the queue, e.g. once merged into another; its heap entry goes stale"""
+        self._entries.pop(customer_id, None)
+
+    def take(self):
+        """Remove and return the id of the best customer, or None when empty"""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[2]) is entry:
+                del self._entries[entry[2]]
+                return entry[2]
+        return None
+
+    def peek(self, n):
+        """[(score, customer id)] of the next ``n`` customers, best first"""
+        taken = []
+        while self._heap and len(taken) < n:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[2]) is entry:
+                taken.append(entry)
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return [(-entry[0], entry[2]) for entry in taken]
+
+
+def call_queue(rm_code):
+    """This session's queue for an RM, built on first use"""
+    queues = st.session_state.setdefault('call_queues', {})
+    if rm_code not in queues:
+        with trace_span("build:call_queue"):
+            queues[rm_code] = CallQueue.from_frame(st.session_state.customers.frame(rm_code))
+    return queues[rm_code]
+
+
+def requeue(customer):
+    """Re-score a changed customer in its RM's queue, if that queue exists yet"""
+    queue = st.session_state.get('call_queues', {}).get(customer.get('rm_code'))
+    if queue is not None:
+        queue.update(customer)
+
+
+# Callback scheduler
+def parse_due(value):
+    """Epoch seconds of a "YYYY-MM-DD HH:MM" due time, or None"""
+    try:
+        return datetime.strptime(str(value)[:16], "%Y-%m-%d %H:%M").timestamp()
+    except ValueError:
+        return None
+
+
+def day_start(timestamp, days=0):
+    day = datetime.fromtimestamp(timestamp).date() + timedelta(days=days)
+    return datetime.combine(day, datetime.min.time()).timestamp()
+
+
+class CallbackScheduler:
+    """Due times of every RM's Callback follow-ups, advanced by a background thread.
+
+    A callback waits in a heap until the start of its due day, moves to
+    its RM's "later today" set and waits again until it is due, then
+    moves to the "due now" set, where it stays until the customer is
+    called. Advancing only pops expired heap entries, so the counts cost
+    O(1) to read and O(expired items) to keep current. Rescheduling or
+    clearing a callback leaves its heap entry behind; stale entries are
+    skipped when they surface.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._heap = []  # (wake-up time, seq, customer id, stage)
+        self._live = {}  # customer id -> (due, rm_code, seq)
+        self._later = {}  # rm_code -> ids due later today
+        self._now = {}  # rm_code -> ids due now or overdue
+        self._version = None
+        self.expired = 0
+        self._thread = threading.Thread(target=self._run, name="callback-scheduler", daemon=True)
+        self._thread.start()
+
+    def sync(self, version, frame):
+        """Rebuild from a customer snapshot, once per snapshot version"""
+        with self._cond:
+            if version == self._version:
+                return
+        waiting = frame[(frame['status'] == "Callback") & (frame['callback_due'] != "")]
+        with self._cond:
+            self._version = version
+            self._heap, self._live, self._later, self._now = [], {}, {}, {}
+            for customer_id, due, rm_code in zip(waiting['id'].tolist(), waiting['callback_due'].tolist(),
+                                                 waiting['rm_code'].astype(str).tolist()):
+                self._add(customer_id, parse_due(due), rm_code)
+            self._cond.notify_all()
+
+    def schedule(self, customer):
+        """Track a customer's callback, or forget it once the status has moved on"""
+        due = parse_due(customer.get('callback_due')) if customer.get('status') == "Callback" else None
+        with self._cond:
+            self._remove(customer.get('id'))
+            self._add(customer.get('id'), due, str(customer.get('rm_code')))
+            if len(self._heap) > 2 * len(self._live) + 64:
+                self._rebuild()
+            self._cond.notify_all()
+
+    def due_now(self, rm_code):
+        with self._cond:
+            self._advance()
+            return len(self._now.get(rm_code, ()))
+
+    def due_later_today(self, rm_code):
+        with self._cond:
+            self._advance()
+            return len(self._later.get(rm_code, ()))
+
+    def due(self, rm_code, n):
+        """[(due time, customer id)] of the ``n`` longest-waiting due callbacks"""
+        with self._cond:
+            self._advance()
+            return heapq.nsmallest(n, ((self._live[i][0], i) for i in self._now.get(rm_code, ())))
+
+    def _add(self, customer_id, due, rm_code):
+        if due is None:
+            return
+        seq = next(self._seq)
+        self._live[customer_id] = (due, rm_code, seq)
+        now = self._clock()
+        if due <= now:
+            self._now.setdefault(rm_code, set()).add(customer_id)
+        elif due < day_start(now, 1):
+            self._later.setdefault(rm_code, set()).add(customer_id)
+            heapq.heappush(self._heap, (due, seq, customer_id, "now"))
+        else:
+            heapq.heappush(self._heap, (day_start(due), seq, customer_id, "today"))
+
+    def _remove(self, customer_id):
+        live = self._live.pop(customer_id, None)
+        if live is not None:
+            self._later.get(live[1], set()).discard(customer_id)
+            self._now.get(live[1], set()).discard(customer_id)
+
+    def _rebuild(self):
+        live = list(self._live.items())
+        self._heap, self._live, self._later, self._now = [], {}, {}, {}
+        for customer_id, (due, rm_code, _) in live:
+            self._add(customer_id, due, rm_code)
+
+    def _advance(self):
+        now = self._clock()
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, customer_id, stage = heapq.heappop(self._heap)
+            live = self._live.get(customer_id)
+            if live is None or live[2] != seq:
+                continue
+            due, rm_code, _ = live
+            self.expired += 1
+            if stage == "today" and due > now:
+                self._later.setdefault(rm_code, set()).add(customer_id)
+                heapq.heappush(self._heap, (due, seq, customer_id, "now"))
+            else:
+                self._later.get(rm_code, set()).discard(customer_id)
+                self._now.setdefault(rm_code, set()).add(customer_id)
+
+    def _run(self):
+        with self._cond:
+            while True:
+                self._advance()
+                timeout = self._heap[0][0] - self._clock() if self._heap else None
+                self._cond.wait(None if timeout is None else max(timeout, 0.05))
+
+
+@st.cache_resource
+def get_callback_scheduler():
+    """Process-wide callback scheduler shared by every session"""
+    return CallbackScheduler()
+
+
+# Name / business search
+def search_tokens(text):
+    """Lowercased word tokens with accents stripped"""
+    text = unicodedata.normalize("NFKD", str(text or "")).casefold()
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return re.findall(r"\w+", text)
+
+
+@functools.lru_cache(maxsize=65536)
+def romanized_key(token):
+    """Loose key that folds common Khmer romanization variants (Sok/Sokh, Srey/Srei)"""
+    key = token[:1] + token[1:].replace("h", "")
+    key = key.replace("ou", "o").replace("y", "i")
+    return re.sub(r"(.)\1+", r"\1", key)
+
+
+def _deletions(key):
+    return {key[:i] + key[i + 1:] for i in range(len(key))} | {key}
+
+
+class SearchIndex:
+    """Pre-normalized token index over customer name and business.
+
+    Each query token is matched as an exact token, a token prefix, a
+    substring (via 2/3-gram lookup) or, with ``fuzzy``, a romanization
+    key within one deletion. Every query token must match; results are
+    scored by the strength of each match.
+    """
+
+    EXACT, PREFIX, SUBSTRING, FUZZY = 3.0, 2.0, 1.0, 0.5
+
+    def __init__(self, records=()):
+        self._ids_by_token = {}
+        self._tokens_by_gram = {}
+        self._tokens_by_key = {}
+        for record in records:
+            for token in self._record_tokens(record):
+                self._ids_by_token.setdefault(token, set()).add(record.get('id'))
+        for token in self._ids_by_token:
+            self._index_token(token)
+        self._vocabulary = sorted(self._ids_by_token)
+
+    def add(self, record):
+        for token in self._record_tokens(record):
+            if token not in self._ids_by_token:
+                self._ids_by_token[token] = set()
+                self._index_token(token)
+                bisect.insort(self._vocabulary, token)
+            self._ids_by_token[token].add(record.get('id'))
+
+    def search(self, query, fuzzy=False):
+        """Return {customer id: score} for records matching every query token"""
+        scores = None
+        for term in search_tokens(query):
+            tokens_by_score = {}
+            for token, score in self._match(term, fuzzy).items():
+                tokens_by_score.setdefault(score, []).append(self._ids_by_token[token])
+            # Weakest match level first so stronger levels overwrite it; set unions run in C
+            term_scores = {}
+            for score in sorted(tokens_by_score):
+                ids = set().union(*tokens_by_score[score])
+                if scores is not None:
+                    ids &= scores.keys()
+                term_scores.update(dict.fromkeys(ids, score))
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {i: scores[i] + score for i, score in term_scores.items()}
+            if not scores:
+                return {}
+        return scores or {}
+
+    def _match(self, term, fuzzy):
+        matches = {}
+        if term in self._ids_by_token:
+            matches[term] = self.EXACT
+        start = bisect.bisect_left(self._vocabulary, term)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            matches.setdefault(token, self.PREFIX)
+        if len(term) >= 2:
+            grams = self._grams(term, 3 if len(term) >= 3 else 2)
+            candidates = set.intersection(*(self._tokens_by_gram.get(g, set()) for g in grams))
+            for token in candidates:
+                if term in token:
+                    matches.setdefault(token, self.SUBSTRING)
+        if fuzzy:
+            for variant in _deletions(romanized_key(term)):
+                for token in self._tokens_by_key.get(variant, ()):
+                    matches.setdefault(token, self.FUZZY)
+        return matches
+
+    @staticmethod
+    def _record_tokens(record):
+        return set(search_tokens(record.get('name'))) | set(search_tokens(record.get('business')))
+
+    @staticmethod
+    def _grams(token, n):
+        return {token[i:i + n] for i in range(len(token) - n + 1)}
+
+    def _index_token(self, token):
+        for n in (2, 3):
+            for gram in self._grams(token, n):
+                self._tokens_by_gram.setdefault(gram, set()).add(token)
+        for variant in _deletions(romanized_key(token)):
+            self._tokens_by_key.setdefault(variant, set()).add(token)
+
+
+@st.cache_resource(max_entries=2)
+def get_search_index(version, _table):
+    """Search index for one customer dataset version, shared by every session"""
+    frame = _table.frame
+    return SearchIndex({'id': i, 'name': n, 'business': b} for i, n, b in
+                       zip(frame['id'].tolist(), frame['name'].tolist(), frame['business'].tolist()))
+
+
+def search_scores(query, fuzzy=False):
+    """{customer id: relevance} over the shared index and this session's additions"""
+    scores = st.session_state.search_index.search(query, fuzzy)
+    scores.update(st.session_state.search_extras.search(query, fuzzy))
+    return scores
+
+
+@traced("filter")
+def filter_customers(customers, search_term, fuzzy, status, potential, sort_by):
+    """Vectorized directory filter and sort over a customer frame"""
+    mask = np.ones(len(customers), dtype=bool)
+    scores = None
+    if search_term:
+        scores = search_scores(search_term, fuzzy)
+        mask &= customers['id'].isin(list(scores)).to_numpy()
+    if status:
+        mask &= (customers['status'] == status).to_numpy()
+    if potential:
+        mask &= (customers['potential'] == potential).to_numpy()
+    filtered = customers[mask]
+
+    names = filtered['name'].to_numpy()
+    if sort_by == "Relevance" and scores is not None:
+        rank = filtered['id'].map(scores).to_numpy()
+        order = np.lexsort((names, -rank))
+    elif sort_by == "Last Contact":
+        # Stable descending sort: sort the reversed column ascending, then flip back
+        last_contact = filtered['last_contact'].to_numpy(dtype=object)[::-1]
+        order = len(last_contact) - 1 - np.argsort(last_contact, kind='stable')[::-1]
+    elif sort_by == "Potential":
+        potential_order = {"H": 1, "M": 2, "L": 3}
+        order = np.argsort(filtered['potential'].map(potential_order).astype(float).fillna(4).to_numpy(),
+                           kind='stable')
+    elif sort_by == "Status":
+        status_order = {"New Lead": 1, "Pending": 2, "Completed": 3, "Missed": 4, "Callback": 5, "Not Interested": 6}
+        order = np.argsort(filtered['status'].map(status_order).astype(float).fillna(7).to_numpy(),
+                           kind='stable')
+    else:
+        order = np.argsort(names, kind='stable')
+    return CustomerFrameView(filtered.iloc[order])
+
+
+# Duplicate customers
+def name_key(text):
+    """Blocking key of a name: its romanized tokens, sorted (Sokh Dara and dara sok share one)"""
+    return " ".join(sorted({romanized_key(token) for token in search_tokens(text)}))
+
+
+def business_key(text):
+    """Blocking key of a business name, without generic words like "shop" or "co\""""
+    return " ".join(sorted({romanized_key(token) for token in search_tokens(text)
+                            if token not in DUPLICATE_BUSINESS_WORDS}))
+
+
+def key_overlap(a, b):
+    """Share of tokens two keys have in common (Jaccard), 0 if either is blank"""
+    a, b = set(a.split()), set(b.split())
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def score_keys(phone_a, phone_b, name_a, name_b, business_a, business_b):
+    """(score, reasons) of two customers from their phone, name and business keys"""
+    same_phone = len(phone_a) >= DUPLICATE_MIN_PHONE_DIGITS and phone_a == phone_b
+    name, business = key_overlap(name_a, name_b), key_overlap(business_a, business_b)
+    score = (DUPLICATE_WEIGHTS['phone'] * same_phone + DUPLICATE_WEIGHTS['name'] * name
+             + DUPLICATE_WEIGHTS['business'] * business)
+    reasons = ["same phone"] if same_phone else []
+    if name:
+        reasons.append("same name" if name == 1 else "similar name")
+    if business:
+        reasons.append("same business" if business == 1 else "similar business")
+    return round(score, 2), ", ".join(reasons)
+
+
+def duplicate_score(a, b):
+    """(score, reasons) of two customer records"""
+    return score_keys(normalize_phone(a.get('phone')), normalize_phone(b.get('phone')),
+                      name_key(a.get('name')), name_key(b.get('name')),
+                      business_key(a.get('business')), business_key(b.get('business')))
+
+
+class DuplicateIndex:
+    """Blocking index that finds duplicate customers without comparing every pair.
+
+    Every customer is filed under up to three blocking keys: its phone
+    key, its name key and its business key. Only customers sharing a
+    block are scored against each other. A block bigger than
+    DUPLICATE_MAX_BLOCK (a very common name, a chain's business name) is
+    split by a second key instead (SPLIT_KEYS: a common name by business
+    and by phone prefix). A split block still bigger than
+    DUPLICATE_MAX_SPLIT_BLOCK (a big book reuses the same name at the same
+    business) is split once more by FINE_KEY, the email address, so only
+    its customers without an email, or sharing one with too many others,
+    go uncompared there. Keys are kept as sorted 64-bit hashes, so a new
+    customer is checked with a few binary searches.
+    """
+
+    PAIR_COLUMNS = ["id", "duplicate_id", "rm_code", "duplicate_rm_code", "score", "reasons"]
+    SPLIT_KEYS = {"phone": ("name",), "name": ("business", "prefix"), "business": ("prefix",)}
+    FINE_KEY = "email"
+
+    def __init__(self, frame):
+        self._ids = frame['id'].to_numpy()
+        self._rm_codes = frame['rm_code'].astype(str).to_numpy(dtype=object)
+        self._phones = frame['phone_key'].to_numpy(dtype=object)
+        # Keyed once per distinct name and business; a book repeats them a lot
+        self._names = self._unique_keys(frame['name'], name_key)
+        self._businesses = self._unique_keys(frame['business'], business_key)
+        long_enough = frame['phone_key'].str.len().to_numpy() >= DUPLICATE_MIN_PHONE_DIGITS
+        keys = {"phone": np.where(long_enough, self._phones, ""), "name": self._names,
+                "business": self._businesses,
+                "prefix": np.where(long_enough, frame['phone_key'].str.slice(0, DUPLICATE_PHONE_PREFIX_DIGITS)
+                                   .to_numpy(dtype=object), ""),
+                "email": frame['email'].str.strip().str.lower().to_numpy(dtype=object)}
+        hashes, positions, split_hashes, split_positions, fine_hashes, fine_positions = [], [], [], [], [], []
+        no_email = []  # customers of crowded split blocks that have no email to split them by
+        for kind, seconds in self.SPLIT_KEYS.items():
+            present = np.flatnonzero(keys[kind] != "")
+            kind_hashes = self._hash(kind, keys[kind][present])
+            hashes.append(kind_hashes)
+            positions.append(present)
+            for second in seconds:
+                split = self._crowded(kind_hashes, present, DUPLICATE_MAX_BLOCK)
+                split = split[keys[second][split] != ""]
+                split_keys = keys[kind][split] + "|" + keys[second][split]
+                split_hashes.append(self._hash(f"{kind}+{second}", split_keys))
+                split_positions.append(split)
+                fine = self._crowded(split_hashes[-1], split, DUPLICATE_MAX_SPLIT_BLOCK)
+                no_email.append(fine[keys[self.FINE_KEY][fine] == ""])
+                fine = fine[keys[self.FINE_KEY][fine] != ""]
+                fine_hashes.append(self._hash(f"{kind}+{second}+{self.FINE_KEY}", keys[kind][fine] + "|"
+                                              + keys[second][fine] + "|" + keys[self.FINE_KEY][fine]))
+                fine_positions.append(fine)
+        self._hashes, self._positions = self._sorted(hashes, positions)
+        self._split_hashes, self._split_positions = self._sorted(split_hashes, split_positions)
+        self._fine_hashes, self._fine_positions = self._sorted(fine_hashes, fine_positions)
+        self._no_email = len(np.unique(np.concatenate(no_email)))
+
+    def members(self, record):
+        """Ids of the customers sharing a block with ``record``, splitting oversized blocks"""
+        phone = normalize_phone(record.get('phone'))
+        long_enough = len(phone) >= DUPLICATE_MIN_PHONE_DIGITS
+        keys = {"phone": phone if long_enough else "", "name": name_key(record.get('name')),
+                "business": business_key(record.get('business')),
+                "prefix": phone[:DUPLICATE_PHONE_PREFIX_DIGITS] if long_enough else "",
+                "email": str(record.get('email') or "").strip().lower()}
+        found = set()
+        for kind, seconds in self.SPLIT_KEYS.items():
+            if not keys[kind]:
+                continue
+            block = self._block(self._hashes, self._positions, kind, keys[kind])
+            if len(block) <= DUPLICATE_MAX_BLOCK:
+                found.update(self._ids[block].tolist())
+                continue
+            for second in seconds:
+                if not keys[second]:
+                    continue
+                split_key = keys[kind] + "|" + keys[second]
+                block = self._block(self._split_hashes, self._split_positions, f"{kind}+{second}", split_key)
+                if len(block) > DUPLICATE_MAX_SPLIT_BLOCK:
+                    if not keys[self.FINE_KEY]:
+                        continue
+                    block = self._block(self._fine_hashes, self._fine_positions, f"{kind}+{second}+{self.FINE_KEY}",
+                                        split_key + "|" + keys[self.FINE_KEY])
+                if len(block) <= DUPLICATE_MAX_SPLIT_BLOCK:
+                    found.update(self._ids[block].tolist())
+        return found
+
+    def pairs(self):
+        """(likely and possible duplicate pairs over the whole book, best first, scan stats)"""
+        started = time.perf_counter()
+        blocks, split = self._blocks(self._hashes, self._positions, DUPLICATE_MAX_BLOCK)
+        split_blocks, fine = self._blocks(self._split_hashes, self._split_positions, DUPLICATE_MAX_SPLIT_BLOCK)
+        fine_blocks, skipped = self._blocks(self._fine_hashes, self._fine_positions, DUPLICATE_MAX_SPLIT_BLOCK)
+        blocks += split_blocks + fine_blocks
+        seen, rows = set(), []
+        for block in blocks:
+            for a, b in itertools.combinations(block, 2):
+                # Customers sharing a phone usually share a name block too; score them once
+                if (a, b) in seen:
+                    continue
+                seen.add((a, b))
+                score, reasons = score_keys(self._phones[a], self._phones[b], self._names[a], self._names[b],
+                                            self._businesses[a], self._businesses[b])
+                if score >= DUPLICATE_REVIEW_SCORE:
+                    rows.append((int(self._ids[a]), int(self._ids[b]), self._rm_codes[a], self._rm_codes[b],
+                                 score, reasons))
+        pairs = pd.DataFrame(rows, columns=self.PAIR_COLUMNS)
+        pairs = pairs.sort_values(['score', 'id'], ascending=[False, True], ignore_index=True)
+        stats = {"customers": len(self._ids), "blocks": len(blocks), "split_blocks": split, "fine_blocks": fine,
+                 "skipped_blocks": skipped, "no_email": self._no_email, "compared": len(seen), "seconds": time.perf_counter() - started}
+        return pairs, stats
+
+    @staticmethod
+    def _blocks(hashes, positions, limit):
+        """(positions of every block of 2 to ``limit`` customers, number of bigger blocks)"""
+        starts = np.flatnonzero(np.r_[True, hashes[1:] != hashes[:-1]])
+        sizes = np.diff(np.r_[starts, len(hashes)])
+        compared = (sizes > 1) & (sizes <= limit)
+        blocks = [sorted(positions[start:start + size].tolist())
+                  for start, size in zip(starts[compared].tolist(), sizes[compared].tolist())]
+        return blocks, int((sizes > limit).sum())
+
+    @staticmethod
+    def _crowded(hashes, positions, limit):
+        """Positions in blocks of more than ``limit`` customers"""
+        _, inverse, sizes = np.unique(hashes, return_inverse=True, return_counts=True)
+        return positions[sizes[inverse] > limit]
+
+    def _block(self, hashes, positions, kind, key):
+        value = self._hash(kind, np.array([key], dtype=object))[0]
+        low = np.searchsorted(hashes, value, side='left')
+        high = np.searchsorted(hashes, value, side='right')
+        return positions[low:high]
+
+    @staticmethod
+    def _sorted(hashes, positions):
+        hashes = np.concatenate(hashes)
+        order = np.argsort(hashes, kind='stable')
+        return hashes[order], np.concatenate(positions)[order]
+
+    @staticmethod
+    def _unique_keys(column, key):
+        values = column.astype(str)
+        keys = {value: key(value) for value in values.unique()}
+        return values.map(keys).to_numpy(dtype=object)
+
+    @staticmethod
+    def _hash(kind, keys):
+        return pd.util.hash_array((kind + ":" + pd.Series(keys, dtype=object)).to_numpy(dtype=object))
+
+
+@st.cache_resource(max_entries=2, show_spinner="Indexing customers for duplicate checks…")
+def get_duplicate_index(version, _table):
+    """Duplicate index for one customer dataset version, shared by every session"""
+    return DuplicateIndex(_table.frame)
+
+
+@st.cache_resource(max_entries=2, show_spinner="Scanning the whole book for duplicate customers…")
+def get_duplicate_pairs(version, _index):
+    """Whole-book duplicate pairs for one customer dataset version, shared by every session"""
+    return _index.pairs()
+
+
+def duplicate_index():
+    snapshot = st.session_state.snapshot
+    if snapshot.versions is None:
+        return tab_memo("duplicate_index", (data_version(),), lambda: DuplicateIndex(snapshot.table.frame))
+    return get_duplicate_index(snapshot.versions[0], snapshot.table)
+
+
+@traced("find_duplicates")
+def find_duplicates(record, min_score=DUPLICATE_MIN_SCORE):
+    """[(score, reasons, customer)] of customers scoring at least ``min_score`` against ``record``, best first.
+
+    Only the customers sharing a block with it are scored, plus the few
+    this session added, so checking one new customer stays cheap however
+    big the book is.
+    """
+    store = st.session_state.customers
+    candidates = [store.get(customer_id) for customer_id in duplicate_index().members(record)]
+    found = []
+    for customer in candidates + store.added():
+        if customer is None or customer.get('merged_into') or customer.get('id') == record.get('id'):
+            continue
+        score, reasons = duplicate_score(record, customer)
+        if score >= min_score:
+            found.append((score, reasons, customer))
+    return sorted(found, key=lambda match: (-match[0], match[2].get('id')))
+
+
+def duplicate_pairs(rm_code=None):
+    """(likely and possible duplicate pairs, scan stats), optionally only pairs with one of an RM's customers.
+
+    The whole-book scan is shared; pairs this session merged are dropped
+    and the customers it added are checked against their blocks.
+    """
+    snapshot = st.session_state.snapshot
+    index = duplicate_index()
+    if snapshot.versions is None:
+        pairs, stats = tab_memo("duplicate_scan", (data_version(),), index.pairs)
+    else:
+        pairs, stats = get_duplicate_pairs(snapshot.versions[0], index)
+
+    def build():
+        store = st.session_state.customers
+        rows, seen = [], set()
+        for customer in store.added():
+            for score, reasons, other in find_duplicates(customer, DUPLICATE_REVIEW_SCORE):
+                pair = tuple(sorted((other.get('id'), customer.get('id'))))
+                if pair not in seen:
+                    seen.add(pair)
+                    rows.append((other.get('id'), customer.get('id'), str(other.get('rm_code')),
+                                 str(customer.get('rm_code')), score, reasons))
+        found = pairs
+        if rows:
+            found = pd.concat([found, pd.DataFrame(rows, columns=DuplicateIndex.PAIR_COLUMNS)], ignore_index=True)
+            found = found.sort_values(['score', 'id'], ascending=[False, True], ignore_index=True)
+        merged = store.merged()
+        if merged:
+            found = found[~found['id'].isin(merged) & ~found['duplicate_id'].isin(merged)]
+        if rm_code is not None:
+            found = found[(found['rm_code'] == rm_code) | (found['duplicate_rm_code'] == rm_code)]
+        return found.reset_index(drop=True)
+    return tab_memo("duplicate_pairs", (data_version(), rm_code, id(pairs)), build), stats
+
+
+# Session data version and per-tab memo
+def data_version():
+    """Counter bumped whenever this session's customers or call log change"""
+    return st.session_state.get('data_version', 0)
+
+def bump_data_version():
+    st.session_state.data_version = data_version() + 1
+
+def tab_memo(name, key, compute):
+    """This session's result of ``compute()``, recomputed only when ``key`` changes.
+
+    Lazy tabs skip closed tabs entirely; the memo keeps the open tab's
+    expensive results across reruns and tab switches. Keys start with
+    ``data_version()`` so a result never outlives the data it was built from.
+    """
+    memo = st.session_state.setdefault('tab_memo', {})
+    entry = memo.get(name)
+    if entry is None or entry[0] != key:
+        entry = memo[name] = (key, compute())
+    return entry[1]
+
+def rm_customers():
+    """The logged-in RM's customers as a frame"""
+    def build():
+        with trace_span("rm_frame"):
+            frame = st.session_state.customers.frame(st.session_state.rm_code)
+        trace_count("rm_customers", len(frame))
+        return frame
+    return tab_memo("rm_frame", (data_version(), st.session_state.rm_code), build)
+
+# Load data from CSV files
+@traced("load_data")
+def load_data():
+    """Load customer data and call log.
+
+    Sessions share one SharedSnapshot of the customers and recent calls;
+    a session's own edits live in the small overlays of its CustomerStore
+    and SessionCallLog.
+    """
+    # Queued writes reach storage first, so a new session sees them
+    get_commit_service().flush(timeout=10)
+    versions = None
+    try:
+        # Load customers
+        dataset = get_customer_dataset()
+        table = dataset.get()
+        search_index = get_search_index(dataset.version, table)
+        get_callback_scheduler().sync(dataset.version, table.frame)
+        versions = dataset.version
+    except Exception as e:
+        st.error(f"Error loading customer data: {e}")
+        # Fallback sample data
+        fallback = pd.DataFrame([
+            {"id": 1, "name": "Sok Dara", "business": "Sok Dara Grocery", "phone": "010 123 456", 
+             "email": "sokdara@email.com", "potential": "H", "status": "New Lead", 
+             "last_contact": "2023-01-15", "call_count": 0, "rm_code": "001"},
+            {"id": 2, "name": "Lim Srey", "business": "Srey Fashion", "phone": "011 234 567", 
+             "email": "limsrey@email.com", "potential": "M", "status": "Pending", 
+             "last_contact": "2023-02-20", "call_count": 2, "rm_code": "001"},
+            {"id": 3, "name": "Chen Lao", "business": "Lao Construction", "phone": "012 345 678", 
+             "email": "chenlao@email.com", "potential": "L", "status": "Completed", 
+             "last_contact": "2023-03-10", "call_count": 1, "rm_code": "001"},
+        ])
+        table = CustomerTable(customer_frame(fallback))
+        search_index = SearchIndex(fallback.to_dict('records'))
+    try:
+        # Call entries are never modified after they are written, so they can be shared as-is.
+        # Only recent months are loaded; older ones are read per customer from the archive.
+        call_dataset = get_call_log_dataset()
+        call_dataset.get()
+        calls, call_version, _, window_start = call_dataset.peek()
+    except Exception as e:
+        st.error(f"Error reading call log: {e}")
+        calls, call_version, window_start = [], None, recent_calls_start()
+    if versions is not None and call_version is not None:
+        snapshot = get_shared_snapshot(versions, call_version, table, calls)
+    else:
+        snapshot = SharedSnapshot(table, calls)
+    st.session_state.snapshot = snapshot
+    st.session_state.call_window_start = window_start
+    st.session_state.customers = CustomerStore(table)
+    st.session_state.call_log = SessionCallLog(snapshot)
+    st.session_state.search_index = search_index
+    # Customers added during this session are searched through a small private index
+    st.session_state.search_extras = SearchIndex()
+    st.session_state.call_queues = {}
+    if snapshot.versions is not None:
+        # Count the whole call log now, off this rerun, so the Performance tab finds the rollups ready
+        get_call_rollups().warm(table)
+    bump_data_version()
+
+@traced("refresh_snapshot")
+def refresh_snapshot(reload=False):
+    """Move this session onto a newer shared snapshot, dropping the edits it already holds.
+
+    Another session's login re-reads changed files; a session that has
+    piled up SESSION_OVERLAY_MAX_EDITS persisted edits, or passes
+    ``reload`` (after a bulk import), re-checks them itself.
+    """
+    current = st.session_state.get('snapshot')
+    if current is None or current.versions is None:
+        return
+    customers, call_log = st.session_state.customers, st.session_state.call_log
+    customer_dataset, call_dataset = get_customer_dataset(), get_call_log_dataset()
+    for dataset in (customer_dataset, call_dataset):
+        # Process-wide: how often sessions reused the shared parse instead of reading the files
+        stats = dataset.stats()
+        for counter in ("hits", "misses", "reloads"):
+            trace_count(f"dataset:{stats['name']}:{counter}", stats[counter])
+    if reload or customers.persisted_edits() + call_log.persisted_calls() >= SESSION_OVERLAY_MAX_EDITS:
+        try:
+            customer_dataset.get()
+            call_dataset.get()
+        except Exception:
+            # Unreadable right now; keep the current snapshot and try again next rerun
+            pass
+    table, version, loaded_at, _ = customer_dataset.peek()
+    calls, call_version, _, window_start = call_dataset.peek()
+    if (version, call_version) == current.versions:
+        return
+    snapshot = get_shared_snapshot(version, call_version, table, calls)
+    st.session_state.snapshot = snapshot
+    st.session_state.call_window_start = window_start
+    st.session_state.customers = customers.rebase(table, loaded_at)
+    st.session_state.call_log = call_log.rebase(snapshot)
+    st.session_state.search_index = get_search_index(version, table)
+    st.session_state.search_extras = SearchIndex(st.session_state.customers.added())
+    get_callback_scheduler().sync(version, table.frame)
+    bump_data_version()
+
+# Save data to CSV files
+def save_call_log(call_entry):
+    """Write one call entry durably, then add it to the session's log; False when the write failed"""
+    customer = st.session_state.customers.get(call_entry.get('customer_id'))
+    rm_code = customer.get('rm_code') if customer is not None else None
+    with trace_span("write:calls"):
+        try:
+            # The RM only picks the call log partition, it isn't stored with the call
+            future = get_commit_service().submit_calls([dict(call_entry, rm_code=rm_code)])
+            future.result()
+        except Exception as e:
+            st.session_state.flash_error = f"⚠️ The call could not be saved, please log it again: {e}"
+            return False
+        st.session_state.call_log.append(call_entry, rm_code, future)
+        bump_data_version()
+    return True
+
+def record_call(customer, outcome, callback_due=""):
+    """Update status, last contact, call count and callback due time after a call"""
+    store = st.session_state.customers
+    current = store.get(customer.get('id'))
+    if current is None:
+        return None
+    updated = store.update(
+        current.get('id'),
+        status=outcome,
+        last_contact=datetime.now().strftime("%Y-%m-%d"),
+        call_count=current.get('call_count', 0) + 1,
+        callback_due=callback_due if outcome == "Callback" else "",
+    )
+    requeue(updated)
+    get_callback_scheduler().schedule(updated)
+    bump_data_version()
+    with trace_span("write:customers"):
+        store.track_write(updated, get_commit_service().save_customer(updated))
+    return updated
+
+def merge_customers(keep_id, drop_id):
+    """Merge a duplicate customer into the one that stays.
+
+    The survivor takes over blank contact fields and the call count; the
+    duplicate is kept as an alias pointing at it, so its calls (the call
+    log is append-only) show in the survivor's history and rollups.
+    """
+    store = st.session_state.customers
+    keep, drop = store.get(keep_id), store.get(drop_id)
+    if (keep is None or drop is None or keep_id == drop_id or keep.get('merged_into') or drop.get('merged_into')
+            or keep.get('rm_code') != drop.get('rm_code')):
+        st.session_state.flash = "⚠️ These customers can't be merged any more"
+        return None
+    changes = {field: drop[field] for field in ('business', 'phone', 'email')
+               if drop.get(field) and not keep.get(field)}
+    changes['call_count'] = int(keep.get('call_count') or 0) + int(drop.get('call_count') or 0)
+    changes['last_contact'] = max(str(keep.get('last_contact') or ""), str(drop.get('last_contact') or ""))
+    survivor = store.update(keep_id, **changes)
+    merged = store.update(drop_id, merged_into=str(keep_id), callback_due="")
+    queue = st.session_state.get('call_queues', {}).get(merged.get('rm_code'))
+    if queue is not None:
+        queue.discard(drop_id)
+    requeue(survivor)
+    get_callback_scheduler().schedule(merged)
+    bump_data_version()
+    with trace_span("write:customers"):
+        for record in (survivor, merged):
+            store.track_write(record, get_commit_service().save_customer(record))
+    for key in ('selected_customer', 'view_customer_history'):
+        if (st.session_state.get(key) or {}).get('id') == drop_id:
+            st.session_state[key] = survivor
+    st.session_state.flash = f"🔁 Merged {drop.get('name')} into {keep.get('name')}"
+    return survivor
+
+# Bulk import
+def normalize_potential(value):
+    letter = str(value or "").strip()[:1].upper()
+    return letter if letter in ("H", "M", "L") else None
+
+
+def normalize_status(value):
+    statuses = {s.lower(): s for s in CUSTOMER_STATUSES}
+    return statuses.get(str(value or "").strip().lower())
+
+
+def normalize_rm_code(value):
+    code = str(value or "").strip()
+    return code.zfill(3) if re.fullmatch(r"\d{1,3}", code) else None
+
+
+def normalize_last_contact(value):
+    """YYYY-MM-DD of a date no later than today, or None"""
+    try:
+        date = datetime.strptime(str(value or "").strip(), "%Y-%m-%d")
+    except ValueError:
+        return None
+    return date.strftime("%Y-%m-%d") if date <= datetime.now() else None
+
+
+class ImportJob:
+    """Streams a customer CSV through the commit service on a background thread.
+
+    The file is read ``chunk_rows`` rows at a time; each chunk is
+    validated, normalized, deduplicated on the normalized phone and
+    written as one batch, so memory stays bounded by the chunk size plus
+    the set of phone keys seen. Rejected rows go to a CSV error report.
+    """
+
+    REQUIRED = ["name", "business", "phone", "potential", "status"]
+
+    def __init__(self, source, size, writer, known_phone_keys, rm_code, chunk_rows=IMPORT_CHUNK_ROWS):
+        self.source = source
+        self.size = max(size, 1)
+        self.writer = writer
+        self.rm_code = rm_code
+        self.chunk_rows = chunk_rows
+        # Phone keys are digit strings; ints keep the dedupe set compact
+        self._seen_phones = {int(k) for k in known_phone_keys if k}
+        self.state = "running"
+        self.error = None
+        self.rows_read = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.progress = 0.0
+        report = tempfile.NamedTemporaryFile("w", newline="", suffix=".csv", delete=False, encoding="utf-8")
+        self.error_report = report.name
+        self._report = report
+        # Deleted by discard(), or once the job is dropped (replaced, session gone) or at exit
+        self._remove_report = weakref.finalize(self, remove_file, report.name)
+        self._thread = threading.Thread(target=self._run, name="customer-import", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def done(self):
+        return self.state != "running"
+
+    @property
+    def has_report(self):
+        return os.path.exists(self.error_report)
+
+    def discard(self):
+        """Delete the error report; the counts stay readable"""
+        self._remove_report()
+
+    def _run(self):
+        errors = csv.writer(self._report)
+        errors.writerow(["row", "reason"] + self.REQUIRED)
+        today = datetime.now().strftime("%Y-%m-%d")
+        try:
+            reader = pd.read_csv(self.source, dtype=str, keep_default_na=False, chunksize=self.chunk_rows)
+            for chunk in reader:
+                chunk.columns = [str(c).strip().lower() for c in chunk.columns]
+                missing = [c for c in self.REQUIRED if c not in chunk.columns]
+                if missing:
+                    raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+                batch = []
+                for offset, row in enumerate(chunk.to_dict('records')):
+                    line = self.rows_read + offset + 2  # 1-based, after the header
+                    reason, record = self._validate(row, today)
+                    if reason:
+                        if reason == "duplicate phone":
+                            self.duplicates += 1
+                        else:
+                            self.invalid += 1
+                        errors.writerow([line, reason] + [row.get(c, "") for c in self.REQUIRED])
+                        continue
+                    batch.append(record)
+                if batch:
+                    self.writer.insert_customers(batch).result()
+                    self.imported += len(batch)
+                self.rows_read += len(chunk)
+                if hasattr(self.source, "tell"):
+                    self.progress = min(self.source.tell() / self.size, 0.99)
+            self.progress = 1.0
+            self.state = "done"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self._report.close()
+            if not (self.duplicates or self.invalid):
+                self.discard()
+
+    def _validate(self, row, today):
+        values = {c: str(row.get(c, "")).strip() for c in self.REQUIRED}
+        empty = [c for c, v in values.items() if not v]
+        if empty:
+            return f"missing {', '.join(empty)}", None
+        potential = normalize_potential(values['potential'])
+        if potential is None:
+            return "potential must be H, M or L", None
+        status = normalize_status(values['status'])
+        if status is None:
+            return "unknown status", None
+        last_contact = str(row.get('last_contact', "")).strip()
+        if last_contact:
+            last_contact = normalize_last_contact(last_contact)
+            if last_contact is None:
+                return "last_contact must be a past YYYY-MM-DD date", None
+        rm_code = str(row.get('rm_code', "")).strip()
+        if rm_code:
+            rm_code = normalize_rm_code(rm_code)
+            if rm_code is None:
+                return "rm_code must be up to 3 digits", None
+        phone_key = normalize_phone(values['phone'])
+        if not phone_key:
+            return "invalid phone", None
+        if int(phone_key) in self._seen_phones:
+            return "duplicate phone", None
+        self._seen_phones.add(int(phone_key))
+        return None, {
+            "name": values['name'],
+            "business": values['business'],
+            "phone": values['phone'],
+            "email": str(row.get('email', "")).strip(),
+            "potential": potential,
+            "status": status,
+            "last_contact": last_contact or today,
+            "call_count": 0,
+            "rm_code": rm_code or self.rm_code,
+        }
+
+
+def remove_file(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+@st.fragment(run_every=1)
+def import_progress_panel():
+    """Polls the running import without re-running the whole script"""
+    job = st.session_state.import_job
+    st.progress(job.progress, text=f"Imported {job.imported:,} • duplicates {job.duplicates:,} • "
+                                   f"invalid {job.invalid:,} • rows read {job.rows_read:,}")
+    if job.done:
+        # Reload the shared dataset once so the new customers show up everywhere
+        st.rerun()
+
+
+# Dialer
+class FakeDialer:
+    """Local stand-in for a telephony service.
+
+    ``dial()`` returns immediately; ringing, answer or no-answer happen on
+    background timers. A real telephony client only needs the same
+    ``dial`` / ``hangup`` / ``status`` methods.
+    """
+
+    LIVE_STATES = ("ringing", "connected")
+
+    def __init__(self, ring_seconds=DIALER_RING_SECONDS, answer_rate=DIALER_ANSWER_RATE):
+        self.ring_seconds = ring_seconds
+        self.answer_rate = answer_rate
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._ids = itertools.count(1)
+
+    def dial(self, phone):
+        now = time.time()
+        with self._lock:
+            self._forget_finished(now)
+            call_id = next(self._ids)
+            self._calls[call_id] = {"id": call_id, "phone": phone, "state": "ringing", "answered": False,
+                                    "started_at": now, "connected_at": None, "ended_at": None}
+        answered = random.random() < self.answer_rate
+        timer = threading.Timer(random.uniform(*self.ring_seconds),
+                                self._answer if answered else self._hangup, args=(call_id,))
+        timer.daemon = True
+        timer.start()
+        return call_id
+
+    def hangup(self, call_id):
+        self._hangup(call_id)
+
+    def status(self, call_id):
+        """Snapshot of a call with its talk time in seconds"""
+        with self._lock:
+            call = dict(self._calls.get(call_id) or {"id": call_id, "state": "ended", "answered": False,
+                                                     "connected_at": None, "ended_at": None})
+        if call["connected_at"] is not None:
+            call["duration"] = int((call["ended_at"] or time.time()) - call["connected_at"])
+        else:
+            call["duration"] = 0
+        return call
+
+    def _answer(self, call_id):
+        with self._lock:
+            call = self._calls.get(call_id)
+            if call and call["state"] == "ringing":
+                call.update(state="connected", answered=True, connected_at=time.time())
+
+    def _hangup(self, call_id):
+        with self._lock:
+            call = self._calls.get(call_id)
+            if call and call["state"] in self.LIVE_STATES:
+                call.update(state="ended", ended_at=time.time())
+
+    def _forget_finished(self, now):
+        for call_id in [i for i, c in self._calls.items()
+                        if c["ended_at"] is not None and now - c["ended_at"] > DIALER_KEEP_SECONDS]:
+            del self._calls[call_id]
+
+
+@st.cache_resource
+def get_dialer():
+    return FakeDialer()
+
+
+def render_call_status(call):
+    minutes, seconds = divmod(call["duration"], 60)
+    if call["state"] == "ringing":
+        st.info(f"🔔 Ringing… ({int(time.time() - call['started_at'])}s)")
+    elif call["state"] == "connected":
+        st.success(f"🟢 Connected • {minutes}:{seconds:02d}")
+    elif call["answered"]:
+        st.info(f"📴 Call ended • talk time {minutes}:{seconds:02d}")
+    else:
+        st.warning("📴 No answer")
+
+
+@st.fragment(run_every=DIALER_POLL_SECONDS)
+def live_call_panel(call_id):
+    """Polls the dialer without re-running the whole script"""
+    dialer = get_dialer()
+    call = dialer.status(call_id)
+    render_call_status(call)
+    if call["state"] in FakeDialer.LIVE_STATES:
+        st.button("📴 Hang up", key=f"hangup_{call_id}", on_click=dialer.hangup, args=(call_id,))
+    else:
+        # One full rerun renders the final state statically and stops the polling
+        st.rerun()
+
+
+def end_active_call():
+    call_id = st.session_state.pop('active_call', None)
+    if call_id is not None:
+        get_dialer().hangup(call_id)
+
+
+# Call and history panels. These are fragments: their buttons and forms rerun
+# only the panel, and state changes go through widget callbacks so the panel
+# renders the new state in that same rerun.
+def show_flash():
+    # Messages queued by callbacks for the next (possibly fragment-only) rerun
+    if st.session_state.get('flash'):
+        st.toast(st.session_state.pop('flash'))
+    if st.session_state.get('flash_error'):
+        st.error(st.session_state.pop('flash_error'))
+
+def select_customer(customer):
+    st.session_state.selected_customer = customer
+
+def next_call(rm_code):
+    """Take the best customer off the RM's queue and open them in the call panel"""
+    queue = call_queue(rm_code)
+    customer = None
+    while customer is None and len(queue):
+        customer = st.session_state.customers.get(queue.take())
+    if customer is None:
+        st.session_state.flash = "🎉 No customers left in your queue"
+        return
+    st.session_state.selected_customer = customer
+    st.session_state.queued_customer = customer.get('id')
+
+def show_history(customer):
+    st.session_state.view_customer_history = customer
+
+def log_call(customer, outcome, notes, callback_due=""):
+    """Append the call and update the customer's status, last contact and call count"""
+    call_entry = {
+        "customer_id": customer.get('id'),
+        "customer": customer.get('name', ''),
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "outcome": outcome,
+        "notes": notes
+    }
+    if not save_call_log(call_entry):
+        return
+    record_call(customer, outcome, callback_due)
+    st.session_state.flash = "✅ Call logged successfully!"
+    if callback_due and outcome == "Callback":
+        st.session_state.flash += f" Callback due {callback_due}."
 
-# Initialize session state
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
-if 'current_user' not in st.session_state:
-    st.session_state.current_user = None
-if 'customers' not in st.session_state:
-    st.session_state.customers = []
-if 'call_log' not in st.session_state:
-    st.session_state.call_log = []
-if 'selected_customer' not in st.session_state:
-    st.session_state.selected_customer = None
-if 'view_customer_history' not in st.session_state:
-    st.session_state.view_customer_history = None
+def log_call_from_form(customer, outcome_key, notes_key, due_prefix=None):
+    """Log a call from widget values; ``due_prefix`` names the callback date/time widgets"""
+    outcome = st.session_state[outcome_key]
+    callback_due = ""
+    if outcome == "Callback":
+        default = default_callback_due()
+        date = st.session_state.get(f"{due_prefix}_date", default.date()) if due_prefix else default.date()
+        at = st.session_state.get(f"{due_prefix}_time", default.time()) if due_prefix else default.time()
+        callback_due = datetime.combine(date, at).strftime("%Y-%m-%d %H:%M")
+    log_call(customer, outcome, st.session_state.get(notes_key, ""), callback_due)
 
-# File paths
+def default_callback_due():
+    due = datetime.now() + timedelta(hours=CALLBACK_DEFAULT_HOURS)
+    return due.replace(minute=0, second=0, microsecond=0)
 
-# Get the folder where your main.py is
-BASE_DIR = os.path.dirname(__file__)
+def callback_due_inputs(prefix, label="Call back on"):
+    """Date and time pickers for a Callback's due time"""
+    default = default_callback_due()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.date_input(label, value=default.date(), key=f"{prefix}_date")
+    with col2:
+        st.time_input("at", value=default.time(), key=f"{prefix}_time", step=timedelta(minutes=15))
 
-# Relative path to the logo
-LOGO_PATH = os.path.join(BASE_DIR, "Logo-CMCB.png") 
-CUSTOMERS_FILE = os.path.join(BASE_DIR, "sample_customers.csv")
-CALL_LOG_FILE = os.path.join(BASE_DIR, "call_log.csv")
+def start_call(customer):
+    st.session_state.active_call = get_dialer().dial(customer.get('phone'))
 
-# Load data from CSV files
-def load_data():
-    """Load customer data and call log"""
+def finish_call(customer, outcome_key=None, notes_key=None, due_prefix=None):
+    """Log Call (with widget keys) or Cancel (without); either way the panel is cleared"""
+    if outcome_key is not None:
+        log_call_from_form(customer, outcome_key, notes_key, due_prefix)
+    elif st.session_state.get('queued_customer') == customer.get('id'):
+        # Skipped: back into the queue, behind everyone not skipped yet
+        current = st.session_state.customers.get(customer.get('id')) or customer
+        call_queue(current.get('rm_code')).defer(current)
+    st.session_state.pop('queued_customer', None)
+    end_active_call()
+    st.session_state.pop(f"call_notes_{customer.get('id', '')}", None)
+    st.session_state.selected_customer = None
+
+def more_history(pages_key):
+    st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+
+
+@contextlib.contextmanager
+def fragment_trace(name):
+    """Time a fragment; a fragment-only rerun gets a rerun log event of its own"""
+    if 'rerun_trace' in st.session_state:
+        with trace_span(name):
+            yield
+        return
+    start_rerun_trace()
+    outcome = "rerun"
     try:
-        # Load customers
-        st.session_state.customers = pd.read_csv(CUSTOMERS_FILE).to_dict('records')
-        
-        # Ensure required fields exist
-        for customer in st.session_state.customers:
-            if 'rm_code' not in customer:
-                customer['rm_code'] = "001"
-            if 'call_count' not in customer:
-                customer['call_count'] = 0
-            if 'last_contact' not in customer:
-                customer['last_contact'] = datetime.now().strftime("%Y-%m-%d")
-    except Exception as e:
-        st.error(f"Error loading customer data: {e}")
-        # Fallback sample data
-        st.session_state.customers = [
-            {"id": 1, "name": "Sok Dara", "business": "Sok Dara Grocery", "phone": "010 123 456", 
-             "email": "sokdara@email.com", "potential": "H", "status": "New Lead", 
-             "last_contact": "2023-01-15", "call_count": 0, "rm_code": "001"},
-            {"id": 2, "name": "Lim Srey", "business": "Srey Fashion", "phone": "011 234 567", 
-             "email": "limsrey@email.com", "potential": "M", "status": "Pending", 
-             "last_contact": "2023-02-20", "call_count": 2, "rm_code": "001"},
-            {"id": 3, "name": "Chen Lao", "business": "Lao Construction", "phone": "012 345 678", 
-             "email": "chenlao@email.com", "potential": "L", "status": "Completed", 
-             "last_contact": "2023-03-10", "call_count": 1, "rm_code": "001"},
-        ]
-    if os.path.exists(CALL_LOG_FILE) and os.path.getsize(CALL_LOG_FILE) > 0:
-        try:
-        # Specify column names if CSV has no header
-            columns = ["rm_code", "customer_name", "call_date", "call_count", "notes"]  # adjust to your actual columns
-            st.session_state.call_log = pd.read_csv(CALL_LOG_FILE, names=columns).to_dict('records')
-        except Exception as e:
-            st.error(f"Error reading call log: {e}")
-            st.session_state.call_log = []
-    else:
-        st.session_state.call_log = []
-        save_call_log()
-# Save data to CSV files
-def save_call_log():
-    df = pd.DataFrame(st.session_state.call_log)
-    df.to_csv(CALL_LOG_FILE, index=False)
+        with trace_span(name):
+            yield
+        outcome = "fragment"
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        finish_rerun_trace(outcome)
+
+
+@st.fragment(run_every=CALLBACK_POLL_SECONDS)
+def callback_nudge():
+    """Due callback counts, refreshed on a timer; toasts when more come due"""
+    with fragment_trace("fragment:callback_nudge"):
+        scheduler = get_callback_scheduler()
+        rm_code = st.session_state.rm_code
+        due_now = scheduler.due_now(rm_code)
+        st.markdown(f"🔔 **{due_now}** callbacks due now · {scheduler.due_later_today(rm_code)} later today")
+        seen = st.session_state.get('callbacks_due_seen', 0)
+        if due_now > seen:
+            st.toast(f"🔔 {due_now - seen} callback{'s' if due_now - seen > 1 else ''} due — see Make Calls")
+        st.session_state.callbacks_due_seen = due_now
+
+
+@st.fragment
+def call_panel():
+    """Make Calls tab body"""
+    with fragment_trace("fragment:call_panel"):
+        show_flash()
+        if not st.session_state.selected_customer:
+            rm_code = st.session_state.rm_code
+            due_callbacks = get_callback_scheduler().due(rm_code, CALLBACKS_SHOWN)
+            if due_callbacks:
+                st.markdown("**🔔 Callbacks due now**")
+                for due_at, due_id in due_callbacks:
+                    customer = st.session_state.customers.get(due_id)
+                    if customer is None:
+                        continue
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        st.markdown(f"{customer.get('name', 'N/A')} · {customer.get('phone', '')} · "
+                                    f"due {datetime.fromtimestamp(due_at).strftime('%Y-%m-%d %H:%M')}")
+                    with col2:
+                        st.button("📞 Call", key=f"callback_{due_id}", on_click=select_customer, args=(customer,))
+            queue = call_queue(rm_code)
+            st.info("Take the next best call from your queue, or select a customer from the Customer List tab")
+            st.button("⏭️ Next call", type="primary", disabled=not len(queue), key="next_call",
+                      on_click=next_call, args=(rm_code,))
+            upcoming = queue.peek(CALL_QUEUE_PREVIEW)
+            if upcoming:
+                st.caption(f"Up next of {len(queue)} customers in your queue")
+                for score, upcoming_id in upcoming:
+                    customer = st.session_state.customers.get(upcoming_id) or {}
+                    st.markdown(f"- **{customer.get('name', 'N/A')}** · {customer.get('business', '')} · "
+                                f"{customer.get('potential', '')} · {customer.get('status', '')} "
+                                f"(score {score:.0f})")
+            return
+        selected = st.session_state.selected_customer
+        customer = st.session_state.customers.get(selected.get('id')) or selected
+        customer_id = customer.get('id', '')
+        st.markdown(f"### Calling: {customer.get('name', 'N/A')}")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"**Business:** {customer.get('business', 'N/A')}")
+            st.markdown(f"**Phone:** 📞 {customer.get('phone', 'N/A')}")
+            potential = customer.get('potential', '')
+            potential_color = "red" if potential == 'H' else "orange" if potential == 'M' else "green"
+            st.markdown(f"**Potential:** <span style='color: {potential_color};'>{potential}</span>", 
+                       unsafe_allow_html=True)
+
+        with col2:
+            st.markdown(f"**Last Contact:** {customer.get('last_contact', 'N/A')}")
+            status = customer.get('status', '')
+            st.markdown(f"**Status:** <span class='status-{status.lower()}'>{status}</span>", 
+                       unsafe_allow_html=True)
+            if status == "Callback" and customer.get('callback_due'):
+                st.markdown(f"**Callback Due:** 🔔 {customer.get('callback_due')}")
+
+        # Call notes
+        notes_key = f"call_notes_{customer_id}"
+        st.text_area("Call Notes", placeholder="Enter details about the conversation...", key=notes_key)
+
+        # Live call state from the dialer; polling runs in a nested fragment
+        call_id = st.session_state.get('active_call')
+        call = get_dialer().status(call_id) if call_id is not None else None
+        if call is not None:
+            if call["state"] in FakeDialer.LIVE_STATES:
+                live_call_panel(call_id)
+            else:
+                render_call_status(call)
+
+        # Call outcome; an unanswered call defaults to Missed. The key changes with
+        # the default so the radio resets when the call ends unanswered.
+        outcomes = ["Completed", "Missed", "Callback"]
+        unanswered = call is not None and call["state"] == "ended" and not call["answered"]
+        outcome_key = f"call_outcome_{customer_id}_{call_id}_{'missed' if unanswered else 'default'}"
+        st.radio("Call Outcome", outcomes, index=1 if unanswered else 0, key=outcome_key)
+        due_prefix = f"call_callback_{customer_id}"
+        if st.session_state.get(outcome_key) == "Callback":
+            callback_due_inputs(due_prefix)
+
+        # Call actions
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            live = call is not None and call["state"] in FakeDialer.LIVE_STATES
+            st.button("📞 Start Call", width="stretch", disabled=live,
+                      on_click=start_call, args=(customer,))
+        with col2:
+            st.button("✅ Log Call", width="stretch",
+                      on_click=finish_call, args=(customer, outcome_key, notes_key, due_prefix))
+        with col3:
+            st.button("❌ Cancel", width="stretch", on_click=finish_call, args=(customer,))
+
+
+@st.fragment
+def history_panel(customer):
+    """One customer's details, call history and log-call form"""
+    with fragment_trace("fragment:history_panel"):
+        show_flash()
+        customer = st.session_state.customers.get(customer.get('id')) or customer
+        customer_id = customer.get('id', '')
+        st.success(f"Found customer: {customer.get('name', 'N/A')}")
+
+        # Display customer info
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"**Name:** {customer.get('name', 'N/A')}")
+            st.markdown(f"**Business:** {customer.get('business', 'N/A')}")
+            st.markdown(f"**Phone:** {customer.get('phone', 'N/A')}")
+
+        with col2:
+            potential = customer.get('potential', '')
+            potential_color = {"H": "red", "M": "orange", "L": "green"}.get(potential, "black")
+            st.markdown(f"**Potential:** <span style='color: {potential_color};'>{potential}</span>", 
+                       unsafe_allow_html=True)
+            st.markdown(f"**Status:** {customer.get('status', 'N/A')}")
+            st.markdown(f"**Last Contact:** {customer.get('last_contact', 'N/A')}")
+
+        # Display call history
+        st.subheader("📋 Call History")
+
+        # Newest calls for this customer, one page per "load more"
+        storage = get_storage()
+        if storage.supports_queries:
+            history = storage
+        else:
+            history = TieredCallHistory(st.session_state.call_log, get_archived_history(),
+                                        st.session_state.call_window_start, customer.get('rm_code'),
+                                        legacy_call_resolver(st.session_state.customers))
+        merged_ids = st.session_state.customers.merged_ids(customer.get('id'))
+        if merged_ids:
+            # Calls logged for customers merged into this one are part of its history
+            history = MergedCallHistory(history, customer.get('id'), merged_ids)
+        pages_key = f"history_pages_{customer_id}"
+        pages = st.session_state.get(pages_key, 1)
+        customer_calls, cursor = [], None
+        for _ in range(pages):
+            page, cursor = history.page(customer.get('id'), HISTORY_PAGE_SIZE, cursor)
+            customer_calls.extend(page)
+            if cursor is None:
+                break
+
+        for call in customer_calls:  # Most recent first
+            st.markdown(f"""
+            <div class="customer-card">
+                <strong>{call.get('date', '')}</strong> - 
+                <span class="status-{call.get('outcome', '').lower()}">{call.get('outcome', '')}</span><br>
+                <em>{call.get('notes') or 'No notes'}</em>
+            </div>
+            """, unsafe_allow_html=True)
+        if cursor is not None:
+            total = history.count(customer.get('id'))
+            if total is None:
+                st.caption(f"Showing {len(customer_calls)} calls; older months are loaded on request")
+            else:
+                st.caption(f"Showing {len(customer_calls)} of {total} calls")
+            st.button("⬇️ Load more", key=f"history_more_{customer_id}", on_click=more_history, args=(pages_key,))
+        elif not customer_calls:
+            st.info("No call history found for this customer.")
+
+        # Add new call entry
+        st.subheader("📝 Log New Call")
+        notes_key, outcome_key = f"history_notes_{customer_id}", f"history_outcome_{customer_id}"
+        with st.form(key=f"log_call_form_{customer_id}", clear_on_submit=True):
+            st.text_area("Call Notes", placeholder="Enter details about the conversation...", key=notes_key)
+            st.radio("Call Outcome", ["Completed", "Missed", "Callback", "Not Interested"], key=outcome_key)
+            # Forms can't react to the outcome, so the pickers are always there and only used for Callback
+            due_prefix = f"history_callback_{customer_id}"
+            callback_due_inputs(due_prefix, "Call back on (Callback only)")
+            st.form_submit_button("💾 Save Call Log", on_click=log_call_from_form,
+                                  args=(customer, outcome_key, notes_key, due_prefix))
+
 
 # User authentication
 def authenticate_user(username, rm_code):
@@ -204,6 +4036,15 @@ def login_form():
     st.markdown("</div>", unsafe_allow_html=True)
 # Main app
 def main_app():
+    refresh_snapshot()
+    show_flash()
+    with st.sidebar:
+        callback_nudge()
+        failed = st.session_state.customers.failed_writes()
+        if failed:
+            st.error(f"⚠️ {len(failed)} customer change(s) could not be saved and only show in this session: "
+                     f"{list(failed.values())[-1]}")
+
     # Header with logo
     col1, col2 = st.columns([1, 3])
     with col1:
@@ -227,415 +4068,511 @@ def main_app():
         """, unsafe_allow_html=True)
     
     # Filter customers by RM code
-    user_customers = [c for c in st.session_state.customers if c.get('rm_code') == st.session_state.rm_code]
+    trace_count("customers", len(st.session_state.customers))
+    trace_count("call_log_rows", len(st.session_state.call_log))
+    trace_count("overlay_edits", st.session_state.customers.edit_count())
     
-    # Main tabs
-    tab1, tab2, tab3 = st.tabs(["📋 Customer List", "📞 Make Calls", "📊 Performance"])
+    # Main tabs. Switching tabs reruns the script and only the open tab's body runs,
+    # so typing in the directory no longer recomputes the other tabs.
+    tab1, tab2, tab3, tab4 = st.tabs(["📋 Customer List", "📞 Make Calls", "📊 Performance", "🏢 Branch Scorecards"],
+                                     key="main_tab", on_change="rerun")
 
-    with tab1:
-        st.markdown("""
-        <div class="call-card">
-            <h2>👥 Customer Relationship Management</h2>
-            <p>Manage customer contacts, track call history, and add new customers</p>
-        </div>
-        """, unsafe_allow_html=True)
+    if tab1.open:
+        with tab1, trace_span("tab:customer_list"):
+            st.markdown("""
+            <div class="call-card">
+                <h2>👥 Customer Relationship Management</h2>
+                <p>Manage customer contacts, track call history, and add new customers</p>
+            </div>
+            """, unsafe_allow_html=True)
         
-        # Create tabs for different functionalities
-        cust_tab1, cust_tab2, cust_tab3 = st.tabs(["📋 Customer Directory", "📞 Call History Lookup", "➕ Add New Customer"])
+            # Create tabs for different functionalities
+            cust_tab1, cust_tab2, cust_tab3, cust_tab4, cust_tab5 = st.tabs(
+                ["📋 Customer Directory", "📞 Call History Lookup", "➕ Add New Customer", "📥 Bulk Import",
+                 "🔁 Duplicates"], key="customer_tab", on_change="rerun")
         
-        with cust_tab1:
-            st.markdown("### 🔍 Search & Filter Customers")
+            if cust_tab1.open:
+                with cust_tab1, trace_span("tab:directory"):
+                    st.markdown("### 🔍 Search & Filter Customers")
             
-            # Search and filter
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                search_term = st.text_input("Search by name or business", key="search_main")
-            with col2:
-                status_filter = st.selectbox("Filter by status", ["All", "Pending", "Completed", "Missed", "New Lead"], key="status_filter")
-            with col3:
-                potential_filter = st.selectbox("Filter by potential", ["All", "H (High)", "M (Medium)", "L (Low)"], key="potential_filter")
-            with col4:
-                sort_by = st.selectbox("Sort by", ["Name", "Last Contact", "Potential", "Status"], key="sort_by")
+                    # Search and filter
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        search_term = st.text_input("Search by name or business", key="search_main")
+                        fuzzy_search = st.checkbox("Typo-tolerant", key="search_fuzzy",
+                                                   help="Also match spelling variants such as Sok / Sokh")
+                    with col2:
+                        status_filter = st.selectbox("Filter by status", ["All", "Pending", "Completed", "Missed",
+                                                                          "New Lead", "Callback", "Not Interested"],
+                                                     key="status_filter")
+                    with col3:
+                        potential_filter = st.selectbox("Filter by potential", ["All", "H (High)", "M (Medium)", "L (Low)"], key="potential_filter")
+                    with col4:
+                        sort_by = st.selectbox("Sort by", ["Relevance", "Name", "Last Contact", "Potential", "Status"], key="sort_by")
             
-            # Filter customers
-            filtered_customers = user_customers.copy()
-            if search_term:
-                filtered_customers = [c for c in filtered_customers if search_term.lower() in str(c.get('name', '')).lower() or search_term.lower() in str(c.get('business', '')).lower()]
-            if status_filter != "All":
-                filtered_customers = [c for c in filtered_customers if c.get('status') == status_filter]
-            if potential_filter != "All":
-                potential_value = potential_filter[0]  # Get H, M, or L
-                filtered_customers = [c for c in filtered_customers if c.get('potential') == potential_value]
+                    # Filter and sort customers
+                    status_value = status_filter if status_filter != "All" else None
+                    potential_value = potential_filter[0] if potential_filter != "All" else None  # Get H, M, or L
+                    storage = get_storage()
+                    if storage.supports_queries and not fuzzy_search:
+                        # The database filters, sorts and pages; only the visible page is fetched.
+                        # It only knows acknowledged writes, so this session's queued edits go first.
+                        if st.session_state.customers.unpersisted_edits():
+                            with trace_span("write:flush"):
+                                get_commit_service().flush(timeout=10)
+                        with trace_span("filter"):
+                            filtered_customers = storage.query_customers(
+                                st.session_state.rm_code, search_term, status_value, potential_value, sort_by)
+                            len(filtered_customers)
+                    else:
+                        # Reused across tab switches until the data or the filters change
+                        filters = (search_term, fuzzy_search, status_value, potential_value, sort_by)
+                        filtered_customers = tab_memo(
+                            "directory", (data_version(), filters),
+                            lambda: filter_customers(rm_customers(), *filters))
             
-            # Sort customers
-            if sort_by == "Name":
-                filtered_customers.sort(key=lambda x: x.get('name', ''))
-            elif sort_by == "Last Contact":
-                filtered_customers.sort(key=lambda x: x.get('last_contact', ''), reverse=True)
-            elif sort_by == "Potential":
-                potential_order = {"H": 1, "M": 2, "L": 3}
-                filtered_customers.sort(key=lambda x: potential_order.get(x.get('potential', ''), 4))
-            elif sort_by == "Status":
-                status_order = {"New Lead": 1, "Pending": 2, "Completed": 3, "Missed": 4}
-                filtered_customers.sort(key=lambda x: status_order.get(x.get('status', ''), 5))
+                    trace_count("directory_results", len(filtered_customers))
             
-            # Display customers
-            st.subheader(f"📋 Customers ({len(filtered_customers)})")
+                    # Display customers
+                    st.subheader(f"📋 Customers ({len(filtered_customers)})")
             
-            if not filtered_customers:
-                st.info("No customers match your search criteria.")
+                    if not filtered_customers:
+                        st.info("No customers match your search criteria.")
             
-            for customer in filtered_customers:
-                with st.container():
-                    st.markdown("---")
-                    col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 1, 1])
-                    
+                    # Pagination: only the current page is rendered
+                    col1, col2, col3 = st.columns([1, 1, 2])
                     with col1:
-                        st.markdown(f"**{customer.get('name', 'N/A')}**")
-                        st.markdown(f"*{customer.get('business', 'N/A')}*")
-                        st.markdown(f"📞 {customer.get('phone', 'N/A')}")
-                        if 'email' in customer:
-                            st.markdown(f"📧 {customer.get('email', 'N/A')}")
-                    
+                        page_size = st.selectbox("Per page", DIRECTORY_PAGE_SIZES, key="directory_page_size")
+                    page_count = max(1, -(-len(filtered_customers) // page_size))
+                    # Back to the first page whenever the result set changes
+                    directory_view = (search_term, fuzzy_search, status_filter, potential_filter, sort_by, page_size)
+                    if st.session_state.get('directory_view') != directory_view:
+                        st.session_state.directory_view = directory_view
+                        st.session_state.directory_page = 1
+                    st.session_state.directory_page = min(st.session_state.get('directory_page', 1), page_count)
                     with col2:
-                        # Potential badge
-                        potential = customer.get('potential', '')
-                        potential_color = {"H": "red", "M": "orange", "L": "green"}.get(potential, "black")
-                        st.markdown(f"<span style='color: {potential_color}; font-weight: bold;'>Potential: {potential}</span>", 
-                                   unsafe_allow_html=True)
-                        st.markdown(f"Last contact: {customer.get('last_contact', 'N/A')}")
+                        page = st.number_input("Jump to page", min_value=1, max_value=page_count,
+                                               step=1, key="directory_page")
+                    with col3:
+                        view_mode = st.radio("View", ["Cards", "Compact table"], horizontal=True, key="directory_view_mode")
+            
+                    page_start = (page - 1) * page_size
+                    page_customers = filtered_customers[page_start:page_start + page_size]
+                    if filtered_customers:
+                        st.caption(f"Showing {page_start + 1}–{page_start + len(page_customers)} of "
+                                   f"{len(filtered_customers)} • Page {page} of {page_count}")
+            
+                    if view_mode == "Compact table" and page_customers:
+                        table = pd.DataFrame(page_customers).reindex(
+                            columns=['name', 'business', 'phone', 'potential', 'status', 'last_contact', 'call_count'])
+                        selection = st.dataframe(table, hide_index=True, width="stretch",
+                                                 on_select="rerun", selection_mode="single-row",
+                                                 key="directory_table")
+                        selected_rows = selection.selection.rows
+                        if selected_rows:
+                            customer = page_customers[selected_rows[0]]
+                            col1, col2, col3 = st.columns([3, 1, 1])
+                            with col1:
+                                st.markdown(f"Selected: **{customer.get('name', 'N/A')}** • {customer.get('business', 'N/A')}")
+                            with col2:
+                                st.button("📞 Call", key="table_call", width="stretch",
+                                          on_click=select_customer, args=(customer,))
+                            with col3:
+                                st.button("📋 History", key="table_history", width="stretch",
+                                          on_click=show_history, args=(customer,))
+                        else:
+                            st.caption("Select a row to call the customer or view their history.")
+                        page_customers = []
+            
+                    for customer in page_customers:
+                        with st.container():
+                            st.markdown("---")
+                            col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 1, 1])
+                    
+                            with col1:
+                                st.markdown(f"**{customer.get('name', 'N/A')}**")
+                                st.markdown(f"*{customer.get('business', 'N/A')}*")
+                                st.markdown(f"📞 {customer.get('phone', 'N/A')}")
+                                if customer.get('email'):
+                                    st.markdown(f"📧 {customer.get('email', 'N/A')}")
+                    
+                            with col2:
+                                # Potential badge
+                                potential = customer.get('potential', '')
+                                potential_color = {"H": "red", "M": "orange", "L": "green"}.get(potential, "black")
+                                st.markdown(f"<span style='color: {potential_color}; font-weight: bold;'>Potential: {potential}</span>", 
+                                           unsafe_allow_html=True)
+                                st.markdown(f"Last contact: {customer.get('last_contact', 'N/A')}")
                         
-                        # Call count if available
-                        if 'call_count' in customer:
-                            st.markdown(f"Calls: {customer.get('call_count', 0)}")
+                                # Call count if available
+                                if 'call_count' in customer:
+                                    st.markdown(f"Calls: {customer.get('call_count', 0)}")
                     
-                    with col3:
-                        # Status badge
-                        status = customer.get('status', '')
-                        status_class = f"status-{status.lower().replace(' ', '-')}" if status else "status-pending"
-                        st.markdown(f"<span class='{status_class}'>{status}</span>", 
-                                   unsafe_allow_html=True)
+                            with col3:
+                                # Status badge
+                                status = customer.get('status', '')
+                                status_class = f"status-{status.lower().replace(' ', '-')}" if status else "status-pending"
+                                st.markdown(f"<span class='{status_class}'>{status}</span>", 
+                                           unsafe_allow_html=True)
                     
-                    with col4:
-                        if st.button("📞 Call", key=f"call_{customer.get('id', '')}"):
-                            st.session_state.selected_customer = customer
-                            st.rerun()
+                            with col4:
+                                st.button("📞 Call", key=f"call_{customer.get('id', '')}",
+                                          on_click=select_customer, args=(customer,))
                     
-                    with col5:
-                        if st.button("📋 History", key=f"history_{customer.get('id', '')}"):
-                            st.session_state.view_customer_history = customer
-                            st.rerun()
+                            with col5:
+                                st.button("📋 History", key=f"history_{customer.get('id', '')}",
+                                          on_click=show_history, args=(customer,))
 
-        with cust_tab2:
-            st.markdown("### 📞 Call History Lookup")
-            
-            col1, col2 = st.columns([2, 1])
-            with col1:
-                phone_search = st.text_input("Enter customer phone number", placeholder="e.g., 010 123 456")
-            with col2:
-                st.markdown("<br>", unsafe_allow_html=True)
-                search_btn = st.button("🔍 Search History", use_container_width=True)
+            if cust_tab2.open:
+                with cust_tab2, trace_span("tab:history_lookup"):
+                    st.markdown("### 📞 Call History Lookup")
             
-            if phone_search or (st.session_state.get('view_customer_history') and cust_tab2):
-                # Determine which customer to show
-                if st.session_state.get('view_customer_history'):
-                    customer = st.session_state.view_customer_history
-                    phone_search = customer.get('phone', '')
-                else:
-                    # Find customer by phone
-                    customer = next((c for c in user_customers if c.get('phone') == phone_search), None)
-                
-                if customer:
-                    st.success(f"Found customer: {customer.get('name', 'N/A')}")
-                    
-                    # Display customer info
-                    col1, col2 = st.columns(2)
+                    col1, col2 = st.columns([2, 1])
                     with col1:
-                        st.markdown(f"**Name:** {customer.get('name', 'N/A')}")
-                        st.markdown(f"**Business:** {customer.get('business', 'N/A')}")
-                        st.markdown(f"**Phone:** {customer.get('phone', 'N/A')}")
-                    
+                        phone_search = st.text_input("Enter customer phone number", placeholder="e.g., 010 123 456")
                     with col2:
-                        potential = customer.get('potential', '')
-                        potential_color = {"H": "red", "M": "orange", "L": "green"}.get(potential, "black")
-                        st.markdown(f"**Potential:** <span style='color: {potential_color};'>{potential}</span>", 
-                                   unsafe_allow_html=True)
-                        st.markdown(f"**Status:** {customer.get('status', 'N/A')}")
-                        st.markdown(f"**Last Contact:** {customer.get('last_contact', 'N/A')}")
-
-                    # Display call history
-                    st.subheader("📋 Call History")
-                    
-                    # Filter call log for this customer
-                    customer_name = customer.get('name', '')
-                    customer_calls = [call for call in st.session_state.call_log if call.get('customer') == customer_name]
-                    
-                    if customer_calls:
-                        for call in reversed(customer_calls):  # Show most recent first
-                            st.markdown(f"""
-                            <div class="customer-card">
-                                <strong>{call.get('date', '')}</strong> - 
-                                <span class="status-{call.get('outcome', '').lower()}">{call.get('outcome', '')}</span><br>
-                                <em>{call.get('notes', 'No notes')}</em>
-                            </div>
-                            """, unsafe_allow_html=True)
+                        st.markdown("<br>", unsafe_allow_html=True)
+                        search_btn = st.button("🔍 Search History", width="stretch")
+            
+                    if phone_search or (st.session_state.get('view_customer_history') and cust_tab2):
+                        # Determine which customer to show
+                        if st.session_state.get('view_customer_history'):
+                            customer = st.session_state.view_customer_history
+                            phone_search = customer.get('phone', '')
+                        else:
+                            # Find customer by phone
+                            customer = st.session_state.customers.find_by_phone(phone_search, st.session_state.rm_code)
+                
+                        if customer:
+                            history_panel(customer)
+                        else:
+                            st.warning("No customer found with that phone number.")
                     else:
-                        st.info("No call history found for this customer.")
-                    
-                    # Add new call entry
-                    st.subheader("📝 Log New Call")
-                    with st.form(key=f"log_call_form_{customer.get('id', '')}"):
-                        call_notes = st.text_area("Call Notes", placeholder="Enter details about the conversation...")
-                        call_outcome = st.radio("Call Outcome", ["Completed", "Missed", "Callback", "Not Interested"])
-                        
-                        if st.form_submit_button("💾 Save Call Log"):
-                            # Log the call
-                            call_entry = {
-                                "customer": customer.get('name', ''),
-                                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                "outcome": call_outcome,
-                                "notes": call_notes
-                            }
-                            st.session_state.call_log.append(call_entry)
-                            save_call_log()
-                            
-                            # Update customer status and last contact
-                            for i, c in enumerate(st.session_state.customers):
-                                if c.get('id') == customer.get('id'):
-                                    st.session_state.customers[i]['status'] = call_outcome
-                                    st.session_state.customers[i]['last_contact'] = datetime.now().strftime("%Y-%m-%d")
-                                    if 'call_count' in st.session_state.customers[i]:
-                                        st.session_state.customers[i]['call_count'] += 1
-                                    else:
-                                        st.session_state.customers[i]['call_count'] = 1
-                                    break
-                            
-                            st.success("Call logged successfully!")
-                            time.sleep(1)
-                            st.rerun()
-                    
-                else:
-                    st.warning("No customer found with that phone number.")
-            else:
-                st.info("Enter a phone number to search for call history")
+                        st.info("Enter a phone number to search for call history")
         
-        with cust_tab3:
-            st.markdown("### ➕ Add New Customer")
+            if cust_tab3.open:
+                with cust_tab3, trace_span("tab:add_customer"):
+                    st.markdown("### ➕ Add New Customer")
             
-            with st.form(key="add_customer_form"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.subheader("Basic Information")
-                    new_name = st.text_input("Full Name*", placeholder="e.g., Sok Dara")
-                    new_business = st.text_input("Business Name*", placeholder="e.g., Sok Dara Grocery")
-                    new_phone = st.text_input("Phone Number*", placeholder="e.g., 010 123 456")
-                    new_email = st.text_input("Email", placeholder="e.g., sokdara@email.com")
+                    with st.form(key="add_customer_form"):
+                        col1, col2 = st.columns(2)
                 
-                with col2:
-                    st.subheader("Additional Details")
-                    new_potential = st.selectbox("Potential Level*", ["H", "M", "L"])
-                    new_status = st.selectbox("Status*", ["New Lead", "Pending", "Completed", "Missed"])
-                    new_address = st.text_area("Address", placeholder="Full address")
-                    new_notes = st.text_area("Notes", placeholder="Any additional notes")
+                        with col1:
+                            st.subheader("Basic Information")
+                            new_name = st.text_input("Full Name*", placeholder="e.g., Sok Dara")
+                            new_business = st.text_input("Business Name*", placeholder="e.g., Sok Dara Grocery")
+                            new_phone = st.text_input("Phone Number*", placeholder="e.g., 010 123 456")
+                            new_email = st.text_input("Email", placeholder="e.g., sokdara@email.com")
                 
-                submitted = st.form_submit_button("Save Customer")
+                        with col2:
+                            st.subheader("Additional Details")
+                            new_potential = st.selectbox("Potential Level*", ["H", "M", "L"])
+                            new_status = st.selectbox("Status*", CUSTOMER_STATUSES)
+                            new_address = st.text_area("Address", placeholder="Full address")
+                            new_notes = st.text_area("Notes", placeholder="Any additional notes")
 
-            if submitted:
-                if not all([new_name, new_business, new_phone, new_potential, new_status]):
-                    st.error("Please fill all required fields.")
-                else:
-                    # Create new customer
-                    new_id = max([c.get('id', 0) for c in st.session_state.customers], default=0) + 1
-                    new_customer = {
-                        "id": new_id,
-                        "name": new_name,
-                        "business": new_business,
-                        "phone": new_phone,
-                        "email": new_email,
-                        "potential": new_potential,
-                        "status": new_status,
-                        "last_contact": datetime.now().strftime("%Y-%m-%d"),
-                        "call_count": 0,
-                        "rm_code": st.session_state.rm_code
-                    }
-                    
-                    st.session_state.customers.append(new_customer)
-                    st.success("✅ Customer added successfully!")
+                        allow_duplicate = st.checkbox("Save even if it looks like an existing customer")
+                        submitted = st.form_submit_button("Save Customer")
 
-    with tab2:
-        st.markdown("""
-        <div class="call-card">
-            <h2>📞 Make Calls</h2>
-            <p>Connect with customers and log your interactions</p>
-        </div>
-        """, unsafe_allow_html=True)
+                    if submitted:
+                        # Create new customer
+                        new_customer = {
+                            "name": new_name,
+                            "business": new_business,
+                            "phone": new_phone,
+                            "email": new_email,
+                            "potential": new_potential,
+                            "status": new_status,
+                            "last_contact": datetime.now().strftime("%Y-%m-%d"),
+                            "call_count": 0,
+                            "rm_code": st.session_state.rm_code,
+                            # A new Callback is due after the default delay, like one logged without a time
+                            "callback_due": (default_callback_due().strftime("%Y-%m-%d %H:%M")
+                                             if new_status == "Callback" else ""),
+                        }
+                        # Checked against the customers sharing a blocking key, not the whole book
+                        required = all([new_name, new_business, new_phone, new_potential, new_status])
+                        duplicates = find_duplicates(new_customer) if required and not allow_duplicate else []
+                        if not required:
+                            st.error("Please fill all required fields.")
+                        elif duplicates:
+                            listed = "\n".join(
+                                f"- **{c.get('name')}** · {c.get('business')} · {c.get('phone')} "
+                                f"(RM {c.get('rm_code')}, {reasons})"
+                                for _, reasons, c in duplicates[:DUPLICATE_MATCHES_SHOWN])
+                            st.warning(f"This looks like an existing customer:\n\n{listed}\n\n"
+                                       "Tick \"Save even if it looks like an existing customer\" to add it anyway.")
+                        else:
+                            # Gets its id now; the row is written by the commit service
+                            with trace_span("write:customers"):
+                                new_customer, written = get_commit_service().insert_customer(new_customer)
+                            st.session_state.customers.add(new_customer)
+                            st.session_state.customers.track_write(new_customer, written)
+                            st.session_state.search_extras.add(new_customer)
+                            requeue(new_customer)
+                            get_callback_scheduler().schedule(new_customer)
+                            bump_data_version()
+                            st.success("✅ Customer added successfully!")
         
-        if st.session_state.selected_customer:
-            customer = st.session_state.selected_customer
-            st.markdown(f"### Calling: {customer.get('name', 'N/A')}")
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown(f"**Business:** {customer.get('business', 'N/A')}")
-                st.markdown(f"**Phone:** 📞 {customer.get('phone', 'N/A')}")
-                potential = customer.get('potential', '')
-                potential_color = "red" if potential == 'H' else "orange" if potential == 'M' else "green"
-                st.markdown(f"**Potential:** <span style='color: {potential_color};'>{potential}</span>", 
-                           unsafe_allow_html=True)
-            
-            with col2:
-                st.markdown(f"**Last Contact:** {customer.get('last_contact', 'N/A')}")
-                status = customer.get('status', '')
-                st.markdown(f"**Status:** <span class='status-{status.lower()}'>{status}</span>", 
-                           unsafe_allow_html=True)
-            
-            # Call notes
-            call_notes = st.text_area("Call Notes", placeholder="Enter details about the conversation...")
+            if cust_tab4.open:
+                with cust_tab4, trace_span("tab:bulk_import"):
+                    st.markdown("### 📥 Bulk Import")
+                    st.caption("CSV with columns name, business, phone, potential (H/M/L) and status; "
+                               "email, last_contact (YYYY-MM-DD) and rm_code are optional. Rows are deduplicated "
+                               "on phone.")
             
-            # Call outcome
-            outcome = st.radio("Call Outcome", ["Completed", "Missed", "Callback"])
-            
-            # Call actions
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                if st.button("📞 Start Call", use_container_width=True):
-                    with st.spinner("Calling..."):
-                        time.sleep(2)  # Simulate call
-                        st.success(f"Connected to {customer.get('name', 'N/A')}")
-            
-            with col2:
-                if st.button("✅ Log Call", use_container_width=True):
-                    # Log the call
-                    call_entry = {
-                        "customer": customer.get('name', ''),
-                        "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                        "outcome": outcome,
-                        "notes": call_notes
-                    }
-                    st.session_state.call_log.append(call_entry)
-                    save_call_log()
-                    
-                    # Update customer status
-                    for i, c in enumerate(st.session_state.customers):
-                        if c.get('id') == customer.get('id'):
-                            st.session_state.customers[i]['status'] = outcome
-                            st.session_state.customers[i]['last_contact'] = datetime.now().strftime("%Y-%m-%d")
-                            if 'call_count' in st.session_state.customers[i]:
-                                st.session_state.customers[i]['call_count'] += 1
+                    job = st.session_state.get('import_job')
+                    if job is not None and not job.done:
+                        import_progress_panel()
+                    else:
+                        if job is not None:
+                            if job.state == "done":
+                                st.success(f"✅ Imported {job.imported:,} customers "
+                                           f"({job.duplicates:,} duplicates, {job.invalid:,} invalid rows skipped).")
                             else:
-                                st.session_state.customers[i]['call_count'] = 1
-                            break
-                    
-                    st.success("Call logged successfully!")
-                    time.sleep(1)
-                    st.session_state.selected_customer = None
-                    st.rerun()
-            
-            with col3:
-                if st.button("❌ Cancel", use_container_width=True):
-                    st.session_state.selected_customer = None
-                    st.rerun()
-        
-        else:
-            st.info("Select a customer from the Customer List tab to make a call")
+                                st.error(f"Import stopped after {job.imported:,} customers: {job.error}")
+                            if job.has_report:
+                                with open(job.error_report, "rb") as f:
+                                    st.download_button("⬇️ Download error report", f, file_name="import_errors.csv",
+                                                       mime="text/csv")
+                            if job.imported and not st.session_state.get('import_reloaded'):
+                                st.session_state.import_reloaded = True
+                                # Onto a snapshot with the imported customers, keeping this session's edits
+                                refresh_snapshot(reload=True)
+                
+                        upload = st.file_uploader("Customer portfolio (CSV)", type=["csv"], key="import_file")
+                        if upload is not None and st.button("🚀 Start Import"):
+                            st.session_state.import_reloaded = False
+                            if job is not None:
+                                job.discard()
+                            st.session_state.import_job = ImportJob(
+                                upload, upload.size, get_commit_service(), st.session_state.customers.phone_keys(),
+                                st.session_state.rm_code).start()
+                            st.rerun()
 
-    with tab3:
-        st.markdown("""
-        <div class="call-card">
-            <h2>📊 Performance Dashboard</h2>
-            <p>Track your calling performance and metrics</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Calculate metrics
-        total_customers = len(user_customers)
-        completed_calls = len([c for c in user_customers if c.get('status') == 'Completed'])
-        pending_calls = len([c for c in user_customers if c.get('status') == 'Pending'])
-        missed_calls = len([c for c in user_customers if c.get('status') == 'Missed'])
-        
-        high_potential = len([c for c in user_customers if c.get('potential') == 'H'])
-        medium_potential = len([c for c in user_customers if c.get('potential') == 'M'])
-        low_potential = len([c for c in user_customers if c.get('potential') == 'L'])
-        
-        # Display metrics
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>{total_customers}</h3>
-                <p>Total Customers</p>
+            if cust_tab5.open:
+                with cust_tab5, trace_span("tab:duplicates"):
+                    st.markdown("### 🔁 Duplicate Customers")
+                    show_flash()
+                    scope = st.radio("Show", ["My customers", "Whole book"], horizontal=True, key="duplicate_scope")
+                    # One blocking-key scan of the whole book per customer version, shared by every session
+                    pairs, stats = duplicate_pairs(st.session_state.rm_code if scope == "My customers" else None)
+                    trace_count("duplicate_pairs", len(pairs))
+                    trace_count("duplicate_split_blocks", stats['split_blocks'])
+                    trace_count("duplicate_fine_blocks", stats['fine_blocks'])
+                    trace_count("duplicate_skipped_blocks", stats['skipped_blocks'])
+                    likely = int((pairs['score'] >= DUPLICATE_MIN_SCORE).sum())
+                    st.caption(f"{likely:,} likely and {len(pairs) - likely:,} possible duplicate pairs; possible "
+                               f"ones share little more than a name. The last scan scored {stats['compared']:,} "
+                               f"pairs in {stats['blocks']:,} shared-key blocks of {stats['customers']:,} customers "
+                               f"in {stats['seconds']:.1f} s; {stats['split_blocks']:,} keys too common on their own "
+                               f"were split by a second key, {stats['fine_blocks']:,} still too common by email, "
+                               f"and {stats['skipped_blocks']:,} emails shared too widely were skipped. Merging "
+                               "keeps the customer you pick and moves the other's call history to it.")
+                    if stats['fine_blocks']:
+                        st.warning(f"{stats['fine_blocks']:,} combinations of name, business or phone prefix are "
+                                   f"shared by more than {DUPLICATE_MAX_SPLIT_BLOCK} customers. Within them only "
+                                   f"customers with the same phone or email are compared, so duplicates among "
+                                   f"their {stats['no_email']:,} customers without an email are only found when "
+                                   "the phone matches.")
+                    if not len(pairs):
+                        st.info("No likely or possible duplicates found.")
+                    store = st.session_state.customers
+                    for pair in pairs.head(DUPLICATE_PAIRS_SHOWN).itertuples(index=False):
+                        first, second = store.get(pair.id), store.get(pair.duplicate_id)
+                        if first is None or second is None:
+                            continue
+                        own = first.get('rm_code') == second.get('rm_code') == st.session_state.rm_code
+                        with st.container():
+                            st.markdown("---")
+                            band = "Likely" if pair.score >= DUPLICATE_MIN_SCORE else "Possible"
+                            st.markdown(f"**{band} duplicate** · score {pair.score:.2f} · {pair.reasons}")
+                            for column, keep, drop in zip(st.columns(2), (first, second), (second, first)):
+                                with column:
+                                    st.markdown(f"**{keep.get('name')}** · #{keep.get('id')} · "
+                                                f"RM {keep.get('rm_code')}")
+                                    st.caption(f"{keep.get('business')} · {keep.get('phone')} · "
+                                               f"{keep.get('call_count', 0)} calls · last contact "
+                                               f"{keep.get('last_contact')}")
+                                    if own:
+                                        st.button("✅ Keep this one", key=f"merge_{keep.get('id')}_{drop.get('id')}",
+                                                  on_click=merge_customers, args=(keep.get('id'), drop.get('id')))
+                            if not own:
+                                st.caption("Only two customers of your own portfolio can be merged.")
+                    if len(pairs) > DUPLICATE_PAIRS_SHOWN:
+                        st.caption(f"Showing the {DUPLICATE_PAIRS_SHOWN} best of {len(pairs):,} pairs.")
+
+    if tab2.open:
+        with tab2, trace_span("tab:make_calls"):
+            st.markdown("""
+            <div class="call-card">
+                <h2>📞 Make Calls</h2>
+                <p>Connect with customers and log your interactions</p>
             </div>
             """, unsafe_allow_html=True)
         
-        with col2:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>{completed_calls}</h3>
-                <p>Completed Calls</p>
+            call_panel()
+
+    if tab3.open:
+        with tab3, trace_span("tab:performance"):
+            st.markdown("""
+            <div class="call-card">
+                <h2>📊 Performance Dashboard</h2>
+                <p>Track your calling performance and metrics</p>
             </div>
             """, unsafe_allow_html=True)
         
-        with col3:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>{pending_calls}</h3>
-                <p>Pending Calls</p>
-            </div>
-            """, unsafe_allow_html=True)
+            # Shared per-RM numbers with this session's edits applied, see rm_aggregates
+            aggregates = rm_aggregates(st.session_state.rm_code)
+            total_customers = aggregates.total_customers
+            completed_calls = aggregates.status_counts['Completed']
+            pending_calls = aggregates.status_counts['Pending']
+            missed_calls = aggregates.status_counts['Missed']
         
-        with col4:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>{missed_calls}</h3>
-                <p>Missed Calls</p>
-            </div>
-            """, unsafe_allow_html=True)
+            high_potential = aggregates.potential_counts['H']
+            medium_potential = aggregates.potential_counts['M']
+            low_potential = aggregates.potential_counts['L']
         
-        # Potential metrics
-        st.subheader("Potential Distribution")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3 style="color: red;">{high_potential}</h3>
-                <p>High Potential</p>
-            </div>
-            """, unsafe_allow_html=True)
+            # Display metrics
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3>{total_customers}</h3>
+                    <p>Total Customers</p>
+                </div>
+                """, unsafe_allow_html=True)
         
-        with col2:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3 style="color: orange;">{medium_potential}</h3>
-                <p>Medium Potential</p>
-            </div>
-            """, unsafe_allow_html=True)
+            with col2:
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3>{completed_calls}</h3>
+                    <p>Completed Calls</p>
+                </div>
+                """, unsafe_allow_html=True)
         
-        with col3:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3 style="color: green;">{low_potential}</h3>
-                <p>Low Potential</p>
-            </div>
-            """, unsafe_allow_html=True)
+            with col3:
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3>{pending_calls}</h3>
+                    <p>Pending Calls</p>
+                </div>
+                """, unsafe_allow_html=True)
+        
+            with col4:
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3>{missed_calls}</h3>
+                    <p>Missed Calls</p>
+                </div>
+                """, unsafe_allow_html=True)
+        
+            # Potential metrics
+            st.subheader("Potential Distribution")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3 style="color: red;">{high_potential}</h3>
+                    <p>High Potential</p>
+                </div>
+                """, unsafe_allow_html=True)
         
-        # Call log
-        st.subheader("Recent Call Log")
-        user_call_log = [call for call in st.session_state.call_log 
-                         if any(c.get('name') == call.get('customer') and c.get('rm_code') == st.session_state.rm_code 
-                                for c in st.session_state.customers)]
+            with col2:
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3 style="color: orange;">{medium_potential}</h3>
+                    <p>Medium Potential</p>
+                </div>
+                """, unsafe_allow_html=True)
         
-        if user_call_log:
-            for log in reversed(user_call_log[-5:]):  # Show last 5 calls
+            with col3:
                 st.markdown(f"""
-                <div class="customer-card">
-                    <strong>{log.get('customer', '')}</strong> - {log.get('date', '')} 
-                    <span class="status-{log.get('outcome', '').lower()}">({log.get('outcome', '')})</span><br>
-                    <em>{log.get('notes', 'No notes')}</em>
+                <div class="metric-card">
+                    <h3 style="color: green;">{low_potential}</h3>
+                    <p>Low Potential</p>
                 </div>
                 """, unsafe_allow_html=True)
-        else:
-            st.info("No calls logged yet. Start making calls to see your activity here.")
+        
+            # Date-range trends and funnel, answered from the process-wide call rollups
+            st.subheader("📈 Call Trends")
+            today = datetime.now().date()
+            picked = st.date_input("Date range", value=(today - timedelta(days=TREND_DEFAULT_DAYS - 1), today),
+                                   max_value=today, key="trend_range")
+            # A range is picked one click at a time; the first click alone means that single day
+            first, last = (picked[0], picked[-1]) if picked else (today, today)
+            rollups = call_rollups()
+            if rollups is None:
+                rollups_pending_panel()
+            else:
+                with trace_span("rollups:trends"):
+                    daily, funnel, tiers, seconds = call_trends(rollups, st.session_state.rm_code,
+                                                                first.strftime("%Y-%m-%d"),
+                                                                (last + timedelta(days=1)).strftime("%Y-%m-%d"))
+                st.caption(f"{funnel.iloc[0]:,} calls from {first:%d %b %Y} to {last:%d %b %Y}, "
+                           f"answered from the call rollups in {seconds * 1000:.0f} ms.")
+                if funnel.iloc[0]:
+                    st.bar_chart(daily)
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.markdown("**Conversion Funnel**")
+                        funnel_table = funnel.to_frame()
+                        funnel_table["% of calls"] = (100 * funnel / funnel.iloc[0]).round(1)
+                        st.dataframe(funnel_table, width="stretch")
+                        st.bar_chart(funnel, horizontal=True, sort=False)
+                    with col2:
+                        st.markdown("**Calls by Potential**")
+                        st.dataframe(tiers, width="stretch")
+                else:
+                    st.info("No calls in this date range.")
+
+            # Call log
+            st.subheader("Recent Call Log")
+            user_call_log = aggregates.recent_calls
+        
+            if user_call_log:
+                for log in reversed(user_call_log):  # Most recent first
+                    st.markdown(f"""
+                    <div class="customer-card">
+                        <strong>{log.get('customer', '')}</strong> - {log.get('date', '')} 
+                        <span class="status-{log.get('outcome', '').lower()}">({log.get('outcome', '')})</span><br>
+                        <em>{log.get('notes') or 'No notes'}</em>
+                    </div>
+                    """, unsafe_allow_html=True)
+            else:
+                st.info("No calls logged yet. Start making calls to see your activity here.")
+
+    if tab4.open:
+        with tab4, trace_span("tab:scorecards"):
+            st.markdown("""
+            <div class="call-card">
+                <h2>🏢 Branch Scorecards</h2>
+                <p>Call volume, outcomes, contact rates and stale leads for every RM</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+            rollups = call_rollups()
+            if rollups is None:
+                rollups_pending_panel()
+            else:
+                period = st.selectbox("Period", list(SCORECARD_PERIODS), index=1, key="scorecard_period")
+                # Counted from the call rollups once per period and version, then shared
+                cards, daily, stats = branch_scorecards(rollups, SCORECARD_PERIODS[period])
+                trace_count("scorecard_calls", stats['calls'])
+                rebuild = rollups.rebuild_stats
+                st.caption(f"{stats['calls']:,} calls in {len(cards)} RM portfolios, counted from the call rollups "
+                           f"in {stats['seconds'] * 1000:.0f} ms (last full scan: {rebuild['tasks']} pieces by "
+                           f"{rebuild['workers']} worker process(es) in {rebuild['seconds']:.1f} s). "
+                           "Contact rate counts calls that reached the customer; stale leads are open leads "
+                           "by days since last contact.")
+                st.dataframe(cards, width="stretch")
+
+                st.subheader("Calls per Day")
+                rm_choices = list(cards.index)
+                default = [st.session_state.rm_code] if st.session_state.rm_code in rm_choices else rm_choices[:1]
+                chosen = st.multiselect("RMs", rm_choices, default=default, key="scorecard_rms")
+                if chosen:
+                    st.line_chart(daily.reindex(columns=chosen, fill_value=0))
 
     # Footer
     st.markdown("---")
@@ -648,11 +4585,23 @@ def main_app():
     )
 
 # Main app logic
-if not st.session_state.logged_in:
-    login_form()
-else:
-    main_app()
-    if st.sidebar.button("Logout"):
-        st.session_state.logged_in = False
-        st.session_state.current_user = None
-        st.rerun()
+start_rerun_trace()
+rerun_outcome = "rerun"  # st.rerun()/st.stop() leave through the finally block
+try:
+    if not st.session_state.logged_in:
+        login_form()
+    else:
+        main_app()
+        if st.sidebar.button("Logout"):
+            st.session_state.logged_in = False
+            st.session_state.current_user = None
+            st.rerun()
+        st.sidebar.checkbox("⏱️ Show rerun timings", key="show_rerun_trace")
+    rerun_outcome = "ok"
+except Exception:
+    rerun_outcome = "error"
+    raise
+finally:
+    rerun_event = finish_rerun_trace(rerun_outcome)
+if rerun_event is not None and st.session_state.get('show_rerun_trace'):
+    rerun_trace_panel(rerun_event)
@@ -0,0 +1,136 @@
+"""Generate synthetic customer portfolios and call logs for benchmarking.
+
+Writes ``sample_customers.csv`` and ``call_log.csv`` in the layout
+calist.py reads, at any scale from a few rows to millions:
+
+    python generate_data.py --customers 100000 --calls 500000 --rms 40 --out bench_data
+"""
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ["Sok", "Sokh", "Dara", "Bopha", "Chan", "Srey", "Vannak", "Sothy", "Ratha", "Sophea",
+               "Khem", "Piseth", "Sreymom", "Kosal", "Chenda", "Rith", "Sovann", "Nary", "Vuthy", "Leakhena",
+               "Mony", "Thida", "Visal", "Sopheak", "Chantha", "Samnang", "Kanha", "Borey", "Rachana", "Makara"]
+LAST_NAMES = ["Phal", "Oeurn", "Chen", "Tan", "Kim", "Heng", "Mom", "Nguyen", "Lim", "Ly", "Chea", "Keo",
+              "Meas", "Pich", "Sam", "Seng", "Touch", "Yim", "Chhay", "Chhun", "Kong", "Long", "Nhem", "Ouk"]
+BUSINESSES = ["Grocery Store", "Coffee Shop", "Phone Repair", "Clothing Shop", "Motorcycle Repair",
+              "Construction Supplies", "Electronics Store", "Restaurant", "Fruit Vendor", "Beauty Salon",
+              "Pharmacy", "Hardware Store", "Bakery", "Tailor", "Printing Shop", "Car Wash", "Mini Mart"]
+PHONE_PREFIXES = ["010", "011", "012", "015", "016", "017", "069", "070", "077", "078", "085", "086",
+                  "087", "089", "092", "093", "095", "096", "097", "098", "099"]
+POTENTIALS = (["H", "M", "L"], [2, 5, 3])
+STATUSES = (["New Lead", "Pending", "Completed", "Missed", "Callback", "Not Interested"], [25, 35, 20, 10, 6, 4])
+OUTCOMES = (["Completed", "Missed", "Callback", "Not Interested"], [55, 25, 15, 5])
+NOTES = ["", "", "", "Interested in a business loan", "Asked to call back next week",
+         "Wants information on savings accounts", "Busy, try again later", "Discussed KHQR payments"]
+
+CUSTOMER_COLUMNS = ["id", "name", "business", "phone", "email", "potential", "status",
+                    "last_contact", "call_count", "rm_code", "callback_due"]
+CALL_LOG_COLUMNS = ["customer_id", "customer", "date", "outcome", "notes"]
+
+
+def phone_number(rng, serial):
+    """Unique per serial, written in the mixed styles RMs actually type"""
+    prefix = rng.choice(PHONE_PREFIXES)
+    digits = f"{serial % 1_000_000:06d}"
+    style = rng.random()
+    if style < 0.7:
+        return f"{prefix} {digits[:3]} {digits[3:]}"
+    if style < 0.85:
+        return f"{prefix}-{digits[:3]}-{digits[3:]}"
+    return f"+855 {prefix[1:]} {digits[:3]} {digits[3:]}"
+
+
+def generate_customers(path, count, rms, days, rng, chunk=50_000):
+    """Stream ``count`` customers to ``path``; returns their names for the call log"""
+    today = datetime.now()
+    names = []
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CUSTOMER_COLUMNS)
+        rows = []
+        for customer_id in range(1, count + 1):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            names.append(name)
+            business = rng.choice(BUSINESSES)
+            if rng.random() < 0.4:
+                business = f"{name.split()[0]} {business}"
+            status = rng.choices(*STATUSES)[0]
+            # Callbacks fall due between a few days ago and a week ahead, on the quarter hour
+            callback_due = ""
+            if status == "Callback":
+                due = today + timedelta(minutes=15 * rng.randint(-4 * 24 * 3, 4 * 24 * 7))
+                callback_due = due.replace(minute=due.minute // 15 * 15).strftime("%Y-%m-%d %H:%M")
+            rows.append([
+                customer_id,
+                name,
+                business,
+                phone_number(rng, customer_id),
+                f"{name.lower().replace(' ', '.')}{customer_id}@email.com" if rng.random() < 0.6 else "",
+                rng.choices(*POTENTIALS)[0],
+                status,
+                (today - timedelta(days=rng.randint(0, days))).strftime("%Y-%m-%d"),
+                rng.randint(0, 12),
+                f"{rng.randint(1, rms):03d}",
+                callback_due,
+            ])
+            if len(rows) >= chunk:
+                writer.writerows(rows)
+                rows = []
+        writer.writerows(rows)
+    return names
+
+
+def generate_calls(path, count, names, days, rng, chunk=50_000):
+    """Stream ``count`` calls to ``path`` in chronological order"""
+    start = datetime.now() - timedelta(days=days)
+    step = timedelta(days=days) / max(count, 1)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CALL_LOG_COLUMNS)
+        rows = []
+        for i in range(count):
+            customer_id = rng.randint(1, len(names))
+            rows.append([
+                customer_id,
+                names[customer_id - 1],
+                (start + step * i).strftime("%Y-%m-%d %H:%M"),
+                rng.choices(*OUTCOMES)[0],
+                rng.choice(NOTES),
+            ])
+            if len(rows) >= chunk:
+                writer.writerows(rows)
+                rows = []
+        writer.writerows(rows)
+
+
+def generate(out_dir, customers, calls, rms, days=365, seed=42):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    # Changes journaled against an earlier customer file would be replayed onto the new one
+    journal = os.path.join(out_dir, "sample_customers.csv.journal")
+    if os.path.exists(journal):
+        os.remove(journal)
+    names = generate_customers(os.path.join(out_dir, "sample_customers.csv"), customers, rms, days, rng)
+    generate_calls(os.path.join(out_dir, "call_log.csv"), calls, names, days, rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=1_000, help="number of customers (default 1000)")
+    parser.add_argument("--calls", type=int, default=None, help="number of calls (default 5 per customer)")
+    parser.add_argument("--rms", type=int, default=20, help="number of RM codes, 001..NNN (default 20)")
+    parser.add_argument("--days", type=int, default=365, help="history span in days (default 365)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_data", help="output directory (default bench_data)")
+    args = parser.parse_args()
+    calls = args.customers * 5 if args.calls is None else args.calls
+    generate(args.out, args.customers, calls, args.rms, args.days, args.seed)
+    print(f"Wrote {args.customers:,} customers and {calls:,} calls for {args.rms} RMs to {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
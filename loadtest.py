@@ -0,0 +1,526 @@
+"""Multi-session load test of calist.py.
+
+Simulates several RMs using the app at once. Every session logs in
+(as RM 001, the only code the demo login accepts) and repeats a
+scripted flow: search the directory, pick a customer to call, log the
+call, view Performance, then open a customer's call history. Each interaction is one rerun; the report gives
+p50/p95/p99 rerun latency per step and overall, throughput, and memory
+per session:
+
+    python loadtest.py --sessions 10 --rounds 5 --customers 10000
+    python loadtest.py --mode server --sessions 25 --rounds 10 --customers 100000
+    python loadtest.py --mode server --url http://localhost:8501 --server-pid 4242 --sessions 25
+
+``--mode apptest`` (default) drives the sessions through Streamlit's
+AppTest harness in this process, so they share the process-wide caches
+just as in one server process. AppTest runs one script at a time, so
+the sessions take turns: latency has no contention and throughput is
+what one busy thread can serve.
+
+``--mode server`` connects to a real ``streamlit run`` server over its
+websocket, the way browser tabs do, with every session in its own
+thread. Buttons inside fragments rerun just their fragment. Without
+``--url`` a server is started on generated data. Timers that a browser
+would run (the callback nudge, the live call panel) are not simulated.
+
+Memory per session is how much the app process's resident set grew
+after a warm-up session, divided by the number of sessions. With
+``--url`` it is only measured when ``--server-pid`` is given. Results
+are written as JSON. The exit status is 1 if any flow skipped selecting
+or logging a call, so the write path went untested, or, with
+``--baseline``, if overall p95 latency grew, or throughput fell, by
+more than ``--threshold``.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+import streamlit as st
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from streamlit.testing.v1 import AppTest
+
+import benchmark
+
+try:
+    from websockets.sync.client import connect
+except ImportError:  # older Streamlit releases ship tornado instead; only --mode server needs it
+    connect = None
+
+CUSTOMER_LIST_TAB = "📋 Customer List"
+DIRECTORY_TAB = "📋 Customer Directory"
+STEPS = ["login", "search", "search_clear", "call_select", "make_calls_tab", "log_call", "performance_tab",
+         "customer_list_tab", "history", "history_tab", "directory_tab"]
+WRITE_STEPS = ["call_select", "log_call"]  # a run that skipped any of these never exercised the write path
+SERVER_START_SECONDS = 60  # how long a started server may take to answer its health check
+
+
+# Sessions. Both kinds offer the same actions, each one rerun, returning milliseconds.
+class AppTestSession:
+    """One simulated RM driven through the AppTest harness"""
+
+    def __init__(self, app_path, timeout):
+        self.at = AppTest.from_file(app_path, default_timeout=timeout)
+        self.tabs = {}
+        self._run(self.at.run)
+
+    def login(self, username, rm_code):
+        self.at.text_input[0].input(username)
+        self.at.text_input[1].input(rm_code)
+        elapsed = self._run(benchmark.login_button(self.at).click().run)
+        if not self.at.session_state["logged_in"]:
+            raise RuntimeError(f"login as RM {rm_code} was refused")
+        return elapsed
+
+    def type_text(self, key, text):
+        return self._run(self.at.text_input(key=key).input(text).run)
+
+    def button_keys(self, prefix):
+        return [b.key for b in benchmark.buttons(self.at, prefix)]
+
+    def has_button(self, label):
+        return any(label in b.label for b in self.at.button)
+
+    def click(self, key):
+        return self._run(self.at.button(key=key).click().run)
+
+    def click_label(self, label):
+        return self._run(next(b for b in self.at.button if label in b.label).click().run)
+
+    def open_tab(self, main_tab=None, customer_tab=None):
+        if main_tab:
+            self.tabs["main_tab"] = main_tab
+        if customer_tab:
+            self.tabs["customer_tab"] = customer_tab
+        return self._run(self.at.run)
+
+    def _run(self, run):
+        # AppTest forgets tab selections between runs; a browser keeps them
+        for key, label in self.tabs.items():
+            self.at.session_state[key] = label
+        return benchmark.timed(run)
+
+
+class ServerSession:
+    """One simulated RM talking to a Streamlit server like a browser tab.
+
+    Keeps the widget values it has set and sends them with every rerun
+    request, and remembers the widgets the last run rendered so later
+    actions can find them by key or label.
+    """
+
+    def __init__(self, ws, timeout):
+        self.ws = ws
+        self.timeout = timeout
+        self.page_script_hash = ""
+        self.values = {}  # widget id -> WidgetState sent with every rerun
+        self.widgets = []  # (kind, id, label, fragment id) rendered by the last run
+        self.tab_ids = {}  # tabs key -> widget id, kept while the tabs are hidden
+        self.rerun()
+
+    def login(self, username, rm_code):
+        # Form values only reach the server when the form is submitted
+        for label, value in (("Username", username), ("RM Code", rm_code)):
+            widget_id = self._find("text_input", label=label)[1]
+            self.values[widget_id] = WidgetState(id=widget_id, string_value=value)
+        elapsed = self.rerun(self._find("button", label="Login"))
+        if not any(kind == "tab_container" for kind, _, _, _ in self.widgets):
+            raise RuntimeError(f"login as RM {rm_code} was refused")
+        return elapsed
+
+    def type_text(self, key, text):
+        widget_id = self._find("text_input", key=key)[1]
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=text)
+        return self.rerun()
+
+    def button_keys(self, prefix):
+        keys = [user_key(widget_id) for kind, widget_id, _, _ in self.widgets if kind == "button"]
+        return [key for key in keys if key.startswith(prefix)]
+
+    def has_button(self, label):
+        return any(kind == "button" and label in text for kind, _, text, _ in self.widgets)
+
+    def click(self, key):
+        return self.rerun(self._find("button", key=key))
+
+    def click_label(self, label):
+        return self.rerun(self._find("button", label=label))
+
+    def open_tab(self, main_tab=None, customer_tab=None):
+        for key, label in (("main_tab", main_tab), ("customer_tab", customer_tab)):
+            if label:
+                widget_id = self.tab_ids.get(key) or self._find("tab_container", key=key)[1]
+                self.values[widget_id] = WidgetState(id=widget_id, string_value=label)
+        return self.rerun()
+
+    def rerun(self, trigger=None):
+        """Request a rerun, clicking ``trigger`` (a rendered button), and wait until it finishes"""
+        msg = BackMsg()
+        msg.rerun_script.page_script_hash = self.page_script_hash
+        msg.rerun_script.widget_states.widgets.extend(self.values.values())
+        fragment_id = ""
+        if trigger is not None:
+            _, widget_id, _, fragment_id = trigger
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=widget_id, trigger_value=True))
+            msg.rerun_script.fragment_id = fragment_id
+        started = time.perf_counter()
+        self.ws.send(msg.SerializeToString())
+        rendered = []
+        while True:
+            reply = ForwardMsg()
+            reply.ParseFromString(self.ws.recv(timeout=self.timeout))
+            kind = reply.WhichOneof("type")
+            if kind == "new_session":
+                # Sent as every run starts, including the one an st.rerun() asks for
+                self.page_script_hash = reply.new_session.page_script_hash
+                rendered = []
+            elif kind == "delta":
+                rendered.extend(self._widgets(reply.delta))
+            elif kind == "script_finished":
+                status = reply.script_finished
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("app failed to compile")
+                if status != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    break
+        elapsed = (time.perf_counter() - started) * 1000
+        if fragment_id:
+            # Only the fragment was redrawn; everything else is still on the page
+            rendered = [w for w in self.widgets if w[3] != fragment_id] + rendered
+        self.widgets = rendered
+        for kind, widget_id, _, _ in rendered:
+            if kind == "tab_container":
+                self.tab_ids[user_key(widget_id)] = widget_id
+        return elapsed
+
+    def _widgets(self, delta):
+        if delta.WhichOneof("type") == "new_element":
+            element = delta.new_element
+            kind = element.WhichOneof("type")
+            if kind == "exception":
+                raise RuntimeError(f"app raised: {element.exception.message}")
+            proto = getattr(element, kind)
+            if getattr(proto, "id", ""):
+                yield kind, proto.id, getattr(proto, "label", ""), delta.fragment_id
+        elif delta.WhichOneof("type") == "add_block" and delta.add_block.WhichOneof("type") == "tab_container":
+            yield "tab_container", delta.add_block.tab_container.id, "", delta.fragment_id
+
+    def _find(self, kind, key=None, label=None):
+        for widget in self.widgets:
+            if widget[0] != kind:
+                continue
+            if key is not None and user_key(widget[1]) == key:
+                return widget
+            if label is not None and label in widget[2]:
+                return widget
+        raise LookupError(f"no {kind} {key or label!r} on the page")
+
+
+def user_key(widget_id):
+    """The ``key=`` a widget was created with; generated ids end with it ("$$ID-<hash>-<key>")"""
+    return widget_id.split("-", 2)[-1]
+
+
+@contextlib.contextmanager
+def server_session(url, timeout):
+    endpoint = url.replace("http", "ws", 1).rstrip("/") + "/_stcore/stream"
+    with connect(endpoint, subprotocols=["streamlit"], max_size=None, open_timeout=timeout) as ws:
+        yield ServerSession(ws, timeout)
+
+
+# Scripted flow
+def run_flow(session, rng, record, skip):
+    """One pass of the RM's routine; every action is timed as its own step.
+
+    A search that matches nobody is cleared, so the customer to call and
+    the history to open come from the whole directory; a step that still
+    finds nothing to click is counted as skipped.
+    """
+    record("search", session.type_text("search_main", rng.choice(benchmark.SEARCH_TERMS)))
+    calls = session.button_keys("call_")
+    if not calls:
+        record("search_clear", session.type_text("search_main", ""))
+        calls = session.button_keys("call_")
+    if calls:
+        record("call_select", session.click(rng.choice(calls)))
+    else:
+        skip("call_select")
+    record("make_calls_tab", session.open_tab(benchmark.MAKE_CALLS_TAB))
+    if session.has_button("Log Call"):
+        record("log_call", session.click_label("Log Call"))
+    else:
+        skip("log_call")
+    record("performance_tab", session.open_tab(benchmark.PERFORMANCE_TAB))
+    record("customer_list_tab", session.open_tab(CUSTOMER_LIST_TAB, DIRECTORY_TAB))
+    histories = session.button_keys("history_")
+    if histories:
+        record("history", session.click(rng.choice(histories)))
+    else:
+        skip("history")
+    record("history_tab", session.open_tab(customer_tab=benchmark.HISTORY_TAB))
+    record("directory_tab", session.open_tab(customer_tab=DIRECTORY_TAB))
+
+
+class Recorder:
+    """Latencies per step from every session; thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.times = {}
+        self.skipped = {}  # step -> flows that found nothing to click for it
+        self.errors = []
+
+    def session(self):
+        def record(step, ms):
+            with self._lock:
+                self.times.setdefault(step, []).append(ms)
+        return record
+
+    def skip(self, step):
+        with self._lock:
+            self.skipped[step] = self.skipped.get(step, 0) + 1
+
+    def error(self, session_no, e):
+        with self._lock:
+            self.errors.append(f"session {session_no}: {e!r}")
+
+
+def run_apptest(app_path, args, recorder):
+    """Sessions take turns: one flow each per round"""
+    sessions = []
+    for i in range(args.sessions):
+        session = AppTestSession(app_path, args.timeout)
+        recorder.session()("login", session.login(f"load{i}", benchmark.RM_CODE))
+        sessions.append((i, session, random.Random(args.seed + i), recorder.session()))
+    for _ in range(args.rounds):
+        for i, session, rng, record in sessions:
+            try:
+                run_flow(session, rng, record, recorder.skip)
+            except Exception as e:
+                recorder.error(i, e)
+    return len(sessions)
+
+
+def run_server(url, args, recorder):
+    """Every session in its own thread, starting ``--ramp`` seconds apart at most"""
+    def simulate(i):
+        rng = random.Random(args.seed + i)
+        record = recorder.session()
+        time.sleep(rng.uniform(0, args.ramp))
+        try:
+            with server_session(url, args.timeout) as session:
+                record("login", session.login(f"load{i}", benchmark.RM_CODE))
+                for _ in range(args.rounds):
+                    run_flow(session, rng, record, recorder.skip)
+                    time.sleep(rng.uniform(0, 2 * args.think))
+        except Exception as e:
+            recorder.error(i, e)
+
+    threads = [threading.Thread(target=simulate, args=(i,), name=f"rm-{i}") for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(threads)
+
+
+# Server process
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, port, log_path):
+    command = [sys.executable, "-m", "streamlit", "run", "calist.py", "--server.headless", "true",
+               "--server.port", str(port), "--server.fileWatcherType", "none",
+               "--browser.gatherUsageStats", "false"]
+    with open(log_path, "w", encoding="utf-8") as log:
+        server = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/_stcore/health", timeout=2) as response:
+                if response.status == 200:
+                    return server, url
+        except OSError:
+            time.sleep(0.5)
+        if server.poll() is not None:
+            break
+    server.kill()
+    raise RuntimeError(f"streamlit server did not start, see {log_path}")
+
+
+def rss_mb(pid=None):
+    """Resident set size of a process (this one by default) in MB, or None where /proc is missing"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# Report
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))], 2)
+
+    return {"runs": len(ordered), "p50_ms": at(0.5), "p95_ms": at(0.95), "p99_ms": at(0.99),
+            "max_ms": round(ordered[-1], 2)}
+
+
+def compare(report, baseline, threshold):
+    """Print overall p95 and throughput against an earlier run; returns what regressed"""
+    regressions = []
+    checks = [("p95 latency", report["overall"]["p95_ms"], baseline["overall"]["p95_ms"], 1),
+              ("throughput", report["throughput_per_s"], baseline["throughput_per_s"], -1)]
+    for name, new, old, direction in checks:
+        if not old:
+            continue
+        change = (new - old) / old
+        flag = " REGRESSION" if direction * change > threshold else ""
+        print(f"{name:<12} {old:>10.1f} -> {new:>10.1f} ({change:+.0%}){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["apptest", "server"], default="apptest")
+    parser.add_argument("--sessions", type=int, default=10, help="simulated RMs (default 10)")
+    parser.add_argument("--rounds", type=int, default=3, help="flows per session after login (default 3)")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="server mode: mean seconds a session pauses between flows (default 0)")
+    parser.add_argument("--ramp", type=float, default=0.0,
+                        help="server mode: sessions start at random within this many seconds (default 0)")
+    parser.add_argument("--url", help="server mode: an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid of the --url server, to measure its memory")
+    parser.add_argument("--customers", type=int, default=10_000, help="customers in the generated data")
+    parser.add_argument("--calls-per-customer", type=int, default=5)
+    parser.add_argument("--rms", type=int, default=20, help="RM codes in the generated data")
+    parser.add_argument("--storage", choices=["csv", "sqlite"], default="csv")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds allowed per rerun")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="loadtest_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression threshold (default 0.2 = 20%%)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated work directory")
+    args = parser.parse_args()
+    if args.mode == "server" and connect is None:
+        parser.error("--mode server needs the websockets package")
+
+    os.environ["CALL_SYSTEM_STORAGE"] = args.storage
+    workdir, server, url = None, None, args.url
+    if url is None:
+        calls = args.customers * args.calls_per_customer
+        workdir = benchmark.prepare_workdir(args.customers, calls, args.rms, args.seed)
+        os.environ["CALL_SYSTEM_DB"] = os.path.join(workdir, "call_system.db")
+        print(f"{args.customers:,} customers / {calls:,} calls ({args.storage}) in {workdir}", flush=True)
+    recorder = Recorder()
+    try:
+        if args.mode == "server":
+            pid = args.server_pid
+            if url is None:
+                server, url = start_server(workdir, free_port(), os.path.join(workdir, "server.log"))
+                pid = server.pid
+            # A warm-up session loads the shared data, so memory growth after it is per session
+            with server_session(url, args.timeout) as warmup:
+                warmup.login("warmup", benchmark.RM_CODE)
+            rss_before = rss_mb(pid) if pid else None
+            started = time.perf_counter()
+            sessions = run_server(url, args, recorder)
+            elapsed = time.perf_counter() - started
+            rss_after = rss_mb(pid) if pid else None
+        else:
+            app_path = os.path.join(workdir, "calist.py")
+            AppTestSession(app_path, args.timeout).login("warmup", benchmark.RM_CODE)
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            sessions = run_apptest(app_path, args, recorder)
+            elapsed = time.perf_counter() - started
+            rss_after = rss_mb()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if workdir is not None and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    all_samples = [ms for samples in recorder.times.values() for ms in samples]
+    if not all_samples:
+        sys.exit("no rerun completed: " + "; ".join(recorder.errors[:3]))
+    steps = {step: percentiles(recorder.times[step]) for step in STEPS if step in recorder.times}
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": benchmark.git_revision(),
+            "python": sys.version.split()[0],
+            "streamlit": st.__version__,
+            "mode": args.mode,
+            "storage": args.storage,
+            "customers": args.customers if args.url is None else None,
+            "sessions": args.sessions,
+            "rounds": args.rounds,
+            "think": args.think,
+        },
+        "steps": steps,
+        "overall": percentiles(all_samples),
+        "seconds": round(elapsed, 2),
+        "throughput_per_s": round(len(all_samples) / elapsed, 2),
+        "rss_before_mb": rss_before,
+        "rss_after_mb": rss_after,
+        "rss_per_session_mb": (round((rss_after - rss_before) / sessions, 2)
+                               if rss_before is not None and rss_after is not None and sessions else None),
+        "skipped": recorder.skipped,
+        "write_path_skipped": sum(recorder.skipped.get(step, 0) for step in WRITE_STEPS),
+        "errors": recorder.errors,
+    }
+
+    print(f"{'step':<18}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, row in list(steps.items()) + [("overall", report["overall"])]:
+        print(f"{step:<18}{row['runs']:>6}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    print(f"{len(all_samples)} reruns by {sessions} sessions in {elapsed:.1f} s: "
+          f"{report['throughput_per_s']:.1f} reruns/s")
+    if report["rss_per_session_mb"] is not None:
+        print(f"memory {rss_before} -> {rss_after} MB, {report['rss_per_session_mb']} MB per session")
+    for step, count in recorder.skipped.items():
+        print(f"skipped: {step} in {count} flow(s), nothing to click")
+    for error in recorder.errors:
+        print("error:", error)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    failed = False
+    if report["write_path_skipped"]:
+        # Without the call writes the latencies are for a read-only workload
+        print(f"FAILED: {report['write_path_skipped']} write step(s) skipped")
+        failed = True
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Parallel call log scans for the call rollups and branch scorecards.
+
+calist.py splits the call log into independent scan tasks (one per
+call log partition, or one per month of the SQLite ``calls`` table) and
+hands them to worker processes, which import this module by name. Each
+worker reads only the columns it needs, assigns every call to its
+customer's RM and potential tier, and returns small per-RM counts plus
+a mark of how far it read; the parent merges the counts into its call
+rollups and continues from the marks:
+
+    parts = pool.map(count_calls, tasks, ...)
+    counts = merge_counts(counts for counts, _ in parts)
+    cards, daily = build_scorecards(counts, customers, today, days)
+
+Calls without a customer id (very old log rows) are placed by customer
+name when exactly one customer has it, like the app's call history;
+calls of merged customers are placed on the customer they were merged
+into.
+"""
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: readers fall back to no locking
+    fcntl = None
+
+CALL_COLUMNS = ["customer_id", "customer", "date", "outcome"]
+COUNT_COLUMNS = ["rm_code", "potential", "day", "outcome"]
+TIERS = ["H", "M", "L"]
+UNREACHED_OUTCOMES = ["Missed"]  # calls that did not reach the customer
+OPEN_LEAD_STATUSES = ["New Lead", "Pending", "Callback", "Missed"]
+STALE_LEAD_DAYS = [7, 30, 90]  # open leads untouched for longer than each bound are counted as stale
+
+
+def read_task(task, start=None):
+    """(calls, mark) for one scan task.
+
+    ``calls`` holds customer_id, customer, date and outcome; ``mark`` says
+    how far the task read, so the rows appended afterwards can be read on
+    their own: ("seq", last seq) for SQLite, ("partition", key, rows,
+    CSV name, CSV inode, CSV bytes) for a call log partition.
+    """
+    if task[0] == "sqlite":
+        _, path, low, high, through = task
+        where, params = ["date >= ?", "seq <= ?"], [max(low, start or ""), through]
+        if high is not None:
+            where.append("date < ?")
+            params.append(high)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+        try:
+            calls = pd.read_sql_query(f"SELECT {', '.join(CALL_COLUMNS)} FROM calls WHERE {' AND '.join(where)}",
+                                      conn, params=params, dtype=str)
+        finally:
+            conn.close()
+        return calls.fillna(""), ("seq", through)
+
+    _, manifest_path, key, lock_path = task
+    frames = []
+    csv_name, csv_inode, csv_bytes = None, None, 0
+    lock = open(lock_path, "a") if fcntl is not None else None
+    try:
+        # Under the shared lock no append or compression rewrite is halfway, and the
+        # manifest names the partition's current files (its CSV may have become Parquet)
+        if lock is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_SH)
+        with open(manifest_path, encoding="utf-8") as f:
+            entry = json.load(f)['partitions'].get(key, {})
+        root = os.path.dirname(manifest_path)
+        if entry.get('parquet'):
+            frames.append(pd.read_parquet(os.path.join(root, entry['parquet']), columns=CALL_COLUMNS))
+        path = os.path.join(root, entry['csv']) if entry.get('csv') else None
+        if path is not None and os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as f:
+                stat = os.fstat(f.fileno())
+                csv_name, csv_inode, csv_bytes = entry['csv'], stat.st_ino, stat.st_size
+                if stat.st_size:
+                    frames.append(pd.read_csv(f, dtype=str, keep_default_na=False,
+                                              usecols=lambda c: c in CALL_COLUMNS))
+    finally:
+        if lock is not None:
+            lock.close()
+    frames = [f.reindex(columns=CALL_COLUMNS, fill_value="").fillna("").astype(str) for f in frames]
+    calls = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=CALL_COLUMNS)
+    mark = ("partition", key, len(calls), csv_name, csv_inode, csv_bytes)
+    return (calls[calls['date'] >= start] if start else calls), mark
+
+
+def customer_lookup(customers, aliases=None):
+    """What place_calls() needs from a customer frame, as plain arrays a worker can receive.
+
+    ``aliases`` maps the ids of merged customers to the customer they were
+    merged into; their calls count for that customer.
+    """
+    unique = np.flatnonzero(~customers['name'].duplicated(keep=False).to_numpy())
+    ids = customers['id'].to_numpy()
+    rm_codes = customers['rm_code'].astype(str).to_numpy(dtype=object)
+    potentials = customers['potential'].astype(str).to_numpy(dtype=object)
+    if aliases:
+        targets = pd.Index(ids).get_indexer(list(aliases.values()))
+        found = targets >= 0
+        ids = np.concatenate([ids, np.array(list(aliases), dtype=ids.dtype)[found]])
+        rm_codes = np.concatenate([rm_codes, rm_codes[targets[found]]])
+        potentials = np.concatenate([potentials, potentials[targets[found]]])
+    return ids, rm_codes, potentials, customers['name'].astype(str).to_numpy(dtype=object)[unique], unique
+
+
+def place_calls(calls, lookup):
+    """Each call's position in the customer arrays, or -1.
+
+    Calls logged without a customer id are placed by name when exactly
+    one customer has it.
+    """
+    customer_ids, _, _, unique_names, unique_positions = lookup
+    ids = pd.to_numeric(calls['customer_id'], errors='coerce').to_numpy()
+    positions = pd.Index(customer_ids).get_indexer(ids)
+    unplaced = positions < 0
+    if unplaced.any():
+        matches = pd.Index(unique_names).get_indexer(calls['customer'].to_numpy()[unplaced])
+        found = matches >= 0
+        matches[found] = unique_positions[matches[found]]
+        positions[unplaced] = matches
+    return positions
+
+
+def group_calls(calls, positions, lookup):
+    """Calls per (rm_code, potential, day, outcome), skipping unplaced ones"""
+    _, rm_codes, potentials, _, _ = lookup
+    known = positions >= 0
+    frame = pd.DataFrame({
+        "rm_code": rm_codes[positions[known]],
+        "potential": potentials[positions[known]],
+        "day": calls['date'].str[:10].to_numpy()[known],
+        "outcome": calls['outcome'].to_numpy()[known],
+    })
+    return frame.groupby(COUNT_COLUMNS, sort=False).size().rename("calls").reset_index()
+
+
+def count_calls(task, start, lookup):
+    """(counts, mark) for one scan task; the worker entry point"""
+    calls, mark = read_task(task, start)
+    return group_calls(calls, place_calls(calls, lookup), lookup), mark
+
+
+def merge_counts(parts):
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return pd.DataFrame({**{c: pd.Series(dtype=object) for c in COUNT_COLUMNS}, "calls": pd.Series(dtype="int64")})
+    return pd.concat(parts, ignore_index=True).groupby(COUNT_COLUMNS, as_index=False)['calls'].sum()
+
+
+def percent(part, whole):
+    """Rounded percentages, blank where ``whole`` is zero"""
+    return (100 * part / whole.replace(0, np.nan)).round(1)
+
+
+def stale_leads(customers, today):
+    """Open leads per RM by days since last contact, one column per STALE_LEAD_DAYS bound"""
+    leads = customers[customers['status'].isin(OPEN_LEAD_STATUSES)]
+    last = pd.to_datetime(leads['last_contact'], format="%Y-%m-%d", errors='coerce')
+    # Leads never contacted, or with unreadable dates, are as stale as it gets
+    days = (pd.Timestamp(today) - last).dt.days.fillna(np.inf).to_numpy()
+    bounds = STALE_LEAD_DAYS + [np.inf]
+    stale = pd.DataFrame(index=leads['rm_code'].astype(str).unique())
+    for low, high in zip(bounds, bounds[1:]):
+        label = f"Stale {low + 1}–{high} d" if high != np.inf else f"Stale >{low} d"
+        mask = (days > low) & (days <= high)
+        stale[label] = leads['rm_code'].astype(str)[mask].value_counts()
+    return stale.fillna(0).astype(int)
+
+
+def build_scorecards(counts, customers, today, days=None):
+    """(one row per RM, calls per day with one column per RM) from merged counts.
+
+    ``days`` is the report period ending ``today``; for all time it runs
+    from the first dated call.
+    """
+    if days is None:
+        dated = counts['day'][counts['day'] != ""]
+        first = datetime.strptime(dated.min(), "%Y-%m-%d").date() if len(dated) else today
+        days = max((today - first).days + 1, 1)
+    start = (today - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+    customers_per_rm = customers['rm_code'].astype(str).value_counts()
+    calls = counts.groupby('rm_code')['calls'].sum()
+    cards = pd.DataFrame(index=customers_per_rm.index.union(calls.index))
+    cards["Customers"] = customers_per_rm
+    cards["Calls"] = calls
+    cards = cards.fillna(0).astype(int)
+    cards["Calls / day"] = (cards["Calls"] / days).round(1)
+
+    # Outcome mix, then the share of calls that reached the customer, overall and per tier
+    outcomes = counts.pivot_table(index='rm_code', columns='outcome', values='calls', aggfunc='sum', fill_value=0)
+    for outcome in outcomes.columns:
+        cards[f"{outcome or 'No outcome'} %"] = percent(outcomes[outcome], cards["Calls"])
+    reached = counts[~counts['outcome'].isin(UNREACHED_OUTCOMES)]
+    cards["Contact rate %"] = percent(reached.groupby('rm_code')['calls'].sum(), cards["Calls"])
+    for tier in TIERS:
+        tier_calls = counts[counts['potential'] == tier].groupby('rm_code')['calls'].sum()
+        tier_reached = reached[reached['potential'] == tier].groupby('rm_code')['calls'].sum()
+        cards[f"Contact rate {tier} %"] = percent(tier_reached.reindex(tier_calls.index, fill_value=0), tier_calls)
+
+    stale = stale_leads(customers, today)
+    cards = cards.join(stale)
+    cards[stale.columns] = cards[stale.columns].fillna(0).astype(int)
+    cards.index.name = "RM"
+
+    daily = counts[counts['day'] >= start].pivot_table(index='day', columns='rm_code', values='calls',
+                                                       aggfunc='sum', fill_value=0)
+    daily = daily.reindex(pd.date_range(start, today).strftime("%Y-%m-%d"), fill_value=0)
+    return cards.sort_index(), daily